@@ -1,9 +1,22 @@
 import logging
-from pydantic import BaseModel
-from sqlalchemy.orm import Session
-from fastapi import APIRouter, HTTPException, Form, Depends, Request
-from services.chatbot_service import get_openai_response_with_langchain, clear_chat_history, get_db, get_user_chat_history
-from core.bot_history_db import ChatHistory
+from typing import List, Optional
+from pydantic import BaseModel, Field
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import APIRouter, HTTPException, Form, Depends, Request, Header
+from fastapi.responses import StreamingResponse
+from services.chatbot_service import get_openai_response_with_langchain, clear_chat_history, get_async_db, get_user_chat_history, stream_openai_response_with_langchain, stream_batch_answers
+from core.config import settings
+from core.database import get_pool_stats
+from services.sql_agent import refresh_table_info_snapshot, get_schema_cache_status
+from services.answer_cache import get_answer_cache
+from services.query_cache import get_query_cache
+from services.catalog import get_catalog_status
+from services.history_manager import history_stats
+from services.history_writer import get_history_writer
+from services.history_cache import get_history_cache
+from services.tracing import wants_debug_trace, route_stats
+from services.single_flight import get_single_flight
+from services.rate_limiter import get_rate_limiter, get_scheduler, RateLimitExceeded
 
 router = APIRouter(
     prefix="/chatbots",
@@ -17,20 +30,53 @@ class AskQuestionRequest(BaseModel):
     user_id: str
 
 
+class BatchAskRequest(BaseModel):
+    items: List[AskQuestionRequest] = Field(min_length=1)
+    parallelism: Optional[int] = Field(default=None, ge=1)  # defaults to BATCH_MAX_PARALLELISM
+
+
 class ClearChatRequest(BaseModel):
     user_id: str
 
 
 class ChatHistoryRequest(BaseModel):
     user_id: str
+    limit: int = Field(default=10, ge=1, le=100)
+    cursor: Optional[str] = None  # next_cursor from the previous page
+
+
+def verify_admin_key(x_admin_key: str = Header(default=None)):
+    # Closed until a key is configured: the batch endpoint bypasses the per-user rate limits
+    if not settings.ADMIN_API_KEY:
+        raise HTTPException(status_code=503, detail="Admin endpoints are disabled, set ADMIN_API_KEY.")
+    if x_admin_key != settings.ADMIN_API_KEY:
+        raise HTTPException(status_code=403, detail="Invalid admin key.")
+
+
+def too_many_requests(error: RateLimitExceeded):
+    return HTTPException(status_code=429, detail="Too many requests, please retry later.",
+                         headers={"Retry-After": error.retry_after_header})
+
+
+async def enforce_rate_limit(user_id: str):
+    try:
+        await get_rate_limiter().admit(user_id)
+    except RateLimitExceeded as e:
+        raise too_many_requests(e)
 
 
 @router.post("/ask")
 # def ask_question(request: Request, user_question: str = Form(), user_id: str = Form(), db: Session = Depends(get_db)):
-async def ask_question(request: AskQuestionRequest, db: Session = Depends(get_db)):
+async def ask_question(request: AskQuestionRequest, db: AsyncSession = Depends(get_async_db),
+                       x_debug_trace: str = Header(default=None)):
+    await enforce_rate_limit(request.user_id)
     try:
-        return get_openai_response_with_langchain(user_question=request.user_question.strip(), db=db, user_id=request.user_id)
+        return await get_openai_response_with_langchain(user_question=request.user_question.strip(), db=db, user_id=request.user_id,
+                                                        debug_trace=wants_debug_trace(x_debug_trace))
         # return get_openai_response_with_langchain(user_question=user_question.strip(), db=db, user_id=user_id)
+    except RateLimitExceeded as e:
+        # The user's queue for an LLM slot was full or the wait too long
+        raise too_many_requests(e)
     except Exception as e:
         logging.error(f"Error in /ask endpoint: {str(e)}")
         raise HTTPException(
@@ -39,18 +85,33 @@ async def ask_question(request: AskQuestionRequest, db: Session = Depends(get_db
         )
 
 
+@router.post("/ask/stream")
+async def ask_question_stream(request: AskQuestionRequest, x_debug_trace: str = Header(default=None)):
+    await enforce_rate_limit(request.user_id)
+    # Server-Sent Events: progress, token, product_ids, then done (or error)
+    return StreamingResponse(
+        stream_openai_response_with_langchain(user_question=request.user_question.strip(), user_id=request.user_id,
+                                              debug_trace=wants_debug_trace(x_debug_trace)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.post("/ask/batch", dependencies=[Depends(verify_admin_key)])
+async def ask_question_batch(request: BatchAskRequest):
+    if len(request.items) > settings.BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {settings.BATCH_MAX_ITEMS} items per batch.")
+    parallelism = min(request.parallelism or settings.BATCH_MAX_PARALLELISM, settings.BATCH_MAX_PARALLELISM)
+    items = [(item.user_id, item.user_question.strip()) for item in request.items]
+    # NDJSON: one result per item in completion order, then a summary line
+    return StreamingResponse(stream_batch_answers(items, parallelism), media_type="application/x-ndjson")
+
+
 @router.delete("/clear-chat")
-async def clear_chat(request: ClearChatRequest, db: Session = Depends(get_db)):
+async def clear_chat(request: ClearChatRequest, db: AsyncSession = Depends(get_async_db)):
     try:
-        # Check if the user_id exists in the database
-        user_exists = db.query(ChatHistory).filter(ChatHistory.user_id == request.user_id).first() is not None
-        if not user_exists:
-            raise HTTPException(
-                status_code=404,
-                detail=f"No records found for user ID: {request.user_id}."
-            )
-
-        return clear_chat_history(user_id=request.user_id, db=db)
+        # Responds 404 when there was nothing to delete
+        return await clear_chat_history(user_id=request.user_id, db=db)
     except HTTPException as e:
         raise e
     except Exception as e:
@@ -62,16 +123,10 @@ async def clear_chat(request: ClearChatRequest, db: Session = Depends(get_db)):
 
     
 @router.post("/chat-history")
-async def chat_history(request: ChatHistoryRequest, db: Session = Depends(get_db)):
+async def chat_history(request: ChatHistoryRequest, db: AsyncSession = Depends(get_async_db)):
     try:
-        # Check if the user_id exists in the database
-        user_exists = db.query(ChatHistory).filter(ChatHistory.user_id == request.user_id).first() is not None
-        if not user_exists:
-            raise HTTPException(
-                status_code=404,
-                detail=f"No Chat history found for user ID: {request.user_id}."
-            )
-        return get_user_chat_history(user_id=request.user_id, db=db)
+        # Responds 404 when the first page is empty
+        return await get_user_chat_history(user_id=request.user_id, db=db, limit=request.limit, cursor=request.cursor)
     except HTTPException as e:
         raise e
     except Exception as e:
@@ -80,3 +135,84 @@ async def chat_history(request: ChatHistoryRequest, db: Session = Depends(get_db
             status_code=500,
             detail="Internal Server Error, please check the logs."
         )
+
+
+@router.get("/db-pool-stats", dependencies=[Depends(verify_admin_key)])
+async def db_pool_stats():
+    return {"status": True, "message": "Success", "data": get_pool_stats()}
+
+
+@router.get("/admin/schema-cache", dependencies=[Depends(verify_admin_key)])
+async def schema_cache_status():
+    return {"status": True, "message": "Success", "data": get_schema_cache_status()}
+
+
+@router.get("/admin/answer-cache", dependencies=[Depends(verify_admin_key)])
+async def answer_cache_stats():
+    return {"status": True, "message": "Success", "data": get_answer_cache().stats()}
+
+
+@router.delete("/admin/answer-cache", dependencies=[Depends(verify_admin_key)])
+async def clear_answer_cache():
+    get_answer_cache().clear()
+    return {"status": True, "message": "Success"}
+
+
+@router.get("/admin/sql-cache", dependencies=[Depends(verify_admin_key)])
+async def sql_cache_stats():
+    return {"status": True, "message": "Success", "data": get_query_cache().stats()}
+
+
+@router.delete("/admin/sql-cache", dependencies=[Depends(verify_admin_key)])
+async def clear_sql_cache():
+    get_query_cache().clear()
+    return {"status": True, "message": "Success"}
+
+
+@router.get("/admin/catalog", dependencies=[Depends(verify_admin_key)])
+async def catalog_status():
+    # Includes the memory footprint report of the in-memory product catalog
+    return {"status": True, "message": "Success", "data": get_catalog_status()}
+
+
+@router.get("/admin/history-stats", dependencies=[Depends(verify_admin_key)])
+async def history_token_stats():
+    data = history_stats.snapshot()
+    data["write_behind"] = get_history_writer().stats()
+    history_cache = get_history_cache()
+    data["read_cache"] = history_cache.stats() if history_cache is not None else {"enabled": False}
+    return {"status": True, "message": "Success", "data": data}
+
+
+@router.get("/admin/coalescing", dependencies=[Depends(verify_admin_key)])
+async def coalescing_stats():
+    # "coalesced" is the number of agent runs saved by joining an identical in-flight question
+    return {"status": True, "message": "Success", "data": get_single_flight().stats()}
+
+
+@router.get("/admin/rate-limits", dependencies=[Depends(verify_admin_key)])
+async def rate_limit_stats():
+    # Admission (token buckets) and the fair queue in front of the LLM slots of this worker
+    return {"status": True, "message": "Success",
+            "data": {"admission": get_rate_limiter().stats(), "scheduler": get_scheduler().stats()}}
+
+
+@router.get("/admin/routing", dependencies=[Depends(verify_admin_key)])
+async def routing_stats():
+    # Answered questions, average latency and estimated LLM cost per route in this worker
+    return {"status": True, "message": "Success",
+            "data": {"enabled": settings.ROUTING_ENABLED, "light_model": settings.LIGHT_MODEL,
+                     "routes": route_stats.snapshot()}}
+
+
+@router.post("/admin/refresh-schema", dependencies=[Depends(verify_admin_key)])
+def refresh_schema():
+    # Call this after the materialized product view has been rebuilt
+    try:
+        return {"status": True, "message": "Success", "data": refresh_table_info_snapshot()}
+    except Exception as e:
+        logging.error(f"Error in /admin/refresh-schema endpoint: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail="Internal Server Error, please check the logs."
+        )
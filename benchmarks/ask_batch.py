@@ -0,0 +1,114 @@
+"""
+Offline comparison of answering N questions through N sequential /chatbots/ask calls and through one
+/chatbots/ask/batch call, on the same scripted model and SQLite product view as ask_offline.py. Run from the
+repository root:
+
+    python benchmarks/ask_batch.py --items 200 --parallelism 8 --llm-latency 0.2
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+# Every item is answered fresh; with the answer cache the second run would reuse the first run's answers
+os.environ.setdefault("ANSWER_CACHE_ENABLED", "false")
+
+import harness  # sets the app's environment defaults; import before the app
+
+import httpx
+import core.database as database
+import services.chatbot_service as chatbot_service
+import services.history_manager as history_manager
+from core.config import settings
+from services.history_writer import get_history_writer
+from main import app
+
+
+def build_items(questions, count: int, users: int):
+    return [{"user_id": f"batch-{i % users}", "user_question": questions[i % len(questions)]} for i in range(count)]
+
+
+async def run_sequential(client, items):
+    start = time.perf_counter()
+    errors = 0
+    for item in items:
+        response = await client.post("/chatbots/ask", json=item)
+        errors += response.status_code != 200
+    return time.perf_counter() - start, errors
+
+
+async def run_batch(client, items, parallelism: int):
+    start = time.perf_counter()
+    summary = None
+    async with client.stream("POST", "/chatbots/ask/batch", json={"items": items, "parallelism": parallelism},
+                             headers={"X-Admin-Key": settings.ADMIN_API_KEY or ""}) as response:
+        async for line in response.aiter_lines():
+            if not line:
+                continue
+            record = json.loads(line)
+            if record.get("done") is not None:
+                summary = record
+    return time.perf_counter() - start, summary
+
+
+async def run_benchmark(args, model):
+    questions = [recording["question"] for recording in harness.load_recordings(args.recordings)]
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        # Build the schema snapshot, agent and catalog outside the measurements
+        await run_sequential(client, build_items(questions, len(questions), 1))
+
+        sequential_items = build_items(questions, args.items, args.users)
+        sequential_elapsed, sequential_errors = await run_sequential(client, sequential_items)
+        await get_history_writer().flush()
+
+        batch_items = [{"user_id": f"other-{item['user_id']}", "user_question": item["user_question"]}
+                       for item in sequential_items]
+        batch_elapsed, summary = await run_batch(client, batch_items, args.parallelism)
+        await get_history_writer().flush()
+
+    await get_history_writer().stop()
+    await database.dispose_async_engine()
+    database.dispose_engine()
+    return {
+        "items": args.items,
+        "parallelism": args.parallelism,
+        "sequential_elapsed_s": round(sequential_elapsed, 3),
+        "sequential_items_per_s": round(args.items / sequential_elapsed, 2),
+        "sequential_errors": sequential_errors,
+        "batch_elapsed_s": round(batch_elapsed, 3),
+        "batch_items_per_s": round(args.items / batch_elapsed, 2),
+        "batch_failed": summary["failed"] if summary else None,
+        "speedup": round(sequential_elapsed / batch_elapsed, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=200)
+    parser.add_argument("--parallelism", type=int, default=8)
+    parser.add_argument("--users", type=int, default=50, help="distinct user_ids the items are spread over")
+    parser.add_argument("--products", type=int, default=2000, help="rows in the SQLite product view")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="seconds per fake LLM call")
+    parser.add_argument("--recordings", default=harness.DEFAULT_RECORDINGS)
+    args = parser.parse_args()
+
+    model = harness.ScriptedChatModel(recordings=harness.load_recordings(args.recordings), latency=args.llm_latency)
+    chatbot_service.llm = model
+    history_manager._summary_llm = model
+
+    with tempfile.TemporaryDirectory() as directory:
+        settings.SCHEMA_CACHE_PATH = os.path.join(directory, "table_info.json")
+        settings.BATCH_MAX_PARALLELISM = max(settings.BATCH_MAX_PARALLELISM, args.parallelism)
+        harness.setup_sqlite(directory, products=args.products)
+        results = asyncio.run(run_benchmark(args, model))
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
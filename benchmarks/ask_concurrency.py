@@ -0,0 +1,109 @@
+"""
+Measures how many concurrent /chatbots/ask requests one worker can serve.
+
+The OpenAI agent is replaced by a fake one that waits a fixed latency, and chat history and a small product view
+live in local SQLite files, so the benchmark runs offline. Run from the repository root:
+
+    python benchmarks/ask_concurrency.py --requests 40 --concurrency 8 --latency 0.5
+    python benchmarks/ask_concurrency.py --blocking   # simulate the old synchronous agent call
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Every request should reach the (fake) agent, and nothing else should call OpenAI
+os.environ.setdefault("ANSWER_CACHE_ENABLED", "false")
+os.environ.setdefault("FAST_PATH_ENABLED", "false")
+os.environ.setdefault("HISTORY_SUMMARY_ENABLED", "false")
+
+from harness import setup_sqlite  # sets the app's environment defaults; import before the app
+
+import httpx
+import core.database as database
+import services.chatbot_service as chatbot_service
+from main import app
+
+
+class FakeAgent:
+    """
+    Stands in for the AgentExecutor: the service runs it step by step through iter() (services/agent_governor.py);
+    this one takes no tool steps and yields its final output after `latency` seconds.
+    """
+
+    OUTPUT = {"output": "**Product ID: 1** **Product ID: 2** These products suit your needs."}
+
+    def __init__(self, latency: float, blocking: bool):
+        self.latency = latency
+        self.blocking = blocking
+
+    async def _wait(self):
+        if self.blocking:
+            time.sleep(self.latency)
+        else:
+            await asyncio.sleep(self.latency)
+
+    async def ainvoke(self, inputs, config=None, **kwargs):
+        await self._wait()
+        return self.OUTPUT
+
+    async def iter(self, inputs, callbacks=None, **kwargs):
+        await self._wait()
+        yield self.OUTPUT
+
+
+async def run_load(total: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one_request(client, index):
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post("/chatbots/ask", json={
+                "user_question": "best earbuds for the gym",
+                "user_id": f"bench-{index % concurrency}",
+            })
+            latencies.append(time.perf_counter() - start)
+            response.raise_for_status()
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(one_request(client, i) for i in range(total)))
+        elapsed = time.perf_counter() - start
+    return elapsed, sorted(latencies)
+
+
+async def run_benchmark(args):
+    for concurrency in (1, args.concurrency):
+        elapsed, latencies = await run_load(args.requests, concurrency)
+        print(f"concurrency={concurrency:<3} requests={args.requests} elapsed={elapsed:.2f}s "
+              f"throughput={args.requests / elapsed:.2f} req/s "
+              f"p50={latencies[len(latencies) // 2] * 1000:.0f}ms")
+    await database.dispose_async_engine()
+    database.dispose_engine()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.5, help="fake agent latency in seconds")
+    parser.add_argument("--blocking", action="store_true", help="block the event loop like a sync agent call")
+    args = parser.parse_args()
+
+    agent = FakeAgent(args.latency, args.blocking)
+    chatbot_service.get_sql_agent = lambda llm, extra_tools=(): agent
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Routing and the catalog read the product view, though the fake agent never does
+        setup_sqlite(directory, products=50)
+        asyncio.run(run_benchmark(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Offline load test of the full /chatbots/ask stack: the real FastAPI app, agent, fast path, catalog and chat
+history, with gpt-4o replaced by a scripted model (benchmarks/recordings/ask_workload.json) and MySQL replaced by
+a local SQLite copy of the product view. Reports p50/p95/p99 latency, throughput, DB queries per request, LLM
+calls per request and prompt tokens per request. Run from the repository root:
+
+    python benchmarks/ask_offline.py --requests 200 --concurrency 16 --llm-latency 0.2
+    python benchmarks/ask_offline.py --json results.json
+    python benchmarks/ask_offline.py --baseline results.json --max-regression 0.1   # exits 1 on regression
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import harness  # sets the app's environment defaults; import before the app
+
+import httpx
+import core.database as database
+import services.chatbot_service as chatbot_service
+import services.history_manager as history_manager
+from core.config import settings
+from services.history_writer import get_history_writer
+from main import app
+
+# Lower is better for these; throughput is checked separately
+GATED_METRICS = ("p50_ms", "p95_ms", "p99_ms", "db_queries_per_request", "llm_calls_per_request",
+                 "prompt_tokens_per_request")
+
+
+async def run_load(client, questions, total: int, concurrency: int, users: int, endpoint: str):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one_request(index):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post(endpoint, json={
+                "user_question": questions[index % len(questions)],
+                "user_id": f"bench-{index % users}",
+            })
+            if endpoint.endswith("/stream"):
+                await response.aread()
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one_request(i) for i in range(total)))
+    return time.perf_counter() - start, sorted(latencies), errors
+
+
+async def run_benchmark(args, model, queries):
+    questions = [recording["question"] for recording in harness.load_recordings(args.recordings)]
+    endpoint = "/chatbots/ask/stream" if args.stream else "/chatbots/ask"
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        # The first requests build the schema snapshot, agent and catalog; keep them out of the numbers
+        await run_load(client, questions, args.warmup, 1, args.users, endpoint)
+        await get_history_writer().flush()
+
+        queries.reset()
+        model.calls = 0
+        model.prompt_tokens = 0
+        elapsed, latencies, errors = await run_load(client, questions, args.requests, args.concurrency,
+                                                    args.users, endpoint)
+        # Count the write-behind inserts that belong to this run
+        await get_history_writer().flush()
+
+    await get_history_writer().stop()
+    await database.dispose_async_engine()
+    database.dispose_engine()
+    return {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(args.requests / elapsed, 2),
+        "p50_ms": round(harness.percentile(latencies, 0.50) * 1000, 1),
+        "p95_ms": round(harness.percentile(latencies, 0.95) * 1000, 1),
+        "p99_ms": round(harness.percentile(latencies, 0.99) * 1000, 1),
+        "db_queries_per_request": round(queries.count / args.requests, 2),
+        "llm_calls_per_request": round(model.calls / args.requests, 2),
+        "prompt_tokens_per_request": round(model.prompt_tokens / args.requests, 1),
+    }
+
+
+def compare_with_baseline(results, baseline, max_regression: float):
+    """
+    Returns the metrics that got worse than the baseline by more than `max_regression` (a fraction).
+    """
+    regressions = []
+    for metric in GATED_METRICS:
+        if baseline.get(metric) and results[metric] > baseline[metric] * (1 + max_regression):
+            regressions.append(f"{metric}: {baseline[metric]} -> {results[metric]}")
+    if baseline.get("throughput_rps") and results["throughput_rps"] < baseline["throughput_rps"] * (1 - max_regression):
+        regressions.append(f"throughput_rps: {baseline['throughput_rps']} -> {results['throughput_rps']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--users", type=int, default=32, help="distinct user_ids the requests are spread over")
+    parser.add_argument("--warmup", type=int, default=6)
+    parser.add_argument("--products", type=int, default=2000, help="rows in the SQLite product view")
+    parser.add_argument("--history-turns", type=int, default=4, help="earlier turns seeded per user")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="seconds per fake LLM call")
+    parser.add_argument("--recordings", default=harness.DEFAULT_RECORDINGS)
+    parser.add_argument("--stream", action="store_true", help="drive /chatbots/ask/stream instead of /chatbots/ask")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results file of an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.1)
+    args = parser.parse_args()
+
+    model = harness.ScriptedChatModel(recordings=harness.load_recordings(args.recordings), latency=args.llm_latency)
+    chatbot_service.llm = model
+    history_manager._summary_llm = model
+
+    with tempfile.TemporaryDirectory() as directory:
+        settings.SCHEMA_CACHE_PATH = os.path.join(directory, "table_info.json")
+        harness.setup_sqlite(directory, products=args.products)
+        harness.seed_chat_history([f"bench-{i}" for i in range(args.users)], args.history_turns)
+        queries = harness.QueryCounter()
+        queries.attach(database.engine, database.async_engine.sync_engine)
+        results = asyncio.run(run_benchmark(args, model, queries))
+
+    print(json.dumps(results, indent=2))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if results["errors"]:
+        sys.exit(f"{results['errors']} requests failed")
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare_with_baseline(results, json.load(f), args.max_regression)
+        if regressions:
+            sys.exit("Regressed against the baseline:\n  " + "\n  ".join(regressions))
+        print("No regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
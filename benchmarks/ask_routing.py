@@ -0,0 +1,136 @@
+"""
+Offline check of two-tier routing: every user holds a short conversation (a greeting, a product search, a
+follow-up about the products found and a thank-you) over /chatbots/ask. Runs the same conversations with routing
+off (everything goes to gpt-4o and the agent) and on (greetings without an LLM call, small talk and follow-ups on
+the light model), and reports latency, LLM calls and estimated cost per kind of question. gpt-4o and the light
+model are scripted models with their own latency; the cost comes from the token counts on each request's debug
+trace and the prices in services/tracing.py. Run from the repository root:
+
+    python benchmarks/ask_routing.py --users 16 --concurrency 8 --llm-latency 0.4 --light-latency 0.15
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+# Every question should be answered afresh, and the per-request cost is read from the debug trace
+os.environ.setdefault("ANSWER_CACHE_ENABLED", "false")
+os.environ.setdefault("COALESCE_REQUESTS_ENABLED", "false")
+os.environ.setdefault("DEBUG_TRACE_ENABLED", "true")
+
+import harness  # sets the app's environment defaults; import before the app
+
+import httpx
+import core.database as database
+import services.chatbot_service as chatbot_service
+import services.history_manager as history_manager
+import services.question_router as question_router
+from core.config import settings
+from services.history_writer import get_history_writer
+from main import app
+
+FOLLOW_UPS = ["Are they good for calls?", "Which one has the longest battery life?", "Is the first one waterproof?"]
+THANKS = ["thanks!", "Thank you so much, bye", "ok cool"]
+
+
+def conversation(user: int, searches):
+    return [
+        ("greeting", "Hello"),
+        ("search", searches[user % len(searches)]),
+        ("follow_up", FOLLOW_UPS[user % len(FOLLOW_UPS)]),
+        ("thanks", THANKS[user % len(THANKS)]),
+    ]
+
+
+async def run_conversations(client, searches, args, prefix: str):
+    semaphore = asyncio.Semaphore(args.concurrency)
+    samples = {}
+
+    async def one_user(user):
+        async with semaphore:
+            for kind, question in conversation(user, searches):
+                start = time.perf_counter()
+                response = await client.post("/chatbots/ask", headers={"X-Debug-Trace": "1"}, json={
+                    "user_question": question, "user_id": f"{prefix}-{user}"})
+                response.raise_for_status()
+                trace = response.json()["data"]["trace"]
+                samples.setdefault(kind, []).append((time.perf_counter() - start, trace))
+
+    await asyncio.gather(*(one_user(user) for user in range(args.users)))
+    return samples
+
+
+def summarize(samples):
+    results = {}
+    for kind, values in samples.items():
+        latencies = sorted(latency for latency, _ in values)
+        traces = [trace for _, trace in values]
+        routes = {}
+        for trace in traces:
+            routes[trace["route"]] = routes.get(trace["route"], 0) + 1
+        results[kind] = {
+            "routes": routes,
+            "p50_ms": round(harness.percentile(latencies, 0.50) * 1000, 1),
+            "p95_ms": round(harness.percentile(latencies, 0.95) * 1000, 1),
+            "llm_calls_per_request": round(sum(trace["llm_calls"] for trace in traces) / len(traces), 2),
+            "cost_usd_per_1k_requests": round(sum(trace["cost_usd"] for trace in traces) / len(traces) * 1000, 4),
+        }
+    total_cost = sum(trace["cost_usd"] for values in samples.values() for _, trace in values)
+    total_requests = sum(len(values) for values in samples.values())
+    results["all"] = {"cost_usd_per_1k_requests": round(total_cost / total_requests * 1000, 4)}
+    return results
+
+
+async def run_benchmark(args):
+    # Recordings with a fixed answer are greetings
+    searches = [recording["question"] for recording in harness.load_recordings(args.recordings)
+                if not recording.get("answer")]
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        # Build the schema snapshot, agent and catalog outside the measurements
+        for question in searches:
+            await client.post("/chatbots/ask", json={"user_question": question, "user_id": "warmup"})
+        for routing in (False, True):
+            settings.ROUTING_ENABLED = routing
+            samples = await run_conversations(client, searches, args, "routed" if routing else "unrouted")
+            results["routing_on" if routing else "routing_off"] = summarize(samples)
+        await get_history_writer().flush()
+
+    await get_history_writer().stop()
+    await database.dispose_async_engine()
+    database.dispose_engine()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=16, help="conversations, four questions each")
+    parser.add_argument("--concurrency", type=int, default=8, help="conversations in progress at a time")
+    parser.add_argument("--products", type=int, default=2000, help="rows in the SQLite product view")
+    parser.add_argument("--llm-latency", type=float, default=0.4, help="seconds per fake gpt-4o call")
+    parser.add_argument("--light-latency", type=float, default=0.15, help="seconds per fake light model call")
+    parser.add_argument("--recordings", default=harness.DEFAULT_RECORDINGS)
+    args = parser.parse_args()
+
+    recordings = harness.load_recordings(args.recordings)
+    chatbot_service.llm = harness.ScriptedChatModel(recordings=recordings, latency=args.llm_latency)
+    light_model = harness.ScriptedChatModel(recordings=recordings, model_name=settings.LIGHT_MODEL,
+                                            latency=args.light_latency)
+    question_router._light_llm = light_model
+    history_manager._summary_llm = light_model
+
+    with tempfile.TemporaryDirectory() as directory:
+        settings.SCHEMA_CACHE_PATH = os.path.join(directory, "table_info.json")
+        harness.setup_sqlite(directory, products=args.products)
+        results = asyncio.run(run_benchmark(args))
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Cold start of one worker, measured in fresh interpreters on the offline setup of ask_offline.py (scripted model,
+SQLite product view): application import time, time until /ready reports 200, and the latency of the first and
+second agent question, with the startup warm-up enabled and disabled. Run from the repository root:
+
+    python benchmarks/cold_start.py --llm-latency 0.2
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+QUESTION = "compare sony and bose wireless headphones for travel"
+
+
+def measure(args):
+    """
+    Runs in the child interpreter; prints one JSON line.
+    """
+    import asyncio
+    import tempfile
+
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    import harness  # sets the app's environment defaults; import before the app
+
+    start = time.perf_counter()
+    import main
+    import_seconds = time.perf_counter() - start
+
+    import httpx
+    import services.chatbot_service as chatbot_service
+    import services.history_manager as history_manager
+    from core.config import settings
+
+    model = harness.ScriptedChatModel(recordings=harness.load_recordings(), latency=args.llm_latency)
+    chatbot_service.llm = model
+    history_manager._summary_llm = model
+
+    async def run(directory):
+        settings.SCHEMA_CACHE_PATH = os.path.join(directory, "table_info.json")
+        harness.setup_sqlite(directory, products=args.products)
+        transport = httpx.ASGITransport(app=main.app)
+        async with main.app.router.lifespan_context(main.app):
+            async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+                started = time.perf_counter()
+                while (await client.get("/ready")).status_code != 200:
+                    await asyncio.sleep(0.01)
+                ready_seconds = time.perf_counter() - started
+                latencies = []
+                for user_id in ("cold-1", "cold-2"):
+                    start = time.perf_counter()
+                    response = await client.post("/chatbots/ask", json={"user_question": QUESTION, "user_id": user_id})
+                    response.raise_for_status()
+                    latencies.append(time.perf_counter() - start)
+                ready = (await client.get("/ready")).json()["data"]
+        return ready_seconds, latencies, ready["phases_seconds"]
+
+    with tempfile.TemporaryDirectory() as directory:
+        ready_seconds, latencies, phases = asyncio.run(run(directory))
+    print(json.dumps({
+        "import_s": round(import_seconds, 3),
+        "ready_after_s": round(ready_seconds, 3),
+        "first_request_ms": round(latencies[0] * 1000, 1),
+        "second_request_ms": round(latencies[1] * 1000, 1),
+        "warm_up_phases_s": phases,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=2000, help="rows in the SQLite product view")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="seconds per fake LLM call")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        measure(args)
+        return
+
+    results = {}
+    for mode, enabled in (("warm_up", "true"), ("no_warm_up", "false")):
+        # The answer cache would let the second request skip the agent; both requests should run it
+        env = dict(os.environ, WARMUP_ENABLED=enabled, ANSWER_CACHE_ENABLED="false")
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), "--child",
+                                 "--products", str(args.products), "--llm-latency", str(args.llm_latency)],
+                                env=env, capture_output=True, text=True, check=True).stdout
+        results[mode] = json.loads(output.strip().splitlines()[-1])
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
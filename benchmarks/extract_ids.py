@@ -0,0 +1,108 @@
+"""
+Micro-benchmark of product ID extraction: the previous four-regex implementation against the single-pass
+ProductIdStreamParser, on whole answers and on answers fed token by token. Before timing, it checks on random
+answers that feeding any chunking gives the same IDs and text as feeding the whole answer. Run from the
+repository root:
+
+    python benchmarks/extract_ids.py --answers 2000
+"""
+import os
+import re
+import sys
+import json
+import random
+import timeit
+import argparse
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import harness  # sets the app's environment defaults; import before the app
+
+from services.streaming import ProductIdStreamParser
+from services.chatbot_service import extract_product_ids_and_clean_response
+
+WORDS = ["these", "products", "offer", "distinct", "features", "battery", "comfortable", "noise", "cancelling",
+         "budget", "**great**", "value,", "sound.", "fit", "travel", "gym"]
+
+
+def legacy_extract(response_output):
+    # The implementation this replaced, minus its print()
+    product_id_pattern = re.compile(r"\*\*Product ID:\s*(\d+)\*\*")
+    product_ids = product_id_pattern.findall(response_output)
+    cleaned_response = product_id_pattern.sub('', response_output)
+    cleaned_response = re.sub(r'^\s*\**Product ID:\s*\d+\**\s*', '', cleaned_response, flags=re.MULTILINE)
+    cleaned_response = cleaned_response.strip()
+    cleaned_response = re.sub(r'\s{2,}', ' ', cleaned_response)
+    return sorted(product_ids, key=int), cleaned_response
+
+
+def random_answer(rng):
+    ids = [str(rng.randint(1, 5000)) for _ in range(rng.randint(0, 5))]
+    markers = " ".join(f"**Product ID: {product_id}**" for product_id in ids)
+    paragraphs = [" ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 40))) for _ in range(rng.randint(1, 3))]
+    if ids and rng.random() < 0.5:
+        paragraphs.append("\n".join(f"{n}. **Product ID: {product_id}** {rng.choice(WORDS)}"
+                                    for n, product_id in enumerate(ids, 1)))
+    return f"{markers}\n\n" + "\n\n".join(paragraphs)
+
+
+def tokens_of(text: str, rng):
+    pieces, position = [], 0
+    while position < len(text):
+        size = rng.randint(1, 8)
+        pieces.append(text[position:position + size])
+        position += size
+    return pieces
+
+
+def feed_whole(text: str):
+    parser = ProductIdStreamParser()
+    visible, _ = parser.feed(text)
+    return parser.product_ids, (visible + parser.flush()).strip()
+
+
+def feed_tokens(tokens):
+    parser = ProductIdStreamParser()
+    visible = [parser.feed(token)[0] for token in tokens]
+    visible.append(parser.flush())
+    return parser.product_ids, "".join(visible).strip()
+
+
+def check_chunking(answers, rng, rounds: int):
+    for answer in answers:
+        expected = feed_whole(answer)
+        for _ in range(rounds):
+            assert feed_tokens(tokens_of(answer, rng)) == expected, answer
+        product_ids, text = expected
+        assert len(product_ids) == len(set(product_ids))
+        assert "Product ID:" not in text
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--answers", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--check-rounds", type=int, default=20, help="random chunkings checked per answer")
+    args = parser.parse_args()
+
+    rng = random.Random(11)
+    answers = [random_answer(rng) for _ in range(args.answers)]
+    check_chunking(answers[:200], rng, args.check_rounds)
+    tokenized = [tokens_of(answer, rng) for answer in answers]
+
+    def best_us(function, inputs):
+        seconds = min(timeit.repeat(lambda: [function(item) for item in inputs], number=1, repeat=args.repeat))
+        return round(seconds / len(inputs) * 1e6, 2)
+
+    print(json.dumps({
+        "answers": args.answers,
+        "avg_answer_chars": round(sum(map(len, answers)) / len(answers)),
+        "legacy_us_per_answer": best_us(legacy_extract, answers),
+        "single_pass_us_per_answer": best_us(extract_product_ids_and_clean_response, answers),
+        "streamed_us_per_answer": best_us(feed_tokens, tokenized),
+        "streamed_chunks_per_answer": round(sum(map(len, tokenized)) / len(tokenized), 1),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Offline check of the fair scheduler in front of the LLM slots: one noisy user keeps many /chatbots/ask requests in
+flight while regular users ask one question at a time. Runs the same load twice, once with every request in one
+first-come-first-served queue (how the former per-worker semaphore behaved) and once with per-user fair queueing,
+and reports the regular users' latency and the noisy user's 429s. Same scripted model and SQLite product view as
+ask_offline.py. Run from the repository root:
+
+    python benchmarks/fair_share.py --noisy-concurrency 40 --regular-users 3 --slots 4 --llm-latency 0.5
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+# Every request should reach the model; cached or coalesced answers would hide the queueing
+os.environ.setdefault("ANSWER_CACHE_ENABLED", "false")
+os.environ.setdefault("COALESCE_REQUESTS_ENABLED", "false")
+
+import harness  # sets the app's environment defaults; import before the app
+
+import httpx
+import core.database as database
+import services.chatbot_service as chatbot_service
+import services.history_manager as history_manager
+import services.rate_limiter as rate_limiter
+from core.config import settings
+from services.history_writer import get_history_writer
+from main import app
+
+
+async def run_load(client, questions, args):
+    regular_latencies = []
+    noisy = {"answered": 0, "rejected": 0}
+    stop = asyncio.Event()
+
+    async def regular_user(user):
+        for turn in range(args.regular_requests):
+            start = time.perf_counter()
+            response = await client.post("/chatbots/ask", json={
+                "user_question": questions[(user + turn) % len(questions)], "user_id": f"regular-{user}"})
+            response.raise_for_status()
+            regular_latencies.append(time.perf_counter() - start)
+
+    async def noisy_client(index):
+        while not stop.is_set():
+            response = await client.post("/chatbots/ask", json={
+                "user_question": questions[index % len(questions)], "user_id": "noisy"})
+            if response.status_code == 429:
+                noisy["rejected"] += 1
+                # An aggressive client that ignores most of Retry-After
+                await asyncio.sleep(args.llm_latency)
+            else:
+                response.raise_for_status()
+                noisy["answered"] += 1
+
+    noisy_tasks = [asyncio.create_task(noisy_client(i)) for i in range(args.noisy_concurrency)]
+    # Let the noisy user fill the queue first
+    await asyncio.sleep(args.llm_latency * 2)
+    await asyncio.gather(*(regular_user(user) for user in range(args.regular_users)))
+    stop.set()
+    await asyncio.gather(*noisy_tasks)
+    return sorted(regular_latencies), noisy
+
+
+async def run_benchmark(args, fair: bool):
+    questions = [recording["question"] for recording in harness.load_recordings(args.recordings)]
+    rate_limiter._scheduler = None
+    if fair:
+        chatbot_service.set_scheduling_flow = rate_limiter.set_scheduling_flow
+    else:
+        # One unbounded queue shared by everyone
+        chatbot_service.set_scheduling_flow = lambda flow, bounded=True: rate_limiter.set_scheduling_flow("", False)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        # Build the schema snapshot, agent and catalog outside the measurements
+        for question in questions:
+            await client.post("/chatbots/ask", json={"user_question": question, "user_id": "warmup"})
+        latencies, noisy = await run_load(client, questions, args)
+        await get_history_writer().flush()
+
+    stats = rate_limiter.get_scheduler().stats()
+    return {
+        "regular_p50_ms": round(harness.percentile(latencies, 0.50) * 1000, 1),
+        "regular_p95_ms": round(harness.percentile(latencies, 0.95) * 1000, 1),
+        "noisy_answered": noisy["answered"],
+        "noisy_rejected": noisy["rejected"],
+        "average_wait_s": stats["average_wait_s"],
+    }
+
+
+async def run_both(args):
+    results = {"fifo": await run_benchmark(args, fair=False), "fair": await run_benchmark(args, fair=True)}
+    await get_history_writer().stop()
+    await database.dispose_async_engine()
+    database.dispose_engine()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--noisy-concurrency", type=int, default=40, help="requests the noisy user keeps in flight")
+    parser.add_argument("--regular-users", type=int, default=3)
+    parser.add_argument("--regular-requests", type=int, default=5, help="questions asked by each regular user")
+    parser.add_argument("--slots", type=int, default=4, help="MAX_CONCURRENT_AGENT_RUNS")
+    parser.add_argument("--products", type=int, default=2000, help="rows in the SQLite product view")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds per fake LLM call")
+    parser.add_argument("--recordings", default=harness.DEFAULT_RECORDINGS)
+    args = parser.parse_args()
+
+    model = harness.ScriptedChatModel(recordings=harness.load_recordings(args.recordings), latency=args.llm_latency)
+    chatbot_service.llm = model
+    history_manager._summary_llm = model
+
+    with tempfile.TemporaryDirectory() as directory:
+        settings.SCHEMA_CACHE_PATH = os.path.join(directory, "table_info.json")
+        settings.MAX_CONCURRENT_AGENT_RUNS = args.slots
+        harness.setup_sqlite(directory, products=args.products)
+        results = asyncio.run(run_both(args))
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
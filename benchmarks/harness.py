@@ -0,0 +1,291 @@
+"""
+Building blocks for the offline benchmarks: a local SQLite copy of the product view and chat history, a scripted
+chat model that replays recorded tool calls and answers, and counters for DB queries and LLM calls.
+
+Import this module before anything from the application; it fills in the settings the app needs at import time.
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import asyncio
+
+sys.path.append(os.getcwd())
+
+for _var in ("DATABASE_USERNAME", "DATABASE_PASSWORD", "DATABASE_HOSTNAME", "DATABASE_PORT",
+             "DATABASE_NAME", "SSLMODE", "OPENAI_API_KEY", "ORGANIZATION_ID"):
+    os.environ.setdefault(_var, "benchmark")
+# The hashing embedder needs no network; the OpenAI one would
+os.environ.setdefault("ANSWER_CACHE_EMBEDDER", "hashing")
+# Load generators send far more requests per user_id than the per-user rate limit allows
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+# The batch and admin endpoints stay closed without a key
+os.environ.setdefault("ADMIN_API_KEY", "benchmark")
+
+from typing import Any, List, Optional
+from sqlalchemy import (create_engine, event, MetaData, Table, Column, Integer, String, Float, Text,
+                        insert)
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import (AIMessage, AIMessageChunk, BaseMessage, FunctionMessage, HumanMessage,
+                                     ToolMessage)
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+import core.database as database
+from core.bot_history_db import Base, ChatHistory, ChatSummary
+from services.sql_agent import PRODUCT_SCHEMA, PRODUCT_TABLE
+from services.catalog import USAGE_COLUMNS
+from services.history_manager import count_tokens, count_message_tokens
+
+DEFAULT_RECORDINGS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "recordings", "ask_workload.json")
+
+CATEGORIES = ["Wireless Earbuds", "Wireless Headphones", "Wired Earbuds", "Wired Headphones"]
+BRANDS = ["Jabra", "Sony", "Bose", "Anker", "JLab", "Apple", "Samsung", "Sennheiser", "Beyerdynamic", "Skullcandy"]
+MODEL_WORDS = ["Elite", "Pro", "Sport", "Studio", "Life", "Air", "Max", "Go", "Active", "Flex", "Ultra", "Mini"]
+PROS = ["great sound", "long battery life", "comfortable fit", "strong ANC", "good mic", "water resistant"]
+CONS = ["pricey", "bulky case", "average mic", "no aptX", "touch controls misfire", "short cable"]
+
+DEFAULT_ANSWER = ("These products offer distinct features, making them suitable for various needs, from premium sound "
+                  "to budget-friendly comfort. Is there a feature you care about most?")
+GREETING = "Hi there, I am your helpful product recommendation assistant chatbot from Clearbuy. How may I help you today?"
+
+_TOOL_RESULT_ID = re.compile(r"(?:\(|\bid=)(\d+)\b")
+_PROMPT_PRODUCT_ID = re.compile(r"Product ID: (\d+)")
+
+
+def product_table(metadata: MetaData):
+    columns = [
+        Column("id", Integer, primary_key=True),
+        Column("category_name", String(100)),
+        Column("brand_name", String(100)),
+        Column("name", String(200)),
+        Column("price_msrp", Float),
+        Column("full_overview", Text),
+        Column("pros", Text),
+        Column("cons", Text),
+    ]
+    columns += [Column(column, Integer) for column in USAGE_COLUMNS]
+    return Table(PRODUCT_TABLE, metadata, *columns, schema=PRODUCT_SCHEMA)
+
+
+def generate_products(count: int, seed: int = 7):
+    """
+    Deterministic product rows shaped like SG_product_full_info_materialized.
+    """
+    rng = random.Random(seed)
+    rows = []
+    for product_id in range(1, count + 1):
+        category = rng.choice(CATEGORIES)
+        brand = rng.choice(BRANDS)
+        name = f"{rng.choice(MODEL_WORDS)} {rng.randint(1, 9)}{rng.choice(['', ' Plus', ' Lite'])}"
+        row = {
+            "id": product_id,
+            "category_name": category,
+            "brand_name": brand,
+            "name": name,
+            "price_msrp": round(rng.uniform(19, 549), 2),
+            "full_overview": (f"The {brand} {name} are {category.lower()} with {rng.choice(PROS)} and "
+                              f"{rng.choice(PROS)}. " * 4) if rng.random() < 0.8 else None,
+            "pros": ", ".join(rng.sample(PROS, 2)),
+            "cons": ", ".join(rng.sample(CONS, 2)),
+        }
+        row.update({column: int(rng.random() < 0.3) for column in USAGE_COLUMNS})
+        rows.append(row)
+    return rows
+
+
+def setup_sqlite(directory: str, products: int = 0):
+    """
+    Points the app's engines at SQLite files. clearbuydb is an attached database, so the app's schema-qualified
+    names work unchanged. Creates chat_history/chat_summary and, when `products` > 0, a seeded product view.
+    """
+    main_path = os.path.join(directory, "main.db")
+    schema_path = os.path.join(directory, "clearbuydb.db")
+
+    def attach_schema(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"ATTACH DATABASE '{schema_path}' AS clearbuydb")
+        cursor.close()
+
+    database.engine = create_engine(f"sqlite:///{main_path}", connect_args={"check_same_thread": False})
+    event.listen(database.engine, "connect", attach_schema)
+    database.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=database.engine)
+    Base.metadata.create_all(bind=database.engine, tables=[ChatHistory.__table__, ChatSummary.__table__])
+
+    if products:
+        metadata = MetaData()
+        table = product_table(metadata)
+        metadata.create_all(bind=database.engine)
+        with database.engine.begin() as connection:
+            connection.execute(insert(table), generate_products(products))
+
+    database.async_engine = create_async_engine(f"sqlite+aiosqlite:///{main_path}")
+    event.listen(database.async_engine.sync_engine, "connect", attach_schema)
+    database.AsyncSessionLocal = async_sessionmaker(database.async_engine, autoflush=False,
+                                                    expire_on_commit=False)
+
+
+def seed_chat_history(user_ids, turns: int):
+    """
+    Gives every user `turns` earlier question/answer pairs, so history loading and trimming are exercised.
+    """
+    if not turns:
+        return
+    rows = [{"user_id": user_id, "question": f"Earlier question {turn} about earbuds for the gym",
+             "answer": DEFAULT_ANSWER, "product_ids": ["1", "2"]}
+            for user_id in user_ids for turn in range(turns)]
+    with database.engine.begin() as connection:
+        connection.execute(insert(ChatHistory), rows)
+
+
+class QueryCounter:
+    """
+    Counts statements sent to the database by the sync and async engines.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+    def attach(self, *engines):
+        for engine in engines:
+            event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+
+    def reset(self):
+        self.count = 0
+
+
+def load_recordings(path: str = DEFAULT_RECORDINGS):
+    """
+    Recordings are a JSON list of {"question", optional "tool_calls": [{"name", "arguments"}], optional "answer"}.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _message_text(message: BaseMessage):
+    return message.content if isinstance(message.content, str) else json.dumps(message.content)
+
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    Offline stand-in for ChatOpenAI. For the agent it replays the recorded function calls of the matching
+    question one step at a time, then answers with the recorded answer (or with the product IDs the tools
+    returned). Every call waits `latency` seconds. `prompt_tokens` adds up the messages and function definitions
+    sent, counted as the app counts them; each reply reports its token usage under `model_name`, so traces can
+    price the call.
+    """
+
+    recordings: List[dict] = []
+    model_name: str = "gpt-4o"
+    latency: float = 0.0
+    calls: int = 0
+    prompt_tokens: int = 0
+
+    @property
+    def _llm_type(self):
+        return "scripted"
+
+    @property
+    def _identifying_params(self):
+        # Reported in the invocation params, where the tracing callback reads the model name
+        return {"model_name": self.model_name}
+
+    def _recording_for(self, question: str):
+        question = question.lower()
+        for recording in self.recordings:
+            if recording["question"].lower() in question:
+                return recording
+        return {"question": "", "tool_calls": [{
+            "name": "sql_db_query",
+            "arguments": {"query": f"SELECT id, brand_name, name, price_msrp FROM {PRODUCT_SCHEMA}.{PRODUCT_TABLE} "
+                                   f"ORDER BY price_msrp DESC LIMIT 4"},
+        }]}
+
+    def _respond(self, messages: List[BaseMessage], functions: Optional[list]):
+        prompt_tokens = count_message_tokens(messages) + (count_tokens(json.dumps(functions)) if functions else 0)
+        self.calls += 1
+        self.prompt_tokens += prompt_tokens
+        message = self._reply(messages, functions)
+        completion_tokens = count_tokens(message.content) + count_tokens(json.dumps(message.additional_kwargs))
+        message.usage_metadata = {"input_tokens": prompt_tokens, "output_tokens": completion_tokens,
+                                  "total_tokens": prompt_tokens + completion_tokens}
+        return message
+
+    def _reply(self, messages: List[BaseMessage], functions: Optional[list]):
+        last_human = max((i for i, message in enumerate(messages) if isinstance(message, HumanMessage)), default=-1)
+        question = _message_text(messages[last_human]) if last_human >= 0 else ""
+        if question.startswith("Existing summary:"):
+            return AIMessage(content="The user is shopping for earbuds and headphones for the gym and travel.")
+
+        if not functions:
+            # Fast path: the products are already listed in the question
+            product_ids = _PROMPT_PRODUCT_ID.findall(question)
+            if not product_ids:
+                return AIMessage(content=GREETING)
+            markers = " ".join(f"**Product ID: {product_id}**" for product_id in product_ids)
+            return AIMessage(content=f"{markers}\n\n{DEFAULT_ANSWER}")
+
+        # The agent's history turns are messages of their own, so the last human message is the question itself
+        recording = self._recording_for(question)
+        available = {function["name"] for function in functions}
+        tool_calls = [call for call in recording.get("tool_calls", []) if call["name"] in available]
+        tool_results = [message for message in messages[last_human + 1:]
+                        if isinstance(message, (FunctionMessage, ToolMessage))]
+        if len(tool_results) < len(tool_calls):
+            call = tool_calls[len(tool_results)]
+            return AIMessage(content="", additional_kwargs={"function_call": {
+                "name": call["name"], "arguments": json.dumps(call.get("arguments", {})),
+            }})
+        if recording.get("answer"):
+            return AIMessage(content=recording["answer"])
+        product_ids = []
+        for message in tool_results:
+            for product_id in _TOOL_RESULT_ID.findall(_message_text(message)):
+                if product_id not in product_ids:
+                    product_ids.append(product_id)
+        markers = " ".join(f"**Product ID: {product_id}**" for product_id in product_ids[:4])
+        return AIMessage(content=f"{markers}\n\n{DEFAULT_ANSWER}".strip())
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None,
+                  **kwargs: Any):
+        time.sleep(self.latency)
+        message = self._respond(messages, kwargs.get("functions"))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None,
+                         **kwargs: Any):
+        await asyncio.sleep(self.latency)
+        message = self._respond(messages, kwargs.get("functions"))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None,
+                       **kwargs: Any):
+        await asyncio.sleep(self.latency)
+        message = self._respond(messages, kwargs.get("functions"))
+        if message.additional_kwargs:
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", additional_kwargs=message.additional_kwargs,
+                                                             usage_metadata=message.usage_metadata))
+            return
+        pieces = re.findall(r"\S+\s*", message.content)
+        for i, piece in enumerate(pieces):
+            # Usage comes with the last chunk, as OpenAI streams it
+            usage = message.usage_metadata if i == len(pieces) - 1 else None
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=piece, usage_metadata=usage))
+            if run_manager:
+                await run_manager.on_llm_new_token(piece, chunk=chunk)
+            yield chunk
+
+
+def percentile(sorted_values, fraction: float):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
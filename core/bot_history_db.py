@@ -1,5 +1,5 @@
 import json
-from sqlalchemy import Column, Integer, String, DateTime, func, create_engine, Text
+from sqlalchemy import Column, Integer, String, DateTime, func, create_engine, Text, JSON, Index
 from sqlalchemy.orm import declarative_base
 
 Base = declarative_base()
@@ -7,21 +7,38 @@ Base = declarative_base()
 
 class ChatHistory(Base):
     __tablename__ = "chat_history"
-    __table_args__ = {'schema': 'clearbuydb'}  # Specify the schema
+    __table_args__ = (
+        # Serves the per-user history reads (newest first, keyset paginated) and the per-user DELETE
+        Index("ix_chat_history_user_created", "user_id", "created_at", "id"),
+        {'schema': 'clearbuydb'},  # Specify the schema
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(String(50), nullable=False)
     question = Column(Text, nullable=False)  # Using Text type for question
     answer = Column(Text, nullable=False)  # Using Text type for answer
-    product_ids = Column(Text, nullable=True) # Using Text type for product ids
+    product_ids = Column(JSON, nullable=True)  # Native JSON list of product ids
     created_at = Column(DateTime, default=func.now(), nullable=False)
 
-    # Methods to serialize and deserialize the product_ids list
     def set_product_ids(self, product_ids_list):
-        self.product_ids = json.dumps(product_ids_list)
+        self.product_ids = list(product_ids_list)
 
     def get_product_ids(self):
-        return json.loads(self.product_ids) if self.product_ids else []
+        if isinstance(self.product_ids, str):
+            # Rows written before the JSON column migration hold json.dumps text
+            return json.loads(self.product_ids)
+        return self.product_ids or []
+
+
+class ChatSummary(Base):
+    __tablename__ = "chat_summary"
+    __table_args__ = {'schema': 'clearbuydb'}  # Specify the schema
+
+    user_id = Column(String(50), primary_key=True)
+    summary = Column(Text, nullable=False)  # Rolling summary of turns older than the prompt's token budget
+    last_entry_id = Column(Integer, nullable=False)  # Newest chat_history.id folded into the summary
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now(), nullable=False)
+
 
 # Uncomment below lines if you want to create table "chat_history" again in 'clearbuydb' DB.
 # from core.config import settings
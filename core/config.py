@@ -13,14 +13,137 @@ class Settings:
     DATABASE_PORT: str = os.getenv("DATABASE_PORT")
     DATABASE_NAME: str = os.getenv("DATABASE_NAME")
     SSLMODE: str = os.getenv("SSLMODE")
+    # CA bundle that signed the MySQL server certificate; required by SSLMODE=VERIFY_CA
+    SSL_CA: str = os.getenv("SSL_CA")
     OPENAI_API_KEY: str = os.getenv("OPENAI_API_KEY")
     ORGANIZATION_ID: str = os.getenv("ORGANIZATION_ID")
 
+    # Connection pool shared by the whole application (see core/database.py)
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "10"))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+    DB_POOL_TIMEOUT: int = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+    DB_POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+    DB_POOL_PRE_PING: bool = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+    # Seconds a single read from / write to MySQL may block the sync driver
+    DB_READ_TIMEOUT: int = int(os.getenv("DB_READ_TIMEOUT", "30"))
+
+    # Upper bound on agent runs in flight per worker; further /ask requests wait their turn
+    MAX_CONCURRENT_AGENT_RUNS: int = int(os.getenv("MAX_CONCURRENT_AGENT_RUNS", "8"))
+
+    # Snapshot of the product view's DDL and sample rows used by the SQL agent
+    SCHEMA_CACHE_TTL: int = int(os.getenv("SCHEMA_CACHE_TTL", "86400"))
+    SCHEMA_CACHE_PATH: str = os.getenv("SCHEMA_CACHE_PATH", ".cache/table_info.json")
+    # /admin/refresh-schema runs in one worker and touches a marker file next to the snapshot; the other workers
+    # on the host check it this often and drop their snapshot, agent, caches and catalog too
+    SCHEMA_REFRESH_CHECK_SECONDS: float = float(os.getenv("SCHEMA_REFRESH_CHECK_SECONDS", "5"))
+
+    # Cache of final answers in front of the SQL agent (embedder: "openai" or the offline "hashing")
+    ANSWER_CACHE_ENABLED: bool = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+    ANSWER_CACHE_MAX_ENTRIES: int = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+    ANSWER_CACHE_TTL: int = int(os.getenv("ANSWER_CACHE_TTL", "3600"))
+    ANSWER_CACHE_SIMILARITY_THRESHOLD: float = float(os.getenv("ANSWER_CACHE_SIMILARITY_THRESHOLD", "0.92"))
+    ANSWER_CACHE_EMBEDDER: str = os.getenv("ANSWER_CACHE_EMBEDDER", "openai")
+
+    # Answer structured product searches with one fixed query and one LLM call instead of the agent loop
+    FAST_PATH_ENABLED: bool = os.getenv("FAST_PATH_ENABLED", "true").lower() == "true"
+
+    # In-memory copy of the product view, used by the fast path and offered to the agent as a tool
+    CATALOG_ENABLED: bool = os.getenv("CATALOG_ENABLED", "true").lower() == "true"
+    CATALOG_REFRESH_INTERVAL: int = int(os.getenv("CATALOG_REFRESH_INTERVAL", "900"))
+
+    # Chat history in the prompt: newest turns within a token budget, older turns folded into a rolling summary
+    HISTORY_FETCH_LIMIT: int = int(os.getenv("HISTORY_FETCH_LIMIT", "10"))
+    HISTORY_TOKEN_BUDGET: int = int(os.getenv("HISTORY_TOKEN_BUDGET", "1500"))
+    HISTORY_SUMMARY_ENABLED: bool = os.getenv("HISTORY_SUMMARY_ENABLED", "true").lower() == "true"
+    SUMMARY_MODEL: str = os.getenv("SUMMARY_MODEL", "gpt-4o-mini")
+
+    # Newest HISTORY_CACHE_DEPTH rows (at least HISTORY_FETCH_LIMIT) and the summary of recent users, so follow-up
+    # questions read no history from MySQL. On by default only with the shared "redis" backend: a "memory" cache
+    # per worker cannot see other workers' answers and clears, so it refuses to start with WEB_CONCURRENCY > 1
+    HISTORY_CACHE_BACKEND: str = os.getenv("HISTORY_CACHE_BACKEND", "memory")
+    HISTORY_CACHE_ENABLED: bool = os.getenv("HISTORY_CACHE_ENABLED",
+                                            str(HISTORY_CACHE_BACKEND == "redis")).lower() == "true"
+    HISTORY_CACHE_REDIS_URL: str = os.getenv("HISTORY_CACHE_REDIS_URL",
+                                             os.getenv("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0"))
+    HISTORY_CACHE_DEPTH: int = int(os.getenv("HISTORY_CACHE_DEPTH", "20"))
+    HISTORY_CACHE_MAX_USERS: int = int(os.getenv("HISTORY_CACHE_MAX_USERS", "10000"))
+    HISTORY_CACHE_MAX_BYTES: int = int(os.getenv("HISTORY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+    HISTORY_CACHE_TTL: int = int(os.getenv("HISTORY_CACHE_TTL", "300"))
+
+    # Chat history rows are queued and bulk-inserted in the background instead of committing inside each request
+    HISTORY_WRITE_BEHIND_ENABLED: bool = os.getenv("HISTORY_WRITE_BEHIND_ENABLED", "true").lower() == "true"
+    HISTORY_WRITE_BATCH_SIZE: int = int(os.getenv("HISTORY_WRITE_BATCH_SIZE", "50"))
+    HISTORY_WRITE_FLUSH_INTERVAL: float = float(os.getenv("HISTORY_WRITE_FLUSH_INTERVAL", "0.5"))
+    HISTORY_WRITE_MAX_RETRIES: int = int(os.getenv("HISTORY_WRITE_MAX_RETRIES", "5"))
+
+    # Identical questions in flight at the same time (same or no chat history) share one agent run
+    COALESCE_REQUESTS_ENABLED: bool = os.getenv("COALESCE_REQUESTS_ENABLED", "true").lower() == "true"
+
+    # POST /chatbots/ask/batch: items per request and items answered concurrently
+    BATCH_MAX_ITEMS: int = int(os.getenv("BATCH_MAX_ITEMS", "1000"))
+    BATCH_MAX_PARALLELISM: int = int(os.getenv("BATCH_MAX_PARALLELISM", "8"))
+
+    # Per-request ceilings for the SQL agent; a run that hits one is answered from the results gathered so far
+    AGENT_MAX_ITERATIONS: int = int(os.getenv("AGENT_MAX_ITERATIONS", "15"))
+    AGENT_MAX_SECONDS: float = float(os.getenv("AGENT_MAX_SECONDS", "40"))
+    AGENT_MAX_TOKENS: int = int(os.getenv("AGENT_MAX_TOKENS", "40000"))
+    # Agent queries: SELECT only, at most SQL_MAX_ROWS rows, MySQL execution time limited to SQL_QUERY_TIMEOUT_MS
+    SQL_MAX_ROWS: int = int(os.getenv("SQL_MAX_ROWS", "20"))
+    SQL_QUERY_TIMEOUT_MS: int = int(os.getenv("SQL_QUERY_TIMEOUT_MS", "5000"))
+
+    # Results of agent queries, keyed by canonical SQL; cleared when the product view snapshot is refreshed
+    SQL_CACHE_ENABLED: bool = os.getenv("SQL_CACHE_ENABLED", "true").lower() == "true"
+    SQL_CACHE_MAX_ENTRIES: int = int(os.getenv("SQL_CACHE_MAX_ENTRIES", "2000"))
+    SQL_CACHE_MAX_BYTES: int = int(os.getenv("SQL_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+    SQL_CACHE_TTL: int = int(os.getenv("SQL_CACHE_TTL", "900"))
+
+    # Each worker builds the engines, snapshot, catalog and agent at startup; /ready reports 503 until then
+    WARMUP_ENABLED: bool = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+    WARMUP_RETRY_SECONDS: float = float(os.getenv("WARMUP_RETRY_SECONDS", "10"))
+    # Worker processes serving the app (gunicorn.conf.py exports its count); 1 under plain uvicorn
+    WEB_CONCURRENCY: int = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+    # Admission control for /ask: token buckets per user_id and for the whole service (GLOBAL ~ the OpenAI rate
+    # limit divided by LLM calls per question, 0 = off); "redis" shares the buckets between workers
+    RATE_LIMIT_ENABLED: bool = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+    RATE_LIMIT_USER_PER_MINUTE: float = float(os.getenv("RATE_LIMIT_USER_PER_MINUTE", "20"))
+    RATE_LIMIT_USER_BURST: float = float(os.getenv("RATE_LIMIT_USER_BURST", "5"))
+    RATE_LIMIT_GLOBAL_PER_MINUTE: float = float(os.getenv("RATE_LIMIT_GLOBAL_PER_MINUTE", "0"))
+    RATE_LIMIT_GLOBAL_BURST: float = float(os.getenv("RATE_LIMIT_GLOBAL_BURST", "20"))
+    RATE_LIMIT_BACKEND: str = os.getenv("RATE_LIMIT_BACKEND", "memory")
+    RATE_LIMIT_REDIS_URL: str = os.getenv("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0")
+    # Requests waiting for one of the MAX_CONCURRENT_AGENT_RUNS slots are served in weighted fair order per user;
+    # beyond these bounds they get 429 instead of waiting. SCHEDULER_WEIGHTS: "user_id=2,batch=0.5"
+    SCHEDULER_MAX_QUEUE: int = int(os.getenv("SCHEDULER_MAX_QUEUE", "64"))
+    SCHEDULER_MAX_QUEUED_PER_USER: int = int(os.getenv("SCHEDULER_MAX_QUEUED_PER_USER", "2"))
+    SCHEDULER_MAX_WAIT_SECONDS: float = float(os.getenv("SCHEDULER_MAX_WAIT_SECONDS", "20"))
+    SCHEDULER_WEIGHTS: str = os.getenv("SCHEDULER_WEIGHTS", "")
+
+    # Two-tier routing: greetings are answered without an LLM call, small talk and follow-ups about the previous
+    # answer's products by LIGHT_MODEL; everything else goes to gpt-4o. ROUTER_MODEL_ENABLED asks LIGHT_MODEL to
+    # classify the questions the rules cannot place
+    ROUTING_ENABLED: bool = os.getenv("ROUTING_ENABLED", "true").lower() == "true"
+    LIGHT_MODEL: str = os.getenv("LIGHT_MODEL", "gpt-4o-mini")
+    ROUTER_MODEL_ENABLED: bool = os.getenv("ROUTER_MODEL_ENABLED", "false").lower() == "true"
+
+    # Request tracing: slow requests log their trace summary; DEBUG_TRACE_ENABLED lets clients request the full
+    # trace with the X-Debug-Trace header (it contains SQL statements, keep it off in production)
+    TRACE_SLOW_REQUEST_SECONDS: float = float(os.getenv("TRACE_SLOW_REQUEST_SECONDS", "10"))
+    DEBUG_TRACE_ENABLED: bool = os.getenv("DEBUG_TRACE_ENABLED", "false").lower() == "true"
+
+    # Shared secret for the /chatbots/admin endpoints and /chatbots/ask/batch; they answer 503 while it is unset
+    ADMIN_API_KEY: str = os.getenv("ADMIN_API_KEY")
+
     @property
     def DATABASE_URI(self):
         return (f"mysql+pymysql://{self.DATABASE_USERNAME}:{self.DATABASE_PASSWORD}"
                 f"@{self.DATABASE_HOSTNAME}:{self.DATABASE_PORT}/{self.DATABASE_NAME}")
 
+    @property
+    def ASYNC_DATABASE_URI(self):
+        return (f"mysql+aiomysql://{self.DATABASE_USERNAME}:{self.DATABASE_PASSWORD}"
+                f"@{self.DATABASE_HOSTNAME}:{self.DATABASE_PORT}/{self.DATABASE_NAME}")
+
 # Instantiate the settings
 settings = Settings()
 
@@ -42,3 +165,6 @@ required_vars = {
 missing_vars = [var for var, value in required_vars.items() if not value]
 if missing_vars:
     raise EnvironmentError(f"Missing required environment variables: {', '.join(missing_vars)}")
+
+if settings.SSLMODE.upper() == "VERIFY_CA" and not settings.SSL_CA:
+    raise EnvironmentError("SSLMODE=VERIFY_CA needs SSL_CA, the CA bundle that signed the server certificate")
@@ -0,0 +1,227 @@
+import ssl
+import threading
+import time
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from core.config import settings
+
+engine = None
+SessionLocal = None
+async_engine = None
+AsyncSessionLocal = None
+_engine_lock = threading.Lock()
+
+
+class PoolMetrics:
+    """
+    Collects checkout counters and wait times for the shared connection pool.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.checkout_timeouts = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def record_checkout(self, wait_seconds: float, timed_out: bool = False):
+        with self._lock:
+            if timed_out:
+                self.checkout_timeouts += 1
+            else:
+                self.checkouts += 1
+            self.total_wait_seconds += wait_seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, wait_seconds)
+
+    def snapshot(self):
+        with self._lock:
+            attempts = self.checkouts + self.checkout_timeouts
+            return {
+                "checkouts": self.checkouts,
+                "checkout_timeouts": self.checkout_timeouts,
+                "avg_checkout_wait_ms": round(self.total_wait_seconds / attempts * 1000, 3) if attempts else 0.0,
+                "max_checkout_wait_ms": round(self.max_wait_seconds * 1000, 3),
+            }
+
+
+pool_metrics = PoolMetrics()
+async_pool_metrics = PoolMetrics()
+
+
+class _TimedCheckoutMixin:
+    """
+    Times every pool checkout so we can see how long requests wait for a connection.
+    """
+    metrics = None
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except Exception:
+            self.metrics.record_checkout(time.perf_counter() - start, timed_out=True)
+            raise
+        self.metrics.record_checkout(time.perf_counter() - start)
+        return connection
+
+
+class InstrumentedQueuePool(_TimedCheckoutMixin, QueuePool):
+    metrics = pool_metrics
+
+
+class InstrumentedAsyncAdaptedQueuePool(_TimedCheckoutMixin, AsyncAdaptedQueuePool):
+    metrics = async_pool_metrics
+
+
+def get_ssl_connect_args(sslmode: str, ssl_ca: str = None):
+    """
+    Translates the MySQL style SSLMODE setting into PyMySQL connect arguments. The verifying modes check the
+    server certificate against `ssl_ca`, or the system CA store when it is not given (VERIFY_IDENTITY only).
+    """
+    mode = (sslmode or "").upper()
+    if mode in ("", "DISABLED"):
+        return {}
+    if mode in ("VERIFY_CA", "VERIFY_IDENTITY"):
+        if mode == "VERIFY_CA" and not ssl_ca:
+            raise ValueError("SSLMODE=VERIFY_CA needs the CA bundle of the server certificate (SSL_CA)")
+        connect_args = {"ssl_verify_cert": True, "ssl_verify_identity": mode == "VERIFY_IDENTITY"}
+        if ssl_ca:
+            connect_args["ssl_ca"] = ssl_ca
+        return connect_args
+    # REQUIRED / PREFERRED: encrypt the connection without verifying the server certificate
+    return {"ssl": {"check_hostname": False}}
+
+
+def get_timeout_connect_args():
+    """
+    PyMySQL socket timeouts, so a query stuck on the server cannot hold a worker thread indefinitely.
+    """
+    if not settings.DB_READ_TIMEOUT:
+        return {}
+    return {"read_timeout": settings.DB_READ_TIMEOUT, "write_timeout": settings.DB_READ_TIMEOUT}
+
+
+def get_async_ssl_connect_args(sslmode: str, ssl_ca: str = None):
+    """
+    Same as get_ssl_connect_args, but aiomysql expects an SSLContext.
+    """
+    mode = (sslmode or "").upper()
+    if mode in ("", "DISABLED"):
+        return {}
+    if mode == "VERIFY_CA" and not ssl_ca:
+        raise ValueError("SSLMODE=VERIFY_CA needs the CA bundle of the server certificate (SSL_CA)")
+    context = ssl.create_default_context(cafile=ssl_ca if mode in ("VERIFY_CA", "VERIFY_IDENTITY") else None)
+    if mode != "VERIFY_IDENTITY":
+        context.check_hostname = False
+    if mode not in ("VERIFY_CA", "VERIFY_IDENTITY"):
+        context.verify_mode = ssl.CERT_NONE
+    return {"ssl": context}
+
+
+def _pool_kwargs():
+    return {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+    }
+
+
+def init_engine():
+    """
+    Creates the process wide engine and session factory. Safe to call more than once.
+    """
+    global engine, SessionLocal
+    with _engine_lock:
+        if engine is None:
+            engine = create_engine(
+                settings.DATABASE_URI,
+                poolclass=InstrumentedQueuePool,
+                connect_args={**get_ssl_connect_args(settings.SSLMODE, settings.SSL_CA), **get_timeout_connect_args()},
+                **_pool_kwargs(),
+            )
+            SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    return engine
+
+
+def init_async_engine():
+    """
+    Creates the process wide aiomysql engine used for chat history reads and writes.
+    """
+    global async_engine, AsyncSessionLocal
+    with _engine_lock:
+        if async_engine is None:
+            async_engine = create_async_engine(
+                settings.ASYNC_DATABASE_URI,
+                poolclass=InstrumentedAsyncAdaptedQueuePool,
+                connect_args=get_async_ssl_connect_args(settings.SSLMODE, settings.SSL_CA),
+                **_pool_kwargs(),
+            )
+            AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+    return async_engine
+
+
+def get_engine():
+    return engine if engine is not None else init_engine()
+
+
+def get_session_factory():
+    if SessionLocal is None:
+        init_engine()
+    return SessionLocal
+
+
+def get_async_session_factory():
+    if AsyncSessionLocal is None:
+        init_async_engine()
+    return AsyncSessionLocal
+
+
+def dispose_engine():
+    global engine, SessionLocal
+    with _engine_lock:
+        if engine is not None:
+            engine.dispose()
+        engine = None
+        SessionLocal = None
+
+
+async def dispose_async_engine():
+    global async_engine, AsyncSessionLocal
+    current_engine = async_engine
+    with _engine_lock:
+        async_engine = None
+        AsyncSessionLocal = None
+    if current_engine is not None:
+        await current_engine.dispose()
+
+
+def _pool_occupancy(pool, metrics):
+    stats = {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "checked_out": 0,
+        "checked_in": 0,
+        "overflow": 0,
+    }
+    if pool is not None and hasattr(pool, "checkedout"):
+        stats.update({
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": max(pool.overflow(), 0),
+        })
+    stats.update(metrics.snapshot())
+    return stats
+
+
+def get_pool_stats():
+    """
+    Returns the current pool occupancy together with the checkout wait metrics.
+    """
+    stats = _pool_occupancy(engine.pool if engine is not None else None, pool_metrics)
+    stats["async"] = _pool_occupancy(async_engine.pool if async_engine is not None else None,
+                                     async_pool_metrics)
+    return stats
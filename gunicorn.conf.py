@@ -0,0 +1,45 @@
+"""
+Production serving profile: gunicorn managing uvicorn workers.
+
+    gunicorn main:app -c gunicorn.conf.py
+
+The application is imported once in the master (preload_app) and forked, so workers share the import cost and
+its memory pages. Engines, pools and event loops are created per worker in the FastAPI lifespan, after the fork.
+"""
+import os
+import glob
+import tempfile
+
+
+def _available_cpus():
+    # Respects CPU affinity (e.g. taskset, some container runtimes) where the platform exposes it
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+worker_class = "uvicorn.workers.UvicornWorker"
+# Async workers: one event loop per core keeps every core busy; WEB_CONCURRENCY overrides
+workers = int(os.getenv("WEB_CONCURRENCY", str(max(2, _available_cpus()))))
+# The preloaded app reads the worker count from here (settings.WEB_CONCURRENCY)
+os.environ["WEB_CONCURRENCY"] = str(workers)
+preload_app = True
+# Agent answers can take tens of seconds; workers silent for longer than this are restarted
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+# Time for in-flight answers and the chat history write-behind queue to finish on shutdown
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+accesslog = "-"
+
+# Prometheus metrics of all workers are aggregated through files in this directory. It must be set, and cleared of
+# a previous run's samples, before prometheus_client is imported, i.e. before the app is preloaded.
+if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="chatbot-prometheus-")
+for _path in glob.glob(os.path.join(os.environ["PROMETHEUS_MULTIPROC_DIR"], "*.db")):
+    os.remove(_path)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -1,8 +1,51 @@
+import time
+
+# Measured for the cold start report; everything below is the application's import cost
+_import_started = time.perf_counter()
+
 import os
-from fastapi import FastAPI
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Response
+from fastapi.responses import JSONResponse
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST, CollectorRegistry, multiprocess
 from api.endpoints import router as chatbot_router
+from core.config import settings
+from core.database import init_engine, dispose_engine, init_async_engine, dispose_async_engine
+from services.history_writer import get_history_writer
+from services.warmup import warm_up_state, run_warm_up
+from services.rate_limiter import close_rate_limiter
+from services.history_cache import get_history_cache, close_history_cache
+
+IMPORT_SECONDS = time.perf_counter() - _import_started
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Create the shared engines and connection pools once per worker
+    init_engine()
+    init_async_engine()
+    # Fails the worker's startup on a history cache that cannot stay consistent across workers
+    get_history_cache()
+    warm_up_state.record("import", IMPORT_SECONDS)
+    warm_up_task = None
+    if settings.WARMUP_ENABLED:
+        # Builds the snapshot, catalog and agent in the background; /ready turns 200 when it is done
+        warm_up_task = asyncio.create_task(run_warm_up())
+    else:
+        warm_up_state.ready = True
+    yield
+    if warm_up_task is not None and not warm_up_task.done():
+        warm_up_task.cancel()
+    # Write any queued chat history before the pools are closed
+    await get_history_writer().stop()
+    await close_rate_limiter()
+    await close_history_cache()
+    await dispose_async_engine()
+    dispose_engine()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
 
 app.include_router(chatbot_router)
 
@@ -10,6 +53,26 @@ app.include_router(chatbot_router)
 async def read_root():
     return {"message": "Welcome to the Clearbuy Product Recommendation Chatbot API"}
 
+
+@app.get("/ready")
+async def readiness():
+    # Readiness probe: 503 until this worker's warm-up has finished
+    if not warm_up_state.ready:
+        return JSONResponse(status_code=503, content={"status": False, "message": "Warming up",
+                                                      "data": warm_up_state.status()})
+    return {"status": True, "message": "Ready", "data": warm_up_state.status()}
+
+
+@app.get("/metrics")
+async def metrics():
+    # Prometheus scrape endpoint: request latency, agent steps, SQL timings, LLM calls and token usage
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        # Under gunicorn every worker writes its samples to this directory; aggregate them all
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 if __name__ == '__main__':
     import uvicorn
     port = int(os.environ.get('PORT', 5000))
@@ -0,0 +1,125 @@
+import time
+import asyncio
+import logging
+from langchain_core.callbacks import BaseCallbackHandler
+from prometheus_client import Counter
+from services.tracing import get_current_trace, token_usage
+from services.history_manager import count_tokens, count_message_tokens
+
+# Output of AgentExecutor when max_iterations or max_execution_time ends the run
+STOPPED_OUTPUT_PREFIX = "Agent stopped due to"
+MAX_PARTIAL_RESULT_CHARS = 6000
+
+AGENT_EARLY_STOPS = Counter("chatbot_agent_early_stops_total",
+                            "Agent runs stopped before a final answer, by the budget that ran out", ["reason"])
+
+
+class AgentBudget:
+    """
+    Wall-clock and token ceilings of one agent run. `reason` says which one ran out first.
+    """
+
+    def __init__(self, max_seconds: float, max_tokens: int):
+        self.deadline = time.monotonic() + max_seconds
+        self.max_tokens = max_tokens
+        self.tokens = 0
+        self.reason = None
+
+    def remaining_seconds(self):
+        return max(self.deadline - time.monotonic(), 0.0)
+
+    def stop(self, reason: str):
+        if self.reason is None:
+            self.reason = reason
+
+    def exhausted(self):
+        if self.reason is None:
+            if self.remaining_seconds() <= 0:
+                self.stop("time")
+            elif self.max_tokens and self.tokens >= self.max_tokens:
+                self.stop("tokens")
+        return self.reason is not None
+
+
+class BudgetCallbackHandler(BaseCallbackHandler):
+    """
+    Adds the tokens of every LLM call of a run to its budget. Uses the usage reported by the API and falls back
+    to counting the prompt and completion locally when a model does not report it.
+    """
+
+    # Called directly instead of through a thread pool executor
+    run_inline = True
+
+    def __init__(self, budget: AgentBudget):
+        self.budget = budget
+        self._estimates = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._estimates[run_id] = sum(count_message_tokens(batch) for batch in messages)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        estimate = self._estimates.pop(run_id, 0)
+        prompt_tokens, completion_tokens = token_usage(response)
+        if not prompt_tokens and not completion_tokens:
+            prompt_tokens = estimate
+            completion_tokens = sum(count_tokens(generation.text) for generations in response.generations
+                                    for generation in generations)
+        self.budget.tokens += prompt_tokens + completion_tokens
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._estimates.pop(run_id, None)
+
+
+async def within_budget(events, budget: AgentBudget):
+    """
+    Re-yields the items of an async iterator (agent steps or stream events) until the budget runs out; waiting
+    for the next item is cut off at the deadline, which cancels the step in progress.
+    """
+    iterator = events.__aiter__()
+    try:
+        while not budget.exhausted():
+            try:
+                item = await asyncio.wait_for(iterator.__anext__(), timeout=budget.remaining_seconds())
+            except StopAsyncIteration:
+                return
+            except asyncio.TimeoutError:
+                budget.stop("time")
+                return
+            yield item
+    finally:
+        if hasattr(iterator, "aclose"):
+            await iterator.aclose()
+
+
+async def run_agent_within_budget(agent_executor, inputs, budget: AgentBudget, callbacks):
+    """
+    Runs the agent step by step. Returns (final output or None if the run was stopped, tool observations).
+    """
+    output, observations = None, []
+    async for step in within_budget(agent_executor.iter(inputs, callbacks=callbacks), budget):
+        if "intermediate_step" in step:
+            observations.extend(str(observation) for _, observation in step["intermediate_step"])
+        else:
+            output = step.get("output", "")
+    if output is not None and output.startswith(STOPPED_OUTPUT_PREFIX):
+        budget.stop("iterations")
+        output = None
+    return output, observations
+
+
+def record_early_stop(budget: AgentBudget, steps: int):
+    AGENT_EARLY_STOPS.labels(budget.reason or "unknown").inc()
+    logging.warning(f"Agent run stopped early ({budget.reason}) after {steps} tool results and {budget.tokens} tokens")
+    trace = get_current_trace()
+    if trace is not None:
+        now = time.perf_counter()
+        trace.add("agent_early_stop", now, 0.0, reason=budget.reason, tokens=budget.tokens)
+
+
+def build_partial_answer_question(user_question: str, observations):
+    """
+    Question for the single LLM call that answers from the query results gathered before the run was stopped.
+    """
+    results = "\n\n".join(observations)[-MAX_PARTIAL_RESULT_CHARS:]
+    return (f"{user_question}\n\n"
+            f"Do not run any more queries. Answer using only these product query results:\n{results}")
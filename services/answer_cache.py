@@ -0,0 +1,196 @@
+import re
+import json
+import time
+import zlib
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+from core.config import settings
+
+_NON_WORD = re.compile(r"[^a-z0-9$]+")
+_TOKEN = re.compile(r"[a-z0-9$]+")
+
+
+def normalize_question(question: str):
+    """
+    Lowercases the question and drops punctuation so trivially different phrasings share an exact-match key.
+    """
+    return _NON_WORD.sub(" ", question.lower()).strip()
+
+
+def scope_for_history(history):
+    """
+    Answers are only shared between requests whose chat history context is identical; no history means scope "".
+    """
+    if not history:
+        return ""
+    context = json.dumps([history.summary, [[entry.question, entry.answer] for entry in history.turns]])
+    return hashlib.sha256(context.encode("utf-8")).hexdigest()
+
+
+class HashingEmbedder:
+    """
+    Deterministic bag-of-words embedder (hashed unigrams and bigrams). Needs no network, useful offline and in tests.
+    """
+
+    def __init__(self, dimensions: int = 512):
+        self.dimensions = dimensions
+
+    async def aembed(self, text: str):
+        tokens = _TOKEN.findall(text.lower())
+        features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for feature in features:
+            vector[zlib.crc32(feature.encode("utf-8")) % self.dimensions] += 1.0
+        return vector
+
+
+class OpenAIEmbedder:
+    def __init__(self, model: str = "text-embedding-3-small"):
+        from langchain_openai import OpenAIEmbeddings
+        self._embeddings = OpenAIEmbeddings(model=model, openai_api_key=settings.OPENAI_API_KEY)
+
+    async def aembed(self, text: str):
+        return np.asarray(await self._embeddings.aembed_query(text), dtype=np.float32)
+
+
+def get_embedder(name: str):
+    if name == "hashing":
+        return HashingEmbedder()
+    if name == "openai":
+        return OpenAIEmbedder()
+    raise ValueError(f"Unknown answer cache embedder: {name}")
+
+
+class CachedAnswer:
+    def __init__(self, scope: str, question: str, vector, answer: str, product_ids, constraints=None):
+        self.scope = scope
+        self.question = question
+        self.vector = vector
+        self.answer = answer
+        self.product_ids = product_ids
+        self.constraints = constraints
+        self.created_at = time.time()
+
+
+class AnswerCache:
+    """
+    LRU/TTL cache of final answers, looked up by exact normalized question first and then by embedding similarity.
+    """
+
+    def __init__(self, embedder, max_entries: int, ttl_seconds: int, similarity_threshold: float):
+        self.embedder = embedder
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        # Per-scope vector index: (keys, matrix of unit vectors), rebuilt when the scope changes
+        self._index = {}
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    def _expired(self, entry):
+        return time.time() - entry.created_at >= self.ttl_seconds
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._index.pop(entry.scope, None)
+
+    def _scope_index(self, scope: str):
+        if scope not in self._index:
+            keys = [key for key, entry in self._entries.items() if entry.scope == scope and entry.vector is not None]
+            matrix = np.stack([self._entries[key].vector for key in keys]) if keys else None
+            self._index[scope] = (keys, matrix)
+        return self._index[scope]
+
+    async def lookup(self, question: str, scope: str, constraints=None):
+        """
+        Returns (CachedAnswer or None, question vector). Pass the vector back to store() on a miss.
+
+        A similar question is only a hit when its search constraints (categories, brands, usage, price bounds)
+        equal `constraints`: "under $50" and "under $150" embed almost alike. Without constraints only the exact
+        match applies.
+        """
+        key = (scope, normalize_question(question))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry):
+                self._remove(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return entry, entry.vector
+
+        vector = None
+        try:
+            vector = await self.embedder.aembed(key[1])
+            norm = np.linalg.norm(vector)
+            vector = vector / norm if norm else None
+        except Exception as e:
+            logging.warning(f"Answer cache embedding failed, falling back to exact match only: {str(e)}")
+
+        with self._lock:
+            if vector is not None and constraints is not None:
+                keys, matrix = self._scope_index(scope)
+                if matrix is not None:
+                    similarities = matrix @ vector
+                    # Most similar first, among those above the threshold
+                    for best in np.argsort(-similarities):
+                        if similarities[best] < self.similarity_threshold:
+                            break
+                        best_entry = self._entries.get(keys[best])
+                        if (best_entry is not None and best_entry.constraints == constraints
+                                and not self._expired(best_entry)):
+                            self._entries.move_to_end(keys[best])
+                            self.semantic_hits += 1
+                            return best_entry, vector
+
+            self.misses += 1
+        return None, vector
+
+    def store(self, question: str, scope: str, vector, answer: str, product_ids, constraints=None):
+        if not answer:
+            return
+        key = (scope, normalize_question(question))
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = CachedAnswer(scope, question, vector, answer, product_ids, constraints)
+            self._index.pop(scope, None)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._index.clear()
+
+    def stats(self):
+        lookups = self.exact_hits + self.semantic_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_ratio": round((self.exact_hits + self.semantic_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+
+_answer_cache = None
+
+
+def get_answer_cache():
+    global _answer_cache
+    if _answer_cache is None:
+        _answer_cache = AnswerCache(
+            embedder=get_embedder(settings.ANSWER_CACHE_EMBEDDER),
+            max_entries=settings.ANSWER_CACHE_MAX_ENTRIES,
+            ttl_seconds=settings.ANSWER_CACHE_TTL,
+            similarity_threshold=settings.ANSWER_CACHE_SIMILARITY_THRESHOLD,
+        )
+    return _answer_cache
@@ -0,0 +1,335 @@
+import re
+import sys
+import time
+import difflib
+import logging
+import threading
+from collections import defaultdict
+import numpy as np
+from sqlalchemy import text
+from langchain_core.tools import StructuredTool
+from core.config import settings
+from core.database import get_engine
+from services.sql_agent import PRODUCT_SCHEMA, PRODUCT_TABLE, PRODUCT_COLUMNS, USAGE_COLUMNS
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+_catalog_lock = threading.Lock()
+_catalog = None
+
+
+def tokenize(value: str):
+    return _TOKEN.findall((value or "").lower())
+
+
+def _is_set(value):
+    # Usage flags arrive as TINYINT, BIT(1) bytes or strings depending on the driver
+    if isinstance(value, (bytes, bytearray)):
+        return any(value)
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes")
+    return bool(value)
+
+
+class ProductCatalog:
+    """
+    In-memory copy of the product view: NumPy columns for price and usage flags, an inverted index over
+    category/brand/name tokens and a fuzzy name lookup.
+    """
+
+    def __init__(self):
+        self._clear()
+
+    def _clear(self):
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.prices = np.zeros(0, dtype=np.float64)
+        self.flags = np.zeros((0, len(USAGE_COLUMNS)), dtype=np.bool_)
+        self.has_overview = np.zeros(0, dtype=np.bool_)
+        self.category_codes = np.zeros(0, dtype=np.int32)
+        self.brand_codes = np.zeros(0, dtype=np.int32)
+        self.categories = []
+        self.brands = []
+        self.names = []
+        self.search_names = []
+        self.details = []
+        self.token_index = {}
+        self.row_by_id = {}
+        self.loaded_at = 0.0
+
+    def __len__(self):
+        return len(self.ids)
+
+    def copy(self):
+        """
+        A copy for add_rows to extend while requests keep reading this one. Arrays are shared: add_rows replaces
+        them instead of writing into them.
+        """
+        catalog = ProductCatalog()
+        catalog.__dict__.update(self.__dict__)
+        for attribute in ("categories", "brands", "names", "search_names", "details"):
+            setattr(catalog, attribute, list(getattr(self, attribute)))
+        catalog.token_index = dict(self.token_index)
+        catalog.row_by_id = dict(self.row_by_id)
+        return catalog
+
+    @staticmethod
+    def _code(value, values, lookup):
+        if value not in lookup:
+            lookup[value] = len(values)
+            values.append(value)
+        return lookup[value]
+
+    def add_rows(self, rows):
+        """
+        Appends rows (mappings with PRODUCT_COLUMNS and USAGE_COLUMNS); rows whose id is already loaded replace it.
+        Changes the catalog in place, so only call it on one that no request can see yet (see copy()).
+        """
+        rows = list(rows)
+        replaced = [self.row_by_id[row["id"]] for row in rows if row["id"] in self.row_by_id]
+        if replaced:
+            # Updates are rare; rebuild from the merged rows so positions stay dense
+            merged = {self.ids[i].item(): self.to_row(i) for i in range(len(self))}
+            merged.update({row["id"]: row for row in rows})
+            self._clear()
+            rows = list(merged.values())
+
+        category_lookup = {value: code for code, value in enumerate(self.categories)}
+        brand_lookup = {value: code for code, value in enumerate(self.brands)}
+        start = len(self)
+        self.ids = np.concatenate([self.ids, np.array([row["id"] for row in rows], dtype=np.int64)])
+        self.prices = np.concatenate([self.prices, np.array(
+            [np.nan if row["price_msrp"] is None else float(row["price_msrp"]) for row in rows], dtype=np.float64)])
+        self.flags = np.concatenate([self.flags, np.array(
+            [[_is_set(row.get(column)) for column in USAGE_COLUMNS] for row in rows],
+            dtype=np.bool_).reshape(len(rows), len(USAGE_COLUMNS))])
+        self.has_overview = np.concatenate([self.has_overview, np.array(
+            [bool(row.get("full_overview")) for row in rows], dtype=np.bool_)])
+        self.category_codes = np.concatenate([self.category_codes, np.array(
+            [self._code(row["category_name"], self.categories, category_lookup) for row in rows], dtype=np.int32)])
+        self.brand_codes = np.concatenate([self.brand_codes, np.array(
+            [self._code(row["brand_name"], self.brands, brand_lookup) for row in rows], dtype=np.int32)])
+
+        postings = defaultdict(list)
+        for offset, row in enumerate(rows):
+            position = start + offset
+            self.row_by_id[row["id"]] = position
+            self.names.append(row["name"] or "")
+            self.search_names.append(" ".join(tokenize(f"{row['brand_name']} {row['name']}")))
+            self.details.append((row.get("full_overview"), row.get("pros"), row.get("cons")))
+            for token in set(tokenize(row["category_name"]) + tokenize(row["brand_name"]) + tokenize(row["name"])):
+                postings[token].append(position)
+        for token, positions in postings.items():
+            existing = self.token_index.get(token)
+            new_positions = np.array(positions, dtype=np.int32)
+            self.token_index[token] = new_positions if existing is None else np.concatenate([existing, new_positions])
+        self.loaded_at = time.time()
+
+    def to_row(self, position: int):
+        overview, pros, cons = self.details[position]
+        row = {
+            "id": self.ids[position].item(),
+            "category_name": self.categories[self.category_codes[position]],
+            "brand_name": self.brands[self.brand_codes[position]],
+            "name": self.names[position],
+            "price_msrp": None if np.isnan(self.prices[position]) else self.prices[position].item(),
+            "full_overview": overview,
+            "pros": pros,
+            "cons": cons,
+        }
+        row.update({column: int(self.flags[position, i]) for i, column in enumerate(USAGE_COLUMNS)})
+        return row
+
+    def search(self, categories=None, brands=None, usage_columns=None, min_price=None, max_price=None,
+               keywords=None, budget=False, limit=4):
+        """
+        Filters with vectorized masks and returns up to `limit` product rows, premium first unless `budget`.
+        """
+        mask = np.ones(len(self), dtype=np.bool_)
+        if categories:
+            codes = [code for code, value in enumerate(self.categories) if value in categories]
+            mask &= np.isin(self.category_codes, codes)
+        if brands:
+            codes = [code for code, value in enumerate(self.brands) if value in brands]
+            mask &= np.isin(self.brand_codes, codes)
+        for column in usage_columns or []:
+            mask &= self.flags[:, USAGE_COLUMNS.index(column)]
+        if min_price is not None:
+            mask &= self.prices >= min_price
+        if max_price is not None:
+            mask &= self.prices <= max_price
+        for token in tokenize(" ".join(keywords or [])):
+            token_mask = np.zeros(len(self), dtype=np.bool_)
+            token_mask[self.token_index.get(token, np.zeros(0, dtype=np.int32))] = True
+            mask &= token_mask
+
+        positions = np.flatnonzero(mask)
+        if not len(positions):
+            return []
+        has_overview = self.has_overview[positions]
+        prices = np.nan_to_num(self.prices[positions], nan=np.inf if budget else -np.inf)
+        # lexsort sorts by the last key first: products with an overview, then by price
+        order = np.lexsort((prices if budget else -prices, ~has_overview))
+        return [self.to_row(i) for i in positions[order[:limit]]]
+
+    def get_rows(self, product_ids):
+        """
+        Product rows for the given IDs, in that order; unknown IDs are skipped.
+        """
+        positions = [self.row_by_id.get(int(product_id)) for product_id in product_ids]
+        return [self.to_row(position) for position in positions if position is not None]
+
+    def find_by_name(self, name: str, limit: int = 4, cutoff: float = 0.6):
+        """
+        Fuzzy product name lookup, used to correct misspelled product names.
+        """
+        query = " ".join(tokenize(name))
+        if not query:
+            return []
+        positions = []
+        for match in difflib.get_close_matches(query, self.search_names, n=limit, cutoff=cutoff):
+            position = self.search_names.index(match)
+            if position not in positions:
+                positions.append(position)
+        return [self.to_row(i) for i in positions]
+
+    def vocabulary(self):
+        return {"categories": sorted(self.categories), "brands": sorted(self.brands)}
+
+    def memory_footprint(self):
+        """
+        Approximate memory used by the catalog, in bytes.
+        """
+        arrays = (self.ids.nbytes + self.prices.nbytes + self.flags.nbytes + self.has_overview.nbytes
+                  + self.category_codes.nbytes + self.brand_codes.nbytes)
+        index = sum(sys.getsizeof(token) + positions.nbytes for token, positions in self.token_index.items())
+        strings = sum(sys.getsizeof(value) for value in self.names + self.search_names + self.categories + self.brands)
+        strings += sum(sys.getsizeof(value) for detail in self.details for value in detail if value is not None)
+        return {
+            "products": len(self),
+            "array_bytes": arrays,
+            "index_bytes": index,
+            "text_bytes": strings,
+            "total_bytes": arrays + index + strings,
+        }
+
+
+def _select_rows(where: str = "", params=None):
+    statement = text(
+        f"SELECT {', '.join(PRODUCT_COLUMNS + USAGE_COLUMNS)} FROM {PRODUCT_SCHEMA}.{PRODUCT_TABLE} {where}"
+    )
+    with get_engine().connect() as connection:
+        return [dict(row) for row in connection.execute(statement, params or {}).mappings()]
+
+
+def load_catalog():
+    catalog = ProductCatalog()
+    catalog.add_rows(_select_rows())
+    logging.info(f"Loaded product catalog: {catalog.memory_footprint()}")
+    return catalog
+
+
+def refresh_catalog_incremental(catalog: ProductCatalog):
+    """
+    Returns a catalog with the products added since the last load (ids above the current maximum); `catalog`
+    itself is left untouched for the requests still reading it.
+    """
+    max_id = int(catalog.ids.max()) if len(catalog) else 0
+    rows = _select_rows("WHERE id > :max_id", {"max_id": max_id})
+    refreshed = catalog.copy()
+    if rows:
+        refreshed.add_rows(rows)
+    refreshed.loaded_at = time.time()
+    return refreshed
+
+
+def get_catalog():
+    """
+    Returns the per-worker catalog, loading it on first use and picking up new products every
+    CATALOG_REFRESH_INTERVAL seconds.
+    """
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = load_catalog()
+        elif time.time() - _catalog.loaded_at >= settings.CATALOG_REFRESH_INTERVAL:
+            try:
+                # Swapped in with one assignment; readers never see a half-extended catalog
+                _catalog = refresh_catalog_incremental(_catalog)
+            except Exception as e:
+                logging.warning(f"Incremental catalog refresh failed, keeping the current copy: {str(e)}")
+                _catalog.loaded_at = time.time()
+        return _catalog
+
+
+def reload_catalog():
+    """
+    Replaces the catalog with a full reload; registered to run when the product view is rebuilt.
+    """
+    global _catalog
+    catalog = load_catalog()
+    with _catalog_lock:
+        _catalog = catalog
+
+
+def get_known_product_ids():
+    """
+    Product IDs of the loaded catalog, keyed by int, for validating the IDs an answer mentions; None when there is
+    no catalog to check against.
+    """
+    catalog = _catalog
+    if not settings.CATALOG_ENABLED or catalog is None or not len(catalog):
+        return None
+    return catalog.row_by_id
+
+
+def get_catalog_status():
+    catalog = _catalog
+    if catalog is None:
+        return {"loaded": False}
+    status = {"loaded": True, "age_seconds": round(time.time() - catalog.loaded_at, 1)}
+    status.update(catalog.memory_footprint())
+    return status
+
+
+def _format_rows(rows):
+    if not rows:
+        return "No matching products."
+    lines = []
+    for row in rows:
+        usages = [column for column in USAGE_COLUMNS if row[column]]
+        lines.append(
+            f"id={row['id']} | {row['brand_name']} {row['name']} | {row['category_name']} | "
+            f"price_msrp={row['price_msrp']} | pros={row['pros']} | cons={row['cons']} | "
+            f"{', '.join(usages) or 'no usage flags'} | full_overview={(row['full_overview'] or '')[:600]}"
+        )
+    return "\n".join(lines)
+
+
+def search_product_catalog(category: str = None, brand: str = None, usage: str = None, min_price: float = None,
+                           max_price: float = None, product_name: str = None, limit: int = 4):
+    """Search the in-memory product catalog (a copy of SG_product_full_info_materialized) without running SQL.
+    category: e.g. "Wireless Earbuds"; brand: e.g. "Jabra"; usage: comma separated usage columns such as
+    "best_for_workout,fit_small_ear"; min_price/max_price filter price_msrp; product_name finds products by
+    (possibly misspelled) name. Returns up to `limit` products with all key columns."""
+    catalog = get_catalog()
+    if product_name:
+        return _format_rows(catalog.find_by_name(product_name, limit=limit))
+    usage_columns = [column.strip() for column in (usage or "").split(",") if column.strip() in USAGE_COLUMNS]
+    categories = [value for value in catalog.categories if category and value.lower() == category.lower()]
+    brands = [value for value in catalog.brands if brand and value.lower() == brand.lower()]
+    # Values that are not exact category/brand names are matched token by token instead
+    keywords = [value for value, exact in ((category, categories), (brand, brands)) if value and not exact]
+    rows = catalog.search(
+        categories=categories,
+        brands=brands,
+        usage_columns=usage_columns,
+        min_price=min_price,
+        max_price=max_price,
+        keywords=keywords,
+        limit=limit,
+    )
+    return _format_rows(rows)
+
+
+def get_catalog_tools():
+    return [StructuredTool.from_function(search_product_catalog, name="product_catalog_search")]
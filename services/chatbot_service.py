@@ -1,254 +1,639 @@
-import re
+import time
+import base64
+import asyncio
 import logging
 import traceback
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from langchain.agents.agent_types import AgentType
-from langchain.prompts.chat import ChatPromptTemplate
-from langchain_community.agent_toolkits.sql.base import create_sql_agent
-from langchain_community.utilities.sql_database import SQLDatabase
-from langchain_core.messages import HumanMessage, AIMessage
-from langchain_community.agent_toolkits import SQLDatabaseToolkit
-from langchain_core.prompts import MessagesPlaceholder
+from datetime import datetime
+from sqlalchemy import select, delete, insert, or_, and_
+from sqlalchemy.ext.asyncio import AsyncSession
 from langchain_openai import ChatOpenAI
-from sqlalchemy.orm import Session
 from starlette import status
+from starlette.concurrency import run_in_threadpool
 from starlette.responses import JSONResponse
 from fastapi import HTTPException
 from core.config import settings
-from core.bot_history_db import ChatHistory
+from core.bot_history_db import ChatHistory, ChatSummary
+from core.database import get_async_session_factory
+from services.sql_agent import get_sql_agent, add_refresh_listener, shared_refresh_pending, apply_shared_refresh
+from services.prompts import FINAL_PROMPT, SMALL_TALK_PROMPT, GREETING_ANSWER
+from services.streaming import ProductIdStreamParser, format_sse, format_ndjson
+from services.answer_cache import get_answer_cache, scope_for_history, normalize_question
+from services.single_flight import get_single_flight
+from services.fast_path import (find_products_for_question, build_summary_question, build_follow_up_question,
+                                clear_vocabulary, question_constraints)
+from services.question_router import route_question, get_light_llm, GREETING, SMALL_TALK
+from services.catalog import get_catalog_tools, reload_catalog, get_known_product_ids
+from services.history_writer import get_history_writer, merge_pending_history, PendingChatEntry
+from services.history_cache import get_history_cache
+from services.agent_governor import (AgentBudget, BudgetCallbackHandler, within_budget, run_agent_within_budget,
+                                     record_early_stop, build_partial_answer_question, STOPPED_OUTPUT_PREFIX)
+from services.rate_limiter import get_scheduler, set_scheduling_flow, RateLimitExceeded
+from services.tracing import start_trace, finish_trace, trace_section, get_trace_callbacks
+from services.history_manager import (HistoryContext, build_history_context, schedule_summary_update,
+                                      summary_update_needed, count_message_tokens, history_stats)
 
 llm = ChatOpenAI(model_name="gpt-4o", openai_api_key=settings.OPENAI_API_KEY)
 
+# Answer of an agent run that was stopped by its budget before any query returned
+EARLY_STOP_ANSWER = ("Sorry, I could not look that up in time. Could you narrow the question down, for example by "
+                     "product type, brand or budget?")
+
+# Cached answers become stale when the product view is rebuilt
+add_refresh_listener(lambda: get_answer_cache().clear())
+add_refresh_listener(clear_vocabulary)
+if settings.CATALOG_ENABLED:
+    add_refresh_listener(reload_catalog)
+
 
 def get_final_prompt():
-    return ChatPromptTemplate.from_messages([
-        ("system", """
-                **You are a helpful assistant for Clearbuy. Your primary task is to respond to user queries by generating appropriate SQL queries, executing them on the database, and formatting the results.**
-
-                ### Instructions:
-                
-                ### Key Columns information to Use:
-                
-                - Product Columns:
-                  - `id`, `category_name`, `brand_name`, `name`, `price_msrp`, `full_overview`, `pros`, `cons`.
-                  
-                - Usage Columns:
-                  - `fit_small_ear`, `best_for_traveling`, `best_for_workout`, `best_for_work`, `best_for_music`, `best_for_gaming`, `best_for_iphone`, `best_for_samsung`, `best_for_android`.
-                
-                
-                1. Greetings:
-                   - For greetings, respond with:
-                     - "Hi there, I am your helpful product recommendation assistant chatbot from Clearbuy. How may I help you today?"
-                   - Do not perform any SQL operations for greetings.
-                
-                2. Chat History:
-                   - Use past interactions to better understand the user's preferences and previous queries.
-                   - Refer to previous questions and answers if relevant.
-                   - Ensure continuity and context in responses.
-                
-                3. Product Queries:
-                   - Retrieve up to four products relevant to the user's query, ensuring the category matches (e.g., Wireless Earbuds, Wireless Headphones, Wired Earbuds, Wired Headphones, etc). Correct spelling errors in product names.
-                   - Summarize using key attributes and full overview table detailed information but not use columns names.
-                   - Summarize using key attributes if full overview table is not available:
-                   - Key Attributes Include: pros, cons, fit_small_ear, best_for_traveling, best_for_workout, best_for_work, best_for_music, best_for_gaming, best_for_iphone, best_for_samsung, best_for_android.
-                   - Ensure summaries are concise, within 70 words, and written in one continuous sentence.
-                   - Example summary: These four products offer distinct features, making them suitable for various needs. Product A excels in performance but is pricey. Product B offers a balanced cost and quality. Product C impresses with its advanced features yet lacks durability. Product D is budget-friendly but sacrifices some functionality. Together, they cater to different preferences, from high-end users to those seeking cost-effectiveness. Choose based on your priorities.
-                   - Avoid mentioning column names directly in the response. Instead, focus on the product attributes and user value.
-                   
-                4. User-Centric Responses:
-                   - Format responses to be user-friendly and precise.
-                   - Use relevant attributes to ensure meaningful summaries.
-                   - Use spelling correction for accurate results.
-                
-                5. Concise Summaries:
-                   - Each product summary should be within 70 words.
-                   - Highlight key features and critical pros and cons but don't mention their columns name in the summary.
-                
-                6. Clear Response Formatting:
-                   - Use simple and clear language.
-                   - Organize information in a user-friendly manner.
-                   - Provide only requested details.
-                
-                7. Generate Feedback Questions:
-                   - After providing the response, ask relevant feedback questions to engage the user.
-                   - Instead of providing the same feedback each time, ask relevant questions to encourage user engagement.
-                
-                ### Responding to Product Queries:
-                - Comparison Summary:
-                  - Provide a 70-word combined review summarizing the top four products.
-                  - Summarize using key attributes details, ensuring the summary is written in one continuous sentence. 
-                  - Avoid mentioning column names directly in the response. Instead, focus on the product attributes and user value.
-                   
-                ### Guidelines:
-                
-                1. Understand the User's Query:
-                   - Identify key elements and relevant database fields.
-                
-                2. Generate and Execute SQL Query:
-                   - Write and execute a precise SQL query.
-                
-                3. Summarize and Format Results:
-                    - Include 'Product ID:' in summaries and in the product_ids key.
-                    - Summarize using key attributes, ensuring the summary is 70 words.
-                    - Avoid writing attribute names in the summary except for `id`.
-                    - Provide meaningful and concise summaries.
-                    - Avoid mentioning these columns names in response (name, category_name, brand_name, price_msrp, full_overview, pros, cons, best_list_name, fit_small_ear, best_for_traveling, best_for_workout, best_for_work, best_for_music, best_for_gaming, best_for_iphone, best_for_samsung, best_for_android).
-                    - Avoid prefacing with "Summary".  
-                    - Please use the following example response for formatting reference, but ensure your response is original and not copied verbatim.  
-                
-                4. Utilize Chat History:
-                   - Use past interactions to understand preferences.
-                   - Ensure continuity and context in responses.
-                   
-                
-                ### Example Response:
-                
-                **Product ID: 4322** **Product ID: 2289** **Product ID: 143** **Product ID: 146**
-                
-                These products offer distinct features, making them suitable for various needs. Product A excels in performance but is pricey. Product B offers a balanced cost and quality. Product C impresses with its advanced features yet lacks durability. Product D is budget-friendly but sacrifices some functionality. Together, they cater to different preferences, from high-end users to those seeking cost-effectiveness. Choose based on your priorities.
-                
-                
-                # Last Part of response
-                
-                Ensure responses answer user queries directly, providing clear and concise product comparisons and summaries. 
-                
-                After providing the response, ask relevant feedback questions to engage the user.
-        """),
-        MessagesPlaceholder(variable_name="chat_history"),
-        ("user", "{question}")
-    ])
+    # Built once at import (services/prompts.py); the instructions stay the leading, unchanged system message
+    return FINAL_PROMPT
 
 
 def extract_product_ids_and_clean_response(response_output):
     """
-    Extracts all product IDs from the response and removes their mentions from the response text.
+    Extracts the product IDs from the response and removes their markers from the response text.
 
     Args:
-        response_output (str): The original response containing product IDs.
+        response_output (str): The original response containing **Product ID: N** markers.
 
     Returns:
-        tuple: A tuple containing a sorted list of product IDs and the cleaned response string.
+        tuple: The product IDs in order of mention, deduplicated and checked against the catalog, and the cleaned
+        response with its formatting preserved.
+    """
+    parser = ProductIdStreamParser(get_known_product_ids())
+    visible, _ = parser.feed(response_output)
+    cleaned_response = (visible + parser.flush()).strip()
+    if parser.unknown_ids:
+        logging.warning(f"Dropped product IDs that are not in the catalog: {', '.join(parser.unknown_ids)}")
+    return parser.product_ids, cleaned_response
+
+
+async def fetch_user_chat_history(user_id: str, db: AsyncSession, limit: int = 10):
+    history_cache = get_history_cache()
+    if history_cache is not None:
+        cached = await history_cache.recent(user_id, limit)
+        if cached is not None:
+            return cached
+        fill = await history_cache.begin_fill(user_id)
+    # Rows still queued by the write-behind writer are served from memory so users read their own writes
+    pending = get_history_writer().pending_for(user_id)
+    result = await db.execute(
+        select(ChatHistory)
+        .where(ChatHistory.user_id == user_id)
+        .order_by(ChatHistory.created_at.desc(), ChatHistory.id.desc())
+        .limit(limit)
+    )
+    rows = merge_pending_history(pending, result.scalars().all(), limit)
+    if history_cache is not None:
+        # Fewer rows than asked for is the user's whole history
+        await history_cache.fill(user_id, fill, rows, complete=len(rows) < limit)
+    return rows
+
+
+def encode_history_cursor(entry: ChatHistory):
+    raw = f"{entry.created_at.isoformat()}|{entry.id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_history_cursor(cursor: str):
     """
+    Returns (created_at, id) of the last row of the previous page. Raises ValueError for malformed cursors.
+    """
+    try:
+        created_at, entry_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|")
+        return datetime.fromisoformat(created_at), int(entry_id)
+    except Exception:
+        raise ValueError("Invalid cursor.")
 
-    product_ids = []
-    cleaned_response = response_output
 
-    # Regular expression to match **Product ID: xxx**
-    product_id_pattern = re.compile(r"\*\*Product ID:\s*(\d+)\*\*")
+async def fetch_chat_history_page(user_id: str, db: AsyncSession, limit: int, cursor: str = None):
+    """
+    Keyset-paginated history, newest first. Returns (entries, next_cursor); next_cursor is None on the last page.
+    """
+    history_cache = get_history_cache() if not cursor else None
+    if history_cache is not None:
+        cached = await history_cache.first_page(user_id, limit)
+        if cached is not None:
+            entries, last_entry = cached
+            return entries, encode_history_cursor(last_entry) if last_entry is not None else None
+        fill = await history_cache.begin_fill(user_id)
+    pending = [] if cursor else get_history_writer().pending_for(user_id)
+    query = select(ChatHistory).where(ChatHistory.user_id == user_id)
+    if cursor:
+        created_at, entry_id = decode_history_cursor(cursor)
+        query = query.where(or_(ChatHistory.created_at < created_at,
+                                and_(ChatHistory.created_at == created_at, ChatHistory.id < entry_id)))
+    result = await db.execute(
+        query.order_by(ChatHistory.created_at.desc(), ChatHistory.id.desc()).limit(limit + 1)
+    )
+    entries = result.scalars().all()
+    next_cursor = encode_history_cursor(entries[limit - 1]) if len(entries) > limit else None
+    # Queued rows lead the first page on top of the page size; the cursor only ever points at stored rows
+    page = merge_pending_history(pending, entries[:limit], limit + len(pending))
+    if history_cache is not None:
+        await history_cache.fill(user_id, fill, page, complete=next_cursor is None)
+    return page, next_cursor
+
+
+async def load_history(user_id: str, db: AsyncSession):
+    """
+    Fetches the user's recent turns and trims them to the prompt token budget (plus the rolling summary).
+    """
+    with trace_section("fetch_user_chat_history"):
+        chat_history = await fetch_user_chat_history(user_id, db, limit=settings.HISTORY_FETCH_LIMIT)
+        history = await build_history_context(user_id, chat_history, db)
+    return history
 
-    # Find all product IDs
-    product_ids = product_id_pattern.findall(response_output)
 
-    # Remove all **Product ID: xxx** from the response
-    cleaned_response = product_id_pattern.sub('', response_output)
+async def summarize_older_turns(user_id: str, history: HistoryContext):
+    """
+    Call once the new turn is saved: folds the turns that fell out of the prompt into the rolling summary in the
+    background, so the update does not compete with the answer for the LLM and the connection pool.
+    """
+    if await summary_update_needed(user_id, history):
+        schedule_summary_update(user_id)
 
-    # Clean up any extra spaces or redundant line breaks resulting from removal
-    cleaned_response = re.sub(r'^\s*\**Product ID:\s*\d+\**\s*', '', cleaned_response, flags=re.MULTILINE)
-    cleaned_response = cleaned_response.strip()
 
-    # Optionally, if multiple **Product ID: xxx** are present in the same line,
-    # the above substitution should have removed all. However, ensure that
-    # multiple spaces resulting from removal are handled.
-    cleaned_response = re.sub(r'\s{2,}', ' ', cleaned_response)
+def record_prompt_tokens(user_question: str, history: HistoryContext):
+    """
+    Counts the tokens of the prompt we send (system prompt, history and question) and records them.
+    """
+    prompt_tokens = count_message_tokens(get_final_prompt().format_messages(question=user_question,
+                                                                           chat_history=history.messages))
+    history_stats.record(prompt_tokens, history.kept_tokens, history.dropped_tokens)
+    logging.info(f"Prompt tokens: {prompt_tokens} (history kept {history.kept_tokens}, "
+                 f"dropped {history.dropped_tokens}, summary {'yes' if history.summary else 'no'})")
+    return prompt_tokens
 
-    print(f"cleaned_response: {cleaned_response}")
 
-    # Sort the product IDs numerically
-    product_ids_sorted = sorted(product_ids, key=int)
+async def get_async_db():
+    AsyncSessionLocal = get_async_session_factory()
+    async with AsyncSessionLocal() as db:
+        yield db
 
-    return product_ids_sorted, cleaned_response
 
+async def prepare_agent_input(user_question: str, history: HistoryContext):
+    """
+    Returns the cached agent together with its inputs: the question and the user's chat history, which the agent
+    prompt places after its static instructions.
+    """
+    # The SQL database, toolkit and agent are built once per worker; the first build reflects the schema
+    extra_tools = get_catalog_tools() if settings.CATALOG_ENABLED else ()
+    agent_executor = await run_in_threadpool(get_sql_agent, llm, extra_tools)
+    return agent_executor, {"input": user_question, "chat_history": history.messages}
 
-def fetch_user_chat_history(user_id: str, db: Session, limit: int = 10):
-    return db.query(ChatHistory) \
-        .filter(ChatHistory.user_id == user_id) \
-        .order_by(ChatHistory.created_at.desc()) \
-        .limit(limit) \
-        .all()
 
+async def prepare_fast_path_messages(user_question: str, history: HistoryContext):
+    """
+    Returns the summary prompt when the fixed product query can answer the question, otherwise None.
+    """
+    if not settings.FAST_PATH_ENABLED:
+        return None
+    products = await run_in_threadpool(find_products_for_question, user_question, bool(history))
+    if not products:
+        return None
+    return get_final_prompt().format_messages(question=build_summary_question(user_question, products),
+                                              chat_history=history.messages)
 
-def format_chat_history_for_langchain(chat_history):
-    chat_history_msgs = []
-    for entry in chat_history:
-        chat_history_msgs.append(HumanMessage(content=entry.question))
-        chat_history_msgs.append(AIMessage(content=entry.answer))
-    return chat_history_msgs
 
+def light_route_messages(user_question: str, history: HistoryContext, route):
+    """
+    Prompt of a small talk answer, or of a follow-up answered from the previous answer's products.
+    """
+    if route.name == SMALL_TALK:
+        return SMALL_TALK_PROMPT.format_messages(question=user_question, chat_history=history.messages)
+    return get_final_prompt().format_messages(question=build_follow_up_question(user_question, route.products),
+                                              chat_history=history.messages)
 
-def get_db():
-    from sqlalchemy import create_engine
-    from sqlalchemy.orm import sessionmaker
 
-    engine = create_engine(settings.DATABASE_URI)
-    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def new_agent_budget():
+    return AgentBudget(settings.AGENT_MAX_SECONDS, settings.AGENT_MAX_TOKENS)
 
-    # Yield the database session and ensure it closes after use
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
 
+def partial_answer_messages(user_question: str, history: HistoryContext, observations):
+    """
+    Prompt that answers from the query results of an agent run that was stopped early, or None without results.
+    """
+    if not observations:
+        return None
+    return get_final_prompt().format_messages(question=build_partial_answer_question(user_question, observations),
+                                              chat_history=history.messages)
 
-def get_openai_response_with_langchain(user_question: str, db: Session, user_id: str):
-    try:
-        # Fetch the chat history for the given user
-        chat_history = fetch_user_chat_history(user_id, db, limit=10)
-        formatted_chat_history = format_chat_history_for_langchain(chat_history)
-
-        sql_database = SQLDatabase.from_uri(settings.DATABASE_URI,
-                                            view_support=True,
-                                            schema='clearbuydb',
-                                            include_tables=['SG_product_full_info_materialized'],
-                                            sample_rows_in_table_info=(3))
-
-        toolkit = SQLDatabaseToolkit(db=sql_database, llm=llm)
-
-        agent_executor = create_sql_agent(
-            llm=llm,
-            toolkit=toolkit,
-            verbose=False,
-            agent_type=AgentType.OPENAI_FUNCTIONS,
-            max_iterations=30
-        )
 
-        # Prepare the final prompt using chat history
-        final_prompt = get_final_prompt().format(question=user_question, chat_history=formatted_chat_history)
+async def generate_answer(user_question: str, history: HistoryContext, route):
+    """
+    Answers greetings without an LLM call and small talk and follow-ups with the light model; product searches
+    with the fast path (one query plus one LLM call) when possible, otherwise with the SQL agent. Returns
+    (answer, stopped early), the latter True when the agent's budget cut the run short.
+    """
+    if route.name == GREETING:
+        return GREETING_ANSWER, False
+    if route.light:
+        # No LLM slot: the light model has its own OpenAI rate limit and answers in one short call
+        response = await get_light_llm().ainvoke(light_route_messages(user_question, history, route),
+                                                 config={"callbacks": get_trace_callbacks()})
+        return response.content, False
+
+    messages = await prepare_fast_path_messages(user_question, history)
+    if messages is not None:
+        async with get_scheduler().slot():
+            response = await llm.ainvoke(messages, config={"callbacks": get_trace_callbacks()})
+        return response.content, False
+
+    agent_executor, agent_input = await prepare_agent_input(user_question, history)
+
+    # Invoke the agent with the prompt, within this request's time and token budget
+    async with get_scheduler().slot():
+        budget = new_agent_budget()
+        output, observations = await run_agent_within_budget(agent_executor, agent_input, budget,
+                                                             get_trace_callbacks() + [BudgetCallbackHandler(budget)])
+        if output is not None:
+            return output, False
+        record_early_stop(budget, len(observations))
+        messages = partial_answer_messages(user_question, history, observations)
+        if messages is None:
+            return EARLY_STOP_ANSWER, True
+        response = await llm.ainvoke(messages, config={"callbacks": get_trace_callbacks()})
+    return response.content, True
+
+
+async def stream_answer(user_question: str, history: HistoryContext, route):
+    """
+    Streaming counterpart of generate_answer. Yields ("progress", step) and ("text", chunk) pairs, ("stopped", reason)
+    when the agent's budget cut the run short, then ("output", full answer).
+    """
+    if route.name == GREETING:
+        yield "text", GREETING_ANSWER
+        yield "output", GREETING_ANSWER
+        return
+    if route.light:
+        chunks = []
+        async for chunk in get_light_llm().astream(light_route_messages(user_question, history, route),
+                                                   config={"callbacks": get_trace_callbacks()}):
+            chunks.append(chunk.content)
+            yield "text", chunk.content
+        yield "output", "".join(chunks)
+        return
+
+    messages = await prepare_fast_path_messages(user_question, history)
+    if messages is not None:
+        yield "progress", "product_lookup"
+        chunks = []
+        async with get_scheduler().slot():
+            async for chunk in llm.astream(messages, config={"callbacks": get_trace_callbacks()}):
+                chunks.append(chunk.content)
+                yield "text", chunk.content
+        yield "output", "".join(chunks)
+        return
+
+    agent_executor, agent_input = await prepare_agent_input(user_question, history)
+    response_output = None
+    observations = []
+    async with get_scheduler().slot():
+        budget = new_agent_budget()
+        callbacks = get_trace_callbacks() + [BudgetCallbackHandler(budget)]
+        events = agent_executor.astream_events(agent_input, version="v2", config={"callbacks": callbacks})
+        async for event in within_budget(events, budget):
+            kind = event["event"]
+            if kind == "on_tool_start":
+                yield "progress", event["name"]
+            elif kind == "on_tool_end":
+                observations.append(str(event["data"].get("output", "")))
+            elif kind == "on_chat_model_stream":
+                yield "text", event["data"]["chunk"].content
+            elif kind == "on_chain_end" and not event["parent_ids"]:
+                response_output = event["data"]["output"].get("output", "")
+        if response_output is not None and response_output.startswith(STOPPED_OUTPUT_PREFIX):
+            budget.stop("iterations")
+            response_output = None
+        if response_output is None:
+            record_early_stop(budget, len(observations))
+            yield "stopped", budget.reason
+            messages = partial_answer_messages(user_question, history, observations)
+            if messages is None:
+                response_output = EARLY_STOP_ANSWER
+                yield "text", response_output
+            else:
+                chunks = []
+                async for chunk in llm.astream(messages, config={"callbacks": get_trace_callbacks()}):
+                    chunks.append(chunk.content)
+                    yield "text", chunk.content
+                response_output = "".join(chunks)
+    yield "output", response_output
+
+
+async def lookup_cached_answer(user_question: str, history: HistoryContext, route):
+    """
+    Checks the answer cache; returns (cached answer or None, a callback that stores the fresh answer on a miss).
+    """
+    # Every cache and the catalog behind this point must reflect a refresh another worker made
+    if shared_refresh_pending():
+        await run_in_threadpool(apply_shared_refresh)
+    # A greeting costs less to answer than to embed
+    if not settings.ANSWER_CACHE_ENABLED or route.name == GREETING:
+        return None, lambda answer, product_ids: None
+    answer_cache = get_answer_cache()
+    scope = scope_for_history(history)
+    try:
+        # The brand vocabulary may need a query on first use
+        constraints = await run_in_threadpool(question_constraints, user_question)
+    except Exception as e:
+        logging.warning(f"Reading the search constraints failed, using exact answer cache matches: {str(e)}")
+        constraints = None
+    cached, vector = await answer_cache.lookup(user_question, scope, constraints)
+    return cached, lambda answer, product_ids: answer_cache.store(user_question, scope, vector, answer, product_ids,
+                                                                  constraints)
 
-        # Invoke the LLM with the prompt
-        response = agent_executor.invoke({"input": final_prompt})
-        response_output = response.get("output", "")
 
+async def produce_answer(user_question: str, history: HistoryContext, store_answer, route):
+    """
+    Generates a fresh answer and returns (product_ids, cleaned response, stopped early).
+    """
+    response_output, stopped_early = await generate_answer(user_question, history, route)
+    with trace_section("extract_product_ids"):
         product_ids, cleaned_response = extract_product_ids_and_clean_response(response_output)
+    if not stopped_early:
+        # A fallback or partial answer is fine once, but must not be served to everyone asking alike
+        store_answer(cleaned_response, product_ids)
+    return product_ids, cleaned_response, stopped_early
 
-        # Save the chat history
-        new_entry = ChatHistory(user_id=user_id, question=user_question, answer=cleaned_response)
-        new_entry.set_product_ids(product_ids)
-        db.add(new_entry)
-        db.commit()
 
+async def answer_question(user_question: str, history: HistoryContext, store_answer, route):
+    """
+    produce_answer, shared by identical questions in flight at the same time with the same (or no) history
+    context; each caller still saves its own chat entry. Answers of runs that stopped early are not shared.
+    Returns (product_ids, cleaned response).
+    """
+    if not settings.COALESCE_REQUESTS_ENABLED:
+        product_ids, cleaned_response, _ = await produce_answer(user_question, history, store_answer, route)
+        return product_ids, cleaned_response
+    key = (scope_for_history(history), normalize_question(user_question))
+    product_ids, cleaned_response, _ = await get_single_flight().run(
+        key, lambda: produce_answer(user_question, history, store_answer, route),
+        shareable=lambda result: not result[2])
+    return product_ids, cleaned_response
+
+
+async def route_for(user_question: str, history: HistoryContext, trace):
+    with trace_section("route_question"):
+        route = await route_question(user_question, history)
+    trace.route = route.name
+    return route
+
+
+async def remember_chat_entry(entry: PendingChatEntry):
+    # The user's next question reads its history from the cache, new answer included
+    history_cache = get_history_cache()
+    if history_cache is not None:
+        await history_cache.append(entry.user_id, entry)
+
+
+async def save_chat_entry(db: AsyncSession, user_id: str, user_question: str, answer: str, product_ids):
+    if settings.HISTORY_WRITE_BEHIND_ENABLED:
+        await remember_chat_entry(get_history_writer().enqueue(user_id, user_question, answer, product_ids))
+        return
+    new_entry = ChatHistory(user_id=user_id, question=user_question, answer=answer)
+    new_entry.set_product_ids(product_ids)
+    db.add(new_entry)
+    await db.commit()
+    await remember_chat_entry(PendingChatEntry(user_id, user_question, answer, product_ids))
+
+
+async def get_openai_response_with_langchain(user_question: str, db: AsyncSession, user_id: str,
+                                             debug_trace: bool = False):
+    trace = start_trace("ask")
+    # LLM work of this request waits for a slot in the user's own queue (services/rate_limiter.py)
+    set_scheduling_flow(user_id)
+    try:
+        # Fetch the chat history for the given user
+        history = await load_history(user_id, db)
+        prompt_tokens = record_prompt_tokens(user_question, history)
+        route = await route_for(user_question, history, trace)
+
+        cached, store_answer = await lookup_cached_answer(user_question, history, route)
+        if cached is not None:
+            product_ids, cleaned_response = cached.product_ids, cached.answer
+        else:
+            product_ids, cleaned_response = await answer_question(user_question, history, store_answer, route)
+
+        # Save the chat history
+        with trace_section("save_chat_entry"):
+            await save_chat_entry(db, user_id, user_question, cleaned_response, product_ids)
+        await summarize_older_turns(user_id, history)
+
+        data = {
+            "user_question": user_question,
+            "response": cleaned_response,
+            "product_ids": product_ids
+        }
+        finish_trace(trace, "success")
+        if debug_trace:
+            data["trace"] = trace.to_dict()
         return JSONResponse(
             status_code=status.HTTP_200_OK,
             content={
                 "status": True,
                 "message": "Success",
-                "data": {
-                    "user_question": user_question,
-                    "response": cleaned_response,
-                    "product_ids": product_ids
-                }
-            }
+                "data": data
+            },
+            headers={"X-Prompt-Tokens": str(prompt_tokens)}
         )
+    except RateLimitExceeded:
+        finish_trace(trace, "rejected")
+        raise
     except Exception as e:
+        finish_trace(trace, "error")
         logging.error(f"Error in get_openai_response_with_langchain: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
-def clear_chat_history(user_id: str, db: Session):
+async def stream_openai_response_with_langchain(user_question: str, user_id: str, debug_trace: bool = False):
+    """
+    Yields Server-Sent Events for one question: agent progress, answer tokens, product IDs and a final done event.
+
+    The stream owns its database session because it outlives the request's dependencies.
+    """
+    trace = start_trace("ask_stream")
+    set_scheduling_flow(user_id)
+    yield format_sse("progress", {"step": "started"})
+    try:
+        AsyncSessionLocal = get_async_session_factory()
+        async with AsyncSessionLocal() as db:
+            # Fetch the chat history for the given user
+            history = await load_history(user_id, db)
+            record_prompt_tokens(user_question, history)
+            route = await route_for(user_question, history, trace)
+
+            cached, store_answer = await lookup_cached_answer(user_question, history, route)
+            if cached is not None:
+                product_ids, cleaned_response = cached.product_ids, cached.answer
+                yield format_sse("product_ids", {"product_ids": product_ids})
+                yield format_sse("token", {"text": cleaned_response})
+            else:
+                parser = ProductIdStreamParser(get_known_product_ids())
+                response_output = ""
+                stopped_early = False
+                answer_started = False
+                async for kind, value in stream_answer(user_question, history, route):
+                    if kind == "progress":
+                        yield format_sse("progress", {"step": value})
+                    elif kind == "stopped":
+                        stopped_early = True
+                    elif kind == "text":
+                        text, new_ids = parser.feed(value)
+                        if new_ids:
+                            yield format_sse("product_ids", {"product_ids": parser.product_ids})
+                        if not answer_started:
+                            # Markers usually lead the answer; skip the whitespace they leave behind
+                            text = text.lstrip()
+                            answer_started = bool(text)
+                        if text:
+                            yield format_sse("token", {"text": text})
+                    else:
+                        response_output = value
+
+                remaining = parser.flush()
+                if remaining:
+                    yield format_sse("token", {"text": remaining})
+
+                # The stored answer is the agent's final output, which excludes text streamed by intermediate steps
+                with trace_section("extract_product_ids"):
+                    product_ids, cleaned_response = extract_product_ids_and_clean_response(response_output)
+                if not stopped_early:
+                    store_answer(cleaned_response, product_ids)
+
+            # Save the chat history once the answer is complete
+            with trace_section("save_chat_entry"):
+                await save_chat_entry(db, user_id, user_question, cleaned_response, product_ids)
+            await summarize_older_turns(user_id, history)
+
+        done = {
+            "user_question": user_question,
+            "response": cleaned_response,
+            "product_ids": product_ids
+        }
+        finish_trace(trace, "success")
+        if debug_trace:
+            done["trace"] = trace.to_dict()
+        yield format_sse("done", done)
+    except RateLimitExceeded as e:
+        finish_trace(trace, "rejected")
+        yield format_sse("error", {"detail": "Too many requests, please retry later.", "retry_after": round(e.retry_after, 1)})
+    except Exception as e:
+        finish_trace(trace, "error")
+        logging.error(f"Error in stream_openai_response_with_langchain: {str(e)}")
+        yield format_sse("error", {"detail": "Internal Server Error, please check the logs."})
+
+
+async def answer_batch_item(index: int, user_question: str, user_id: str, entries):
+    """
+    Answers one item of a batch like /ask does. The chat history row and the history it was answered with are
+    appended to `entries` for the bulk insert at the end of the batch (or the row is queued on the write-behind
+    writer).
+    """
+    trace = start_trace("ask_batch")
+    # Batch items share one flow, so a large batch gets one user's share of the slots and never 429s
+    set_scheduling_flow("batch", bounded=False)
+    try:
+        AsyncSessionLocal = get_async_session_factory()
+        async with AsyncSessionLocal() as db:
+            history = await load_history(user_id, db)
+        record_prompt_tokens(user_question, history)
+        route = await route_for(user_question, history, trace)
+
+        cached, store_answer = await lookup_cached_answer(user_question, history, route)
+        if cached is not None:
+            product_ids, cleaned_response = cached.product_ids, cached.answer
+        else:
+            product_ids, cleaned_response = await answer_question(user_question, history, store_answer, route)
+
+        if settings.HISTORY_WRITE_BEHIND_ENABLED:
+            await remember_chat_entry(get_history_writer().enqueue(user_id, user_question, cleaned_response,
+                                                                   product_ids))
+            await summarize_older_turns(user_id, history)
+        else:
+            entries.append((PendingChatEntry(user_id, user_question, cleaned_response, product_ids), history))
+        finish_trace(trace, "success")
+        return {"index": index, "status": True, "user_id": user_id, "user_question": user_question,
+                "response": cleaned_response, "product_ids": product_ids}
+    except Exception as e:
+        finish_trace(trace, "error")
+        logging.error(f"Error in answer_batch_item: {str(e)}")
+        return {"index": index, "status": False, "user_id": user_id, "user_question": user_question,
+                "detail": "Internal Server Error, please check the logs."}
+
+
+async def insert_chat_entries(entries):
+    """
+    Bulk-inserts (chat history row, history) pairs in chunks of HISTORY_WRITE_BATCH_SIZE, then adds the rows to
+    the history cache and starts the summary updates they call for.
+    """
+    AsyncSessionLocal = get_async_session_factory()
+    async with AsyncSessionLocal() as db:
+        for start in range(0, len(entries), settings.HISTORY_WRITE_BATCH_SIZE):
+            chunk = entries[start:start + settings.HISTORY_WRITE_BATCH_SIZE]
+            await db.execute(insert(ChatHistory), [entry.to_row() for entry, _ in chunk])
+        await db.commit()
+    # Only committed rows are cached, so a failed or cancelled insert leaves no turns the database lacks
+    for entry, _ in entries:
+        await remember_chat_entry(entry)
+    for entry, history in entries:
+        await summarize_older_turns(entry.user_id, history)
+
+
+async def stream_batch_answers(items, parallelism: int):
+    """
+    Answers (user_id, user_question) pairs with at most `parallelism` in flight and yields one NDJSON record per
+    item as it completes (with its position in `index`), then a summary record.
+    """
+    started = time.perf_counter()
+    results = asyncio.Queue()
+    entries = []
+    next_index = iter(range(len(items)))
+
+    async def worker():
+        for index in next_index:
+            user_id, user_question = items[index]
+            await results.put(await answer_batch_item(index, user_question, user_id, entries))
+
+    workers = [asyncio.create_task(worker()) for _ in range(min(parallelism, len(items)))]
+    succeeded = 0
+    try:
+        for _ in range(len(items)):
+            result = await results.get()
+            succeeded += result["status"]
+            yield format_ndjson(result)
+        if entries:
+            await insert_chat_entries(entries)
+        yield format_ndjson({"done": True, "items": len(items), "succeeded": succeeded,
+                             "failed": len(items) - succeeded,
+                             "elapsed_s": round(time.perf_counter() - started, 3)})
+    except Exception as e:
+        logging.error(f"Error in stream_batch_answers: {str(e)}")
+        yield format_ndjson({"done": False, "detail": "Internal Server Error, please check the logs."})
+    finally:
+        # The client went away or the batch is over; stop answering
+        for task in workers:
+            task.cancel()
+
+
+async def clear_chat_history(user_id: str, db: AsyncSession):
     try:
-        db.query(ChatHistory).filter(ChatHistory.user_id == user_id).delete()
-        db.commit()
+        # Drop queued rows first so the writer cannot re-insert them after the delete
+        discarded = await get_history_writer().discard_user(user_id)
+        result = await db.execute(delete(ChatHistory).where(ChatHistory.user_id == user_id))
+        if not result.rowcount and not discarded:
+            await db.rollback()
+            raise HTTPException(
+                status_code=404,
+                detail=f"No records found for user ID: {user_id}."
+            )
+        await db.execute(delete(ChatSummary).where(ChatSummary.user_id == user_id))
+        await db.commit()
+        history_cache = get_history_cache()
+        if history_cache is not None:
+            await history_cache.invalidate(user_id)
         return JSONResponse(
             status_code=status.HTTP_200_OK,
             content={
@@ -256,14 +641,24 @@ def clear_chat_history(user_id: str, db: Session):
                 "message": "Success",
             }
         )
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error in clear_chat_history: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal Server Error, please check the logs.")
 
 
-def get_user_chat_history(user_id: str, db: Session):
+async def get_user_chat_history(user_id: str, db: AsyncSession, limit: int = 10, cursor: str = None):
     try:
-        chat_history = fetch_user_chat_history(user_id, db)
+        try:
+            chat_history, next_cursor = await fetch_chat_history_page(user_id, db, limit, cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if not chat_history and not cursor:
+            raise HTTPException(
+                status_code=404,
+                detail=f"No Chat history found for user ID: {user_id}."
+            )
         formatted_chat_history = []
         for entry in chat_history:
             formatted_chat_history.append({
@@ -278,9 +673,12 @@ def get_user_chat_history(user_id: str, db: Session):
             content={
                 "status": True,
                 "message": "Success",
-                "data": formatted_chat_history
+                "data": formatted_chat_history,
+                "next_cursor": next_cursor
             }
         )
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error in get_user_chat_history: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal Server Error, please check the logs.")
@@ -1,11 +1,39 @@
-from sqlalchemy import create_engine
-from core.config import settings
-from core.bot_history_db import Base, ChatHistory
+import logging
+from sqlalchemy import inspect, text
+from core.database import get_engine
+from core.bot_history_db import Base, ChatHistory, ChatSummary
+
+CHAT_HISTORY_INDEX = "ix_chat_history_user_created"
 
 
 def init_db():
-    engine = create_engine(settings.DATABASE_URI)
-    Base.metadata.create_all(bind=engine, tables=[ChatHistory.__table__])
+    engine = get_engine()
+    Base.metadata.create_all(bind=engine, tables=[ChatHistory.__table__, ChatSummary.__table__])
+    migrate_chat_history(engine)
+
+
+def migrate_chat_history(engine):
+    """
+    Brings a chat_history table created by an earlier version up to date: adds the (user_id, created_at, id) index
+    and converts product_ids from json.dumps text to a native JSON column. Safe to run repeatedly.
+    """
+    schema = ChatHistory.__table__.schema
+    table = f"{schema}.{ChatHistory.__tablename__}"
+    inspector = inspect(engine)
+
+    indexes = {index["name"] for index in inspector.get_indexes(ChatHistory.__tablename__, schema=schema)}
+    if CHAT_HISTORY_INDEX not in indexes:
+        logging.info(f"Adding index {CHAT_HISTORY_INDEX} to {table}")
+        next(index for index in ChatHistory.__table__.indexes if index.name == CHAT_HISTORY_INDEX).create(bind=engine)
+
+    columns = {column["name"]: column for column in inspector.get_columns(ChatHistory.__tablename__, schema=schema)}
+    product_ids_type = str(columns["product_ids"]["type"]).upper()
+    if engine.dialect.name == "mysql" and product_ids_type != "JSON":
+        logging.info(f"Converting {table}.product_ids to JSON")
+        with engine.begin() as connection:
+            # Existing values were written with json.dumps; blank strings would fail the conversion
+            connection.execute(text(f"UPDATE {table} SET product_ids = NULL WHERE product_ids = ''"))
+            connection.execute(text(f"ALTER TABLE {table} MODIFY product_ids JSON NULL"))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,294 @@
+import re
+import logging
+import threading
+from sqlalchemy import text, bindparam
+from core.config import settings
+from core.database import get_engine
+from services.sql_agent import PRODUCT_SCHEMA, PRODUCT_TABLE
+from services.catalog import PRODUCT_COLUMNS, USAGE_COLUMNS, get_catalog
+
+MAX_PRODUCTS = 4
+MAX_OVERVIEW_CHARS = 600
+
+USAGE_KEYWORDS = {
+    "fit_small_ear": r"small ears?|tiny ears?|small fit",
+    "best_for_traveling": r"travel\w*|flights?|plane|commut\w*",
+    "best_for_workout": r"workouts?|gym|running|runs?|jogging|exercis\w*|sports?|training|climbing|fitness",
+    # Not bare "work": "earbuds that work with iphone" is about compatibility
+    "best_for_work": r"for work|at work|work calls?|working from home|wfh|office|calls?|meetings?|zoom",
+    "best_for_music": r"music|audiophile|sound quality",
+    "best_for_gaming": r"gam(?:e|es|ing|er|ers)",
+    "best_for_iphone": r"iphones?|ios",
+    "best_for_samsung": r"samsung|galaxy",
+    "best_for_android": r"android|pixel",
+}
+USAGE_PATTERNS = {column: re.compile(rf"\b(?:{pattern})\b") for column, pattern in USAGE_KEYWORDS.items()}
+
+EARBUDS_PATTERN = re.compile(r"\b(?:ear ?buds?|earphones?|in-ear|buds|iems?)\b")
+HEADPHONES_PATTERN = re.compile(r"\b(?:head ?phones?|headsets?|over-ear|on-ear|cans)\b")
+WIRED_PATTERN = re.compile(r"\bwired\b")
+WIRELESS_PATTERN = re.compile(r"\b(?:wireless|bluetooth|true wireless|tws)\b")
+
+# A number followed by a unit is a spec ("at least 8 hours", "up to 10 people"), not a price
+_UNITS = (r"(?:(?:hours?|hrs?|h|minutes?|mins?|days?|weeks?|months?|years?|people|persons?|users?|devices?|phones?|"
+          r"connections?|meters?|feet|ft|mm|cm|inch(?:es)?|g|grams?|oz|ounces?|db|hz|khz|ohms?|mah|watts?|gb|mb|"
+          r"percent|x|times|pairs?)\b|%)")
+_NOT_A_UNIT = rf"(?!\.?\d|\s*{_UNITS})"
+MAX_PRICE_PATTERN = re.compile(r"\b(?:under|below|less than|cheaper than|up to|max(?:imum)?|within|no more than)\s*\$?\s*(\d+(?:\.\d+)?)" + _NOT_A_UNIT)
+MIN_PRICE_PATTERN = re.compile(r"\b(?:over|above|more than|at least|min(?:imum)?|starting at)\s*\$?\s*(\d+(?:\.\d+)?)" + _NOT_A_UNIT)
+PRICE_RANGE_PATTERN = re.compile(r"(?:between\s*)?\$\s*(\d+(?:\.\d+)?)\s*(?:-|to|and)\s*\$?\s*(\d+(?:\.\d+)?)|between\s*(\d+(?:\.\d+)?)\s*(?:-|to|and)\s*(\d+(?:\.\d+)?)" + _NOT_A_UNIT)
+BUDGET_PATTERN = re.compile(r"\b(?:cheap\w*|budget|affordable|inexpensive|low cost|value)\b")
+
+# Questions the fixed query cannot answer faithfully are left to the agent. "is/are the" asks about a specific
+# product ("is the Elite 7 waterproof") unless a superlative follows ("what are the best earbuds for the gym")
+UNSUPPORTED_PATTERN = re.compile(r"\b(?:vs\.?|versus|compare\w*|comparison|difference|differences|review of|tell me about|"
+                                 r"how does|how do|what about|specs?|battery life of)\b|"
+                                 r"\b(?:is|are) the (?!(?:\w+est|top|most|least|good)\b)")
+# The fixed query has no column for specs like battery hours, so it would ignore them
+SPEC_PATTERN = re.compile(rf"\d\s*{_UNITS}")
+FOLLOW_UP_PATTERN = re.compile(r"\b(?:it|its|they|them|those|these|that one|this one|the first|the second|the third|"
+                               r"the fourth|the last|another|other|others|more like|cheaper ones?|instead|also)\b")
+
+_vocabulary_lock = threading.Lock()
+_vocabulary = None
+
+
+class ProductQuery:
+    """
+    Slots extracted from a product search question.
+    """
+
+    def __init__(self, categories, brands, usage_columns, min_price=None, max_price=None, budget=False):
+        self.categories = categories
+        self.brands = brands
+        self.usage_columns = usage_columns
+        self.min_price = min_price
+        self.max_price = max_price
+        self.budget = budget
+
+    def constraints(self):
+        """
+        The slots as a comparable tuple; questions that differ in any of them are answered with different products.
+        """
+        return (tuple(self.categories), tuple(self.brands), tuple(self.usage_columns), self.min_price,
+                self.max_price, self.budget)
+
+
+def load_vocabulary():
+    """
+    Returns the distinct category and brand names of the product view, loaded once per worker.
+    """
+    global _vocabulary
+    if settings.CATALOG_ENABLED:
+        return get_catalog().vocabulary()
+    with _vocabulary_lock:
+        if _vocabulary is None:
+            with get_engine().connect() as connection:
+                rows = connection.execute(text(
+                    f"SELECT DISTINCT category_name, brand_name FROM {PRODUCT_SCHEMA}.{PRODUCT_TABLE}"
+                )).all()
+            _vocabulary = {
+                "categories": sorted({row[0] for row in rows if row[0]}),
+                "brands": sorted({row[1] for row in rows if row[1]}),
+            }
+        return _vocabulary
+
+
+def clear_vocabulary():
+    global _vocabulary
+    with _vocabulary_lock:
+        _vocabulary = None
+
+
+def _contains_phrase(question: str, phrase: str):
+    return re.search(rf"(?<!\w){re.escape(phrase.lower())}(?!\w)", question) is not None
+
+
+def _match_categories(question: str, categories):
+    exact = [category for category in categories if _contains_phrase(question, category)]
+    if exact:
+        return exact
+
+    if EARBUDS_PATTERN.search(question):
+        product_type = "earbuds"
+    elif HEADPHONES_PATTERN.search(question):
+        product_type = "headphones"
+    else:
+        return []
+    wired = WIRED_PATTERN.search(question) is not None
+    wireless = WIRELESS_PATTERN.search(question) is not None
+
+    matched = []
+    for category in categories:
+        name = category.lower()
+        if product_type not in name:
+            continue
+        is_wired = name.startswith("wired")
+        if (wired and not wireless and not is_wired) or (wireless and not wired and is_wired):
+            continue
+        matched.append(category)
+    return matched
+
+
+def _match_prices(question: str):
+    min_price, max_price = None, None
+    price_range = PRICE_RANGE_PATTERN.search(question)
+    if price_range:
+        low, high = [float(value) for value in price_range.groups() if value is not None]
+        return min(low, high), max(low, high)
+    max_match = MAX_PRICE_PATTERN.search(question)
+    if max_match:
+        max_price = float(max_match.group(1))
+    min_match = MIN_PRICE_PATTERN.search(question)
+    if min_match:
+        min_price = float(min_match.group(1))
+    return min_price, max_price
+
+
+def mentions_search_constraint(question: str, vocabulary):
+    """
+    Whether the lowercased question names a brand, a price or a budget.
+    """
+    min_price, max_price = _match_prices(question)
+    if min_price is not None or max_price is not None or BUDGET_PATTERN.search(question):
+        return True
+    return any(_contains_phrase(question, brand) for brand in vocabulary["brands"])
+
+
+def parse_product_query(user_question: str, vocabulary, has_chat_history: bool = False):
+    """
+    Rule-based slot extraction. Returns a ProductQuery, or None when the question needs the full agent.
+    """
+    question = user_question.lower()
+    if UNSUPPORTED_PATTERN.search(question) or SPEC_PATTERN.search(question):
+        return None
+    if has_chat_history and FOLLOW_UP_PATTERN.search(question):
+        return None
+
+    query = extract_product_query(question, vocabulary)
+    if not query.categories:
+        return None
+    return query
+
+
+def extract_product_query(question: str, vocabulary):
+    """
+    Fills every slot the lowercased question mentions, without deciding whether the fast path can answer it.
+    """
+    categories = _match_categories(question, vocabulary["categories"])
+    brands = [brand for brand in vocabulary["brands"] if _contains_phrase(question, brand)]
+    usage_columns = [column for column, pattern in USAGE_PATTERNS.items() if pattern.search(question)]
+    min_price, max_price = _match_prices(question)
+    return ProductQuery(categories, brands, usage_columns, min_price, max_price,
+                        budget=BUDGET_PATTERN.search(question) is not None)
+
+
+def question_constraints(user_question: str):
+    """
+    The search constraints of a question (see ProductQuery.constraints); the answer cache keys semantic hits on them.
+    """
+    return extract_product_query(user_question.lower(), load_vocabulary()).constraints()
+
+
+def build_product_sql(query: ProductQuery):
+    """
+    Builds the parameterized SELECT for a ProductQuery.
+    """
+    conditions = ["category_name IN :categories"]
+    params = {"categories": query.categories, "limit": MAX_PRODUCTS}
+    bind_params = [bindparam("categories", expanding=True)]
+    if query.brands:
+        conditions.append("brand_name IN :brands")
+        params["brands"] = query.brands
+        bind_params.append(bindparam("brands", expanding=True))
+    for column in query.usage_columns:
+        # Column names come from USAGE_COLUMNS, never from user input
+        conditions.append(f"{column} = 1")
+    if query.min_price is not None:
+        conditions.append("price_msrp >= :min_price")
+        params["min_price"] = query.min_price
+    if query.max_price is not None:
+        conditions.append("price_msrp <= :max_price")
+        params["max_price"] = query.max_price
+
+    order = "ASC" if query.budget else "DESC"
+    statement = text(
+        f"SELECT {', '.join(PRODUCT_COLUMNS + USAGE_COLUMNS)} FROM {PRODUCT_SCHEMA}.{PRODUCT_TABLE} "
+        f"WHERE {' AND '.join(conditions)} "
+        f"ORDER BY CASE WHEN full_overview IS NULL THEN 1 ELSE 0 END, price_msrp {order} "
+        f"LIMIT :limit"
+    ).bindparams(*bind_params)
+    return statement, params
+
+
+def fetch_products(query: ProductQuery):
+    if settings.CATALOG_ENABLED:
+        return get_catalog().search(categories=query.categories, brands=query.brands,
+                                    usage_columns=query.usage_columns, min_price=query.min_price,
+                                    max_price=query.max_price, budget=query.budget, limit=MAX_PRODUCTS)
+    statement, params = build_product_sql(query)
+    with get_engine().connect() as connection:
+        return [dict(row) for row in connection.execute(statement, params).mappings()]
+
+
+def fetch_products_by_id(product_ids):
+    """
+    Product rows for the given IDs (e.g. those of an earlier answer), in that order.
+    """
+    product_ids = [int(product_id) for product_id in product_ids][:MAX_PRODUCTS]
+    if not product_ids:
+        return []
+    if settings.CATALOG_ENABLED:
+        return get_catalog().get_rows(product_ids)
+    statement = text(
+        f"SELECT {', '.join(PRODUCT_COLUMNS + USAGE_COLUMNS)} FROM {PRODUCT_SCHEMA}.{PRODUCT_TABLE} WHERE id IN :ids"
+    ).bindparams(bindparam("ids", expanding=True))
+    with get_engine().connect() as connection:
+        rows = {row["id"]: dict(row) for row in connection.execute(statement, {"ids": product_ids}).mappings()}
+    return [rows[product_id] for product_id in product_ids if product_id in rows]
+
+
+def format_products_for_prompt(products):
+    lines = []
+    for product in products:
+        usages = [column for column in USAGE_COLUMNS if product.get(column) in (1, True, "1")]
+        overview = (product.get("full_overview") or "")[:MAX_OVERVIEW_CHARS]
+        lines.append(
+            f"- Product ID: {product['id']} | {product['brand_name']} {product['name']} | "
+            f"{product['category_name']} | price: {product['price_msrp']} | pros: {product.get('pros') or 'n/a'} | "
+            f"cons: {product.get('cons') or 'n/a'} | suited for: {', '.join(usages) or 'n/a'} | overview: {overview or 'n/a'}"
+        )
+    return "\n".join(lines)
+
+
+def find_products_for_question(user_question: str, has_chat_history: bool = False):
+    """
+    Runs the rule-based extraction and the fixed query. Returns the products, or None to fall back to the agent.
+    """
+    try:
+        query = parse_product_query(user_question, load_vocabulary(), has_chat_history)
+        if query is None:
+            return None
+        products = fetch_products(query)
+        # An empty result usually means the constraints were too strict; the agent can relax them
+        return products or None
+    except Exception as e:
+        logging.warning(f"Fast path failed, falling back to the SQL agent: {str(e)}")
+        return None
+
+
+def build_summary_question(user_question: str, products):
+    return (
+        f"{user_question}\n\n"
+        f"The database has already been queried for this question; do not write SQL. "
+        f"Answer using only these products:\n{format_products_for_prompt(products)}"
+    )
+
+
+def build_follow_up_question(user_question: str, products):
+    return (
+        f"{user_question}\n\n"
+        f"This is a follow-up about the products of your previous answer; do not write SQL. Answer from the "
+        f"conversation and these products, and mark only the products your answer is about:\n"
+        f"{format_products_for_prompt(products)}"
+    )
@@ -0,0 +1,394 @@
+import json
+import time
+import threading
+from datetime import datetime
+from collections import OrderedDict
+from prometheus_client import Counter, Gauge
+from core.config import settings
+
+HISTORY_CACHE_LOOKUPS = Counter("chatbot_history_cache_lookups_total", "Chat history cache lookups by result",
+                                ["result"])
+HISTORY_CACHE_BYTES = Gauge("chatbot_history_cache_bytes", "Approximate size of the cached chat histories",
+                            multiprocess_mode="livesum")
+
+# Rough per-row overhead of the Python objects around the question and answer text
+ENTRY_OVERHEAD_BYTES = 200
+
+# Every write bumps the user's generation (KEYS[2]), so fills that read the database before it are not stored
+_REDIS_BUMP_GENERATION = """
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+"""
+# Appends to a cached history only; a user without a cached history is loaded from the database on the next read
+_REDIS_APPEND_SCRIPT = _REDIS_BUMP_GENERATION + """
+local raw = redis.call('GET', KEYS[1])
+if not raw then return 0 end
+local history = cjson.decode(raw)
+table.insert(history.entries, 1, cjson.decode(ARGV[1]))
+history.summary_current = false
+while #history.entries > tonumber(ARGV[2]) do
+    table.remove(history.entries)
+    history.complete = false
+end
+redis.call('SET', KEYS[1], cjson.encode(history), 'EX', ARGV[3])
+return 1
+"""
+_REDIS_DELETE_SCRIPT = _REDIS_BUMP_GENERATION + """
+redis.call('DEL', KEYS[1])
+return 1
+"""
+# Stores a loaded history unless a write happened since its generation (ARGV[1]) was read
+_REDIS_FILL_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '') ~= ARGV[1] then return 0 end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+return 1
+"""
+_REDIS_SET_SUMMARY_SCRIPT = """
+local raw = redis.call('GET', KEYS[1])
+if not raw then return 0 end
+local history = cjson.decode(raw)
+history.summary = cjson.decode(ARGV[1])
+history.summary_loaded = true
+history.summary_current = ARGV[3] == '1'
+redis.call('SET', KEYS[1], cjson.encode(history), 'EX', ARGV[2])
+return 1
+"""
+
+
+class CachedChatEntry:
+    """
+    A chat history row as kept in the cache. Mirrors the ChatHistory attributes read by the service; `id` is None
+    for rows that were added after the history was loaded from the database.
+    """
+
+    __slots__ = ("id", "question", "answer", "product_ids", "created_at")
+
+    def __init__(self, entry_id, question: str, answer: str, product_ids, created_at):
+        self.id = entry_id
+        self.question = question
+        self.answer = answer
+        self.product_ids = product_ids
+        self.created_at = created_at
+
+    @classmethod
+    def from_row(cls, row):
+        # ChatHistory rows and queued PendingChatEntry rows alike
+        return cls(row.id, row.question, row.answer, row.get_product_ids(), row.created_at)
+
+    def get_product_ids(self):
+        return list(self.product_ids)
+
+    def size(self):
+        return len(self.question) + len(self.answer) + sum(len(str(product_id)) for product_id in self.product_ids) \
+            + ENTRY_OVERHEAD_BYTES
+
+    def to_dict(self):
+        return {"id": self.id, "question": self.question, "answer": self.answer, "product_ids": self.product_ids,
+                "created_at": self.created_at.isoformat() if self.created_at else None}
+
+    @classmethod
+    def from_dict(cls, data):
+        created_at = datetime.fromisoformat(data["created_at"]) if data.get("created_at") else None
+        return cls(data.get("id"), data["question"], data["answer"], data.get("product_ids") or [], created_at)
+
+
+class CachedHistory:
+    """
+    The newest rows of one user's chat history, newest first. `complete` means the user has no older rows;
+    `summary_loaded` means `summary` holds the stored rolling summary (None when there is none), and
+    `summary_current` that it already covers every turn older than the prompt window (cleared by each append).
+    """
+
+    def __init__(self, entries, complete: bool, summary=None, summary_loaded: bool = False,
+                 summary_current: bool = False):
+        self.entries = entries
+        self.complete = complete
+        self.summary = summary
+        self.summary_loaded = summary_loaded
+        self.summary_current = summary_current
+        self.created_at = time.time()
+
+    def size(self):
+        return sum(entry.size() for entry in self.entries) + len(self.summary or "") + ENTRY_OVERHEAD_BYTES
+
+    def to_json(self):
+        return json.dumps({"entries": [entry.to_dict() for entry in self.entries], "complete": self.complete,
+                           "summary": self.summary, "summary_loaded": self.summary_loaded,
+                           "summary_current": self.summary_current})
+
+    @classmethod
+    def from_json(cls, raw):
+        data = json.loads(raw)
+        return cls([CachedChatEntry.from_dict(entry) for entry in data["entries"]], data["complete"],
+                   data.get("summary"), data.get("summary_loaded", False), data.get("summary_current", False))
+
+
+class MemoryHistoryBackend:
+    """
+    LRU/TTL store of this worker, bounded by the number of users and by the approximate size of their histories.
+    """
+
+    def __init__(self, max_users: int, max_bytes: int, ttl_seconds: int):
+        self.max_users = max_users
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._histories = OrderedDict()
+        self._sizes = {}
+        self._bytes = 0
+        # Loads in progress per user; a write in between makes the loaded rows stale, so they are not stored
+        self._fills = {}
+        self.evictions = 0
+
+    def _remove(self, user_id: str):
+        if self._histories.pop(user_id, None) is not None:
+            self._bytes -= self._sizes.pop(user_id)
+
+    def _store(self, user_id: str, history: CachedHistory):
+        self._remove(user_id)
+        self._histories[user_id] = history
+        self._sizes[user_id] = history.size()
+        self._bytes += self._sizes[user_id]
+        while len(self._histories) > self.max_users or self._bytes > self.max_bytes:
+            self._remove(next(iter(self._histories)))
+            self.evictions += 1
+        HISTORY_CACHE_BYTES.set(self._bytes)
+
+    async def get(self, user_id: str):
+        with self._lock:
+            history = self._histories.get(user_id)
+            if history is not None and time.time() - history.created_at >= self.ttl_seconds:
+                self._remove(user_id)
+                history = None
+            if history is not None:
+                self._histories.move_to_end(user_id)
+            return history
+
+    async def begin_fill(self, user_id: str):
+        token = object()
+        with self._lock:
+            self._fills[user_id] = token
+        return token
+
+    async def fill(self, user_id: str, token, history: CachedHistory):
+        with self._lock:
+            if self._fills.get(user_id) is not token:
+                return
+            del self._fills[user_id]
+            self._store(user_id, history)
+
+    async def append(self, user_id: str, entry: CachedChatEntry, depth: int):
+        with self._lock:
+            self._fills.pop(user_id, None)
+            history = self._histories.get(user_id)
+            if history is None:
+                return
+            entries = [entry] + history.entries
+            complete = history.complete and len(entries) <= depth
+            # A new object, so readers holding the old one never see it change
+            updated = CachedHistory(entries[:depth], complete, history.summary, history.summary_loaded)
+            updated.created_at = history.created_at
+            self._store(user_id, updated)
+
+    async def set_summary(self, user_id: str, summary, current: bool):
+        with self._lock:
+            history = self._histories.get(user_id)
+            if history is None:
+                return
+            updated = CachedHistory(history.entries, history.complete, summary, True, current)
+            updated.created_at = history.created_at
+            self._store(user_id, updated)
+
+    async def delete(self, user_id: str):
+        with self._lock:
+            self._fills.pop(user_id, None)
+            self._remove(user_id)
+            HISTORY_CACHE_BYTES.set(self._bytes)
+
+    def stats(self):
+        return {
+            "backend": "memory",
+            "users": len(self._histories),
+            "bytes": self._bytes,
+            "evictions": self.evictions,
+        }
+
+    async def close(self):
+        pass
+
+
+class RedisHistoryBackend:
+    """
+    Histories shared by every worker that points at the same Redis-compatible server, one JSON value per user.
+    """
+
+    def __init__(self, url: str, ttl_seconds: int, prefix: str = "chatbot:history:"):
+        import redis.asyncio as redis
+        self._client = redis.from_url(url)
+        self._append = self._client.register_script(_REDIS_APPEND_SCRIPT)
+        self._delete = self._client.register_script(_REDIS_DELETE_SCRIPT)
+        self._fill = self._client.register_script(_REDIS_FILL_SCRIPT)
+        self._set_summary = self._client.register_script(_REDIS_SET_SUMMARY_SCRIPT)
+        self.ttl_seconds = ttl_seconds
+        self._prefix = prefix
+
+    async def get(self, user_id: str):
+        raw = await self._client.get(self._prefix + user_id)
+        return CachedHistory.from_json(raw) if raw is not None else None
+
+    def _keys(self, user_id: str):
+        return [self._prefix + user_id, self._prefix + "generation:" + user_id]
+
+    async def begin_fill(self, user_id: str):
+        # The generation is shared by every worker, unlike a token in this process
+        generation = await self._client.get(self._keys(user_id)[1])
+        return generation.decode() if generation is not None else ""
+
+    async def fill(self, user_id: str, token, history: CachedHistory):
+        await self._fill(keys=self._keys(user_id), args=[token, history.to_json(), self.ttl_seconds])
+
+    async def append(self, user_id: str, entry: CachedChatEntry, depth: int):
+        await self._append(keys=self._keys(user_id), args=[json.dumps(entry.to_dict()), depth, self.ttl_seconds])
+
+    async def set_summary(self, user_id: str, summary, current: bool):
+        await self._set_summary(keys=[self._prefix + user_id],
+                                args=[json.dumps(summary), self.ttl_seconds, "1" if current else "0"])
+
+    async def delete(self, user_id: str):
+        await self._delete(keys=self._keys(user_id), args=["", "", self.ttl_seconds])
+
+    def stats(self):
+        return {"backend": "redis"}
+
+    async def close(self):
+        await self._client.aclose()
+
+
+def get_history_backend(name: str):
+    if name == "memory":
+        if settings.WEB_CONCURRENCY > 1:
+            # Other workers would keep serving turns this worker appended or cleared
+            raise ValueError(f"The memory history cache is per worker; with {settings.WEB_CONCURRENCY} workers "
+                             f"set HISTORY_CACHE_BACKEND=redis or HISTORY_CACHE_ENABLED=false")
+        return MemoryHistoryBackend(settings.HISTORY_CACHE_MAX_USERS, settings.HISTORY_CACHE_MAX_BYTES,
+                                    settings.HISTORY_CACHE_TTL)
+    if name == "redis":
+        return RedisHistoryBackend(settings.HISTORY_CACHE_REDIS_URL, settings.HISTORY_CACHE_TTL)
+    raise ValueError(f"Unknown history cache backend: {name}")
+
+
+class ChatHistoryCache:
+    """
+    Read cache of the newest `depth` chat history rows per user. Filled by the first read, appended to by every new
+    answer and dropped when the history is cleared, so the reads of an ongoing conversation never reach MySQL.
+    """
+
+    def __init__(self, backend, depth: int):
+        self.backend = backend
+        self.depth = depth
+        self.hits = 0
+        self.misses = 0
+
+    def _record(self, hit: bool):
+        if hit:
+            self.hits += 1
+            HISTORY_CACHE_LOOKUPS.labels("hit").inc()
+        else:
+            self.misses += 1
+            HISTORY_CACHE_LOOKUPS.labels("miss").inc()
+
+    async def recent(self, user_id: str, limit: int):
+        """
+        Returns the user's newest `limit` rows, newest first, or None when they have to be read from the database.
+        """
+        history = await self.backend.get(user_id)
+        hit = history is not None and (history.complete or len(history.entries) >= limit)
+        self._record(hit)
+        return history.entries[:limit] if hit else None
+
+    async def first_page(self, user_id: str, limit: int):
+        """
+        Returns (rows, last row of the page or None on the last page) for the first /chat-history page, or None.
+        Rows added since the history was loaded lead the page on top of `limit`, like queued rows do; the cursor
+        row is always a stored one.
+        """
+        history = await self.backend.get(user_id)
+        if history is not None:
+            added = [entry for entry in history.entries if entry.id is None]
+            stored = history.entries[len(added):]
+            if len(stored) > limit:
+                self._record(True)
+                return added + stored[:limit], stored[limit - 1]
+            if history.complete:
+                self._record(True)
+                return added + stored, None
+        self._record(False)
+        return None
+
+    async def summary(self, user_id: str):
+        """
+        Returns (True, summary) when the user's rolling summary is cached, otherwise (False, None).
+        """
+        history = await self.backend.get(user_id)
+        if history is None or not history.summary_loaded:
+            return False, None
+        return True, history.summary
+
+    async def summary_is_current(self, user_id: str):
+        """
+        Whether the cached summary already covers every turn older than the prompt window, so an update would
+        find nothing to fold.
+        """
+        history = await self.backend.get(user_id)
+        return history is not None and history.summary_current
+
+    async def begin_fill(self, user_id: str):
+        """
+        Call before reading the history (and before the pending_for() snapshot); pass the result to fill(). An
+        append or invalidate in between, in any worker, makes fill() a no-op.
+        """
+        return await self.backend.begin_fill(user_id)
+
+    async def fill(self, user_id: str, token, rows, complete: bool):
+        entries = [CachedChatEntry.from_row(row) for row in rows[:self.depth]]
+        await self.backend.fill(user_id, token, CachedHistory(entries, complete and len(rows) <= self.depth))
+
+    async def append(self, user_id: str, row):
+        await self.backend.append(user_id, CachedChatEntry.from_row(row), self.depth)
+
+    async def set_summary(self, user_id: str, summary, current: bool = False):
+        await self.backend.set_summary(user_id, summary, current)
+
+    async def invalidate(self, user_id: str):
+        await self.backend.delete(user_id)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        stats = self.backend.stats()
+        stats.update({
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        })
+        return stats
+
+
+_history_cache = None
+
+
+def get_history_cache():
+    """
+    The worker's history cache, or None when HISTORY_CACHE_ENABLED is off.
+    """
+    global _history_cache
+    if not settings.HISTORY_CACHE_ENABLED:
+        return None
+    if _history_cache is None:
+        _history_cache = ChatHistoryCache(get_history_backend(settings.HISTORY_CACHE_BACKEND),
+                                          max(settings.HISTORY_CACHE_DEPTH, settings.HISTORY_FETCH_LIMIT))
+    return _history_cache
+
+
+async def close_history_cache():
+    if _history_cache is not None:
+        await _history_cache.backend.close()
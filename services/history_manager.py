@@ -0,0 +1,254 @@
+import asyncio
+import logging
+import threading
+import tiktoken
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from langchain_openai import ChatOpenAI
+from core.config import settings
+from core.bot_history_db import ChatHistory, ChatSummary
+from core.database import get_async_session_factory
+from services.tracing import detach_trace
+from services.history_cache import get_history_cache
+
+MAX_TURNS_PER_SUMMARY_UPDATE = 20
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a short running summary of a shopping assistant conversation. Merge the existing summary with "
+    "the new turns. Keep the user's stated needs, preferences, budget, devices and the product IDs that were "
+    "recommended; drop pleasantries. Answer with the updated summary only, at most 120 words."
+)
+
+_encoding = None
+_encoding_lock = threading.Lock()
+_summary_llm = None
+_summaries_in_flight = set()
+_background_tasks = set()
+
+
+class HistoryStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.history_tokens_kept = 0
+        self.history_tokens_dropped = 0
+        self.summary_updates = 0
+
+    def record(self, prompt_tokens: int, kept: int, dropped: int):
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += prompt_tokens
+            self.history_tokens_kept += kept
+            self.history_tokens_dropped += dropped
+
+    def record_summary_update(self):
+        with self._lock:
+            self.summary_updates += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "avg_prompt_tokens": round(self.prompt_tokens / self.requests, 1) if self.requests else 0.0,
+                "history_tokens_kept": self.history_tokens_kept,
+                "history_tokens_dropped": self.history_tokens_dropped,
+                "summary_updates": self.summary_updates,
+            }
+
+
+history_stats = HistoryStats()
+
+
+def _get_encoding():
+    global _encoding
+    with _encoding_lock:
+        if _encoding is None:
+            try:
+                _encoding = tiktoken.encoding_for_model("gpt-4o")
+            except Exception as e:
+                # tiktoken downloads its BPE files on first use; fall back to an estimate when that is impossible
+                logging.warning(f"tiktoken encoding unavailable, estimating tokens from characters: {str(e)}")
+                _encoding = False
+        return _encoding
+
+
+def count_tokens(text: str):
+    encoding = _get_encoding()
+    if not encoding:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages):
+    # Roughly 4 tokens of chat formatting overhead per message
+    return sum(count_tokens(message.content) + 4 for message in messages)
+
+
+class HistoryContext:
+    """
+    The part of a user's conversation that goes into the prompt: recent turns within the token budget plus the
+    rolling summary of everything older. `older_turns` means some turns did not fit, so there is something to
+    summarize.
+    """
+
+    def __init__(self, turns, summary=None, kept_tokens=0, dropped_tokens=0, older_turns=False):
+        self.turns = turns
+        self.summary = summary
+        self.kept_tokens = kept_tokens
+        self.dropped_tokens = dropped_tokens
+        self.older_turns = older_turns
+
+    def __bool__(self):
+        return bool(self.turns or self.summary)
+
+    @property
+    def messages(self):
+        messages = []
+        if self.summary:
+            messages.append(SystemMessage(content=f"Summary of the earlier conversation: {self.summary}"))
+        for entry in self.turns:
+            messages.append(HumanMessage(content=entry.question))
+            messages.append(AIMessage(content=entry.answer))
+        return messages
+
+
+def select_turns_within_budget(chat_history, budget: int):
+    """
+    Takes history ordered newest first and keeps the newest turns whose tokens fit the budget.
+    Returns (kept turns oldest first, kept tokens, dropped tokens).
+    """
+    kept = []
+    kept_tokens = 0
+    dropped_tokens = 0
+    for entry in chat_history:
+        tokens = count_tokens(entry.question) + count_tokens(entry.answer) + 8
+        if not dropped_tokens and kept_tokens + tokens <= budget:
+            kept.append(entry)
+            kept_tokens += tokens
+        else:
+            dropped_tokens += tokens
+    kept.reverse()
+    return kept, kept_tokens, dropped_tokens
+
+
+async def build_history_context(user_id: str, chat_history, db: AsyncSession):
+    """
+    Applies the token budget to the fetched history and attaches the stored summary when older turns exist.
+    """
+    kept, kept_tokens, dropped_tokens = select_turns_within_budget(chat_history, settings.HISTORY_TOKEN_BUDGET)
+    summary = None
+    # With fewer rows than the fetch limit and nothing dropped there are no older turns to summarize
+    older_turns = bool(dropped_tokens) or len(chat_history) >= settings.HISTORY_FETCH_LIMIT
+    if settings.HISTORY_SUMMARY_ENABLED and older_turns:
+        summary = await load_summary(user_id, db)
+    return HistoryContext(kept, summary, kept_tokens, dropped_tokens, older_turns)
+
+
+async def load_summary(user_id: str, db: AsyncSession):
+    history_cache = get_history_cache()
+    if history_cache is not None:
+        cached, summary = await history_cache.summary(user_id)
+        if cached:
+            return summary
+    summary_row = await db.get(ChatSummary, user_id)
+    summary = summary_row.summary if summary_row else None
+    if history_cache is not None:
+        await history_cache.set_summary(user_id, summary)
+    return summary
+
+
+def _get_summary_llm():
+    global _summary_llm
+    if _summary_llm is None:
+        _summary_llm = ChatOpenAI(model_name=settings.SUMMARY_MODEL, openai_api_key=settings.OPENAI_API_KEY)
+    return _summary_llm
+
+
+async def update_rolling_summary(user_id: str):
+    """
+    Folds the turns that fell out of the token budget into the user's stored summary.
+    """
+    AsyncSessionLocal = get_async_session_factory()
+    async with AsyncSessionLocal() as db:
+        recent = await db.execute(
+            select(ChatHistory)
+            .where(ChatHistory.user_id == user_id)
+            .order_by(ChatHistory.created_at.desc(), ChatHistory.id.desc())
+            .limit(settings.HISTORY_FETCH_LIMIT)
+        )
+        kept, _, _ = select_turns_within_budget(recent.scalars().all(), settings.HISTORY_TOKEN_BUDGET)
+        if not kept:
+            return
+        history_cache = get_history_cache()
+
+        summary_row = await db.get(ChatSummary, user_id)
+        last_entry_id = summary_row.last_entry_id if summary_row else 0
+        older = await db.execute(
+            select(ChatHistory)
+            .where(ChatHistory.user_id == user_id,
+                   ChatHistory.id > last_entry_id,
+                   ChatHistory.id < min(entry.id for entry in kept))
+            .order_by(ChatHistory.id)
+            .limit(MAX_TURNS_PER_SUMMARY_UPDATE)
+        )
+        to_fold = older.scalars().all()
+        if not to_fold:
+            # Nothing aged out since the last update; skip this query until the next turn is added
+            if history_cache is not None:
+                await history_cache.set_summary(user_id, summary_row.summary if summary_row else None, current=True)
+            return
+
+        turns = "\n".join(f"User: {entry.question}\nAssistant: {entry.answer}" for entry in to_fold)
+        response = await _get_summary_llm().ainvoke([
+            SystemMessage(content=SUMMARY_INSTRUCTIONS),
+            HumanMessage(content=f"Existing summary: {summary_row.summary if summary_row else '(none)'}\n\n"
+                                 f"New turns:\n{turns}"),
+        ])
+
+        if summary_row is None:
+            summary_row = ChatSummary(user_id=user_id)
+            db.add(summary_row)
+        summary = response.content.strip()
+        summary_row.summary = summary
+        summary_row.last_entry_id = to_fold[-1].id
+        await db.commit()
+        history_stats.record_summary_update()
+        if history_cache is not None:
+            # A full batch may leave older turns behind for the next update
+            await history_cache.set_summary(user_id, summary,
+                                            current=len(to_fold) < MAX_TURNS_PER_SUMMARY_UPDATE)
+
+
+async def _run_summary_update(user_id: str):
+    detach_trace()
+    try:
+        await update_rolling_summary(user_id)
+    except Exception as e:
+        logging.warning(f"Rolling summary update failed for user {user_id}: {str(e)}")
+    finally:
+        _summaries_in_flight.discard(user_id)
+
+
+async def summary_update_needed(user_id: str, history: HistoryContext):
+    """
+    False when the history had no older turns, or the cached summary already covers every turn older than the
+    prompt window; without the history cache only the update's own queries can tell.
+    """
+    if not settings.HISTORY_SUMMARY_ENABLED or not history.older_turns:
+        return False
+    history_cache = get_history_cache()
+    return history_cache is None or not await history_cache.summary_is_current(user_id)
+
+
+def schedule_summary_update(user_id: str):
+    """
+    Starts a background summary update for the user unless one is already running.
+    """
+    if not settings.HISTORY_SUMMARY_ENABLED or user_id in _summaries_in_flight:
+        return
+    _summaries_in_flight.add(user_id)
+    task = asyncio.create_task(_run_summary_update(user_id))
+    # Keep a reference so the task is not garbage collected before it finishes
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
@@ -0,0 +1,210 @@
+import asyncio
+import logging
+from collections import deque, defaultdict
+from datetime import datetime
+from sqlalchemy import insert
+from sqlalchemy.exc import OperationalError, InterfaceError
+from core.config import settings
+from core.bot_history_db import ChatHistory
+from core.database import get_async_session_factory
+from services.tracing import detach_trace, trace_section
+from services.history_cache import get_history_cache
+
+MAX_RETRY_BACKOFF_SECONDS = 5.0
+
+
+class PendingChatEntry:
+    """
+    A chat history row that is queued for insertion. Mirrors the ChatHistory attributes read by the service.
+    """
+
+    def __init__(self, user_id: str, question: str, answer: str, product_ids):
+        self.id = None
+        self.user_id = user_id
+        self.question = question
+        self.answer = answer
+        self.product_ids = product_ids
+        # Display only; the database assigns created_at when the batch is inserted
+        self.created_at = datetime.now()
+        self.persisted = False
+
+    def get_product_ids(self):
+        return list(self.product_ids)
+
+    def to_row(self):
+        entry = ChatHistory(user_id=self.user_id, question=self.question, answer=self.answer)
+        entry.set_product_ids(self.product_ids)
+        return {"user_id": entry.user_id, "question": entry.question, "answer": entry.answer,
+                "product_ids": entry.product_ids}
+
+
+class ChatHistoryWriter:
+    """
+    Write-behind queue for chat history: rows are batched into bulk inserts off the request path, while a
+    per-user in-memory tail keeps them visible to the next read.
+    """
+
+    def __init__(self, batch_size: int, flush_interval: float, max_retries: int):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self._pending = deque()
+        self._tails = defaultdict(list)
+        self._write_lock = None
+        self._wakeup = None
+        self._task = None
+        self._stopping = False
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.batches_written = 0
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._stopping = False
+            self._write_lock = self._write_lock or asyncio.Lock()
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    def start(self):
+        self._ensure_started()
+
+    def enqueue(self, user_id: str, question: str, answer: str, product_ids):
+        self._ensure_started()
+        entry = PendingChatEntry(user_id, question, answer, product_ids)
+        self._pending.append(entry)
+        self._tails[user_id].append(entry)
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+        return entry
+
+    def pending_for(self, user_id: str):
+        """
+        Returns the user's queued rows, oldest first. Take this snapshot before querying the table (see
+        merge_pending_history).
+        """
+        return list(self._tails.get(user_id, ()))
+
+    async def _run(self):
+        detach_trace()
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Chat history flush failed: {str(e)}")
+
+    async def flush(self):
+        """
+        Writes every queued row; waits for a batch that is already being written.
+        """
+        if self._write_lock is None:
+            return
+        async with self._write_lock:
+            while self._pending:
+                batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+                await self._write_batch(batch)
+
+    async def _write_batch(self, batch):
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                AsyncSessionLocal = get_async_session_factory()
+                with trace_section("history_flush"):
+                    async with AsyncSessionLocal() as db:
+                        await db.execute(insert(ChatHistory), [entry.to_row() for entry in batch])
+                        await db.commit()
+                for entry in batch:
+                    entry.persisted = True
+                    self._remove_from_tail(entry)
+                self.rows_written += len(batch)
+                self.batches_written += 1
+                return
+            except (OperationalError, InterfaceError) as e:
+                # Connection drops, lock wait timeouts, deadlocks: worth another try
+                logging.warning(f"Transient error writing {len(batch)} chat history rows "
+                                f"(attempt {attempt}/{self.max_retries}): {str(e)}")
+                if attempt < self.max_retries:
+                    await asyncio.sleep(min(0.1 * 2 ** attempt, MAX_RETRY_BACKOFF_SECONDS))
+            except Exception as e:
+                logging.error(f"Error writing {len(batch)} chat history rows: {str(e)}")
+                break
+        logging.error(f"Dropping {len(batch)} chat history rows after failed writes")
+        self.rows_dropped += len(batch)
+        for entry in batch:
+            self._remove_from_tail(entry)
+        # Cached histories hold the dropped rows; read them from the database again
+        history_cache = get_history_cache()
+        if history_cache is not None:
+            for user_id in {entry.user_id for entry in batch}:
+                await history_cache.invalidate(user_id)
+
+    def _remove_from_tail(self, entry):
+        tail = self._tails.get(entry.user_id)
+        if tail and entry in tail:
+            tail.remove(entry)
+            if not tail:
+                del self._tails[entry.user_id]
+
+    async def discard_user(self, user_id: str):
+        """
+        Drops the user's queued rows, waiting for any batch in flight, so a following DELETE is final.
+        Returns the number of rows that were discarded before reaching the database.
+        """
+        if self._write_lock is None:
+            self._tails.pop(user_id, None)
+            return 0
+        async with self._write_lock:
+            discarded = sum(1 for entry in self._pending if entry.user_id == user_id)
+            self._pending = deque(entry for entry in self._pending if entry.user_id != user_id)
+            self._tails.pop(user_id, None)
+            return discarded
+
+    async def stop(self):
+        """
+        Stops the background flusher and writes whatever is still queued; called at shutdown.
+        """
+        if self._task is not None:
+            # Not cancelled: a batch in flight has already left the queue and would be lost
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    def stats(self):
+        return {
+            "queued": len(self._pending),
+            "rows_written": self.rows_written,
+            "batches_written": self.batches_written,
+            "rows_dropped": self.rows_dropped,
+        }
+
+
+def merge_pending_history(pending, db_rows, limit: int):
+    """
+    Puts queued rows (a pending_for() snapshot taken before the query) in front of rows read from the database,
+    newest first. Rows written while the query ran may be in both; only those are matched against the result.
+    """
+    if not pending:
+        return db_rows
+    stored = {(row.question, row.answer) for row in db_rows}
+    unseen = [entry for entry in reversed(pending)
+              if not entry.persisted or (entry.question, entry.answer) not in stored]
+    return (unseen + list(db_rows))[:limit]
+
+
+_history_writer = None
+
+
+def get_history_writer():
+    global _history_writer
+    if _history_writer is None:
+        _history_writer = ChatHistoryWriter(
+            batch_size=settings.HISTORY_WRITE_BATCH_SIZE,
+            flush_interval=settings.HISTORY_WRITE_FLUSH_INTERVAL,
+            max_retries=settings.HISTORY_WRITE_MAX_RETRIES,
+        )
+    return _history_writer
@@ -0,0 +1,72 @@
+from langchain_core.messages import AIMessage, SystemMessage, HumanMessage
+from langchain_core.prompts import ChatPromptTemplate, HumanMessagePromptTemplate, MessagesPlaceholder
+from langchain_community.agent_toolkits.sql.prompt import SQL_PREFIX, SQL_FUNCTIONS_SUFFIX
+
+GREETING_ANSWER = ("Hi there, I am your helpful product recommendation assistant chatbot from Clearbuy. "
+                   "How may I help you today?")
+
+# The static instructions. They lead every request unchanged so the provider's prompt prefix cache applies;
+# per-request content (history, question, agent steps) only ever follows them.
+SYSTEM_INSTRUCTIONS = f"""You are a helpful assistant for Clearbuy. Answer product questions by querying the product database and summarizing the results.
+
+Columns:
+- Product: id, category_name, brand_name, name, price_msrp, full_overview, pros, cons.
+- Usage: fit_small_ear, best_for_traveling, best_for_workout, best_for_work, best_for_music, best_for_gaming, best_for_iphone, best_for_samsung, best_for_android.
+
+Rules:
+1. Greetings: reply exactly "{GREETING_ANSWER}" and run no queries.
+2. Chat history: use earlier questions and answers to understand the user's preferences and keep the conversation continuous.
+3. Product queries: retrieve up to four products relevant to the question, in the matching category (e.g. Wireless Earbuds, Wireless Headphones, Wired Earbuds, Wired Headphones). Correct misspelled product names.
+4. Summary: one continuous sentence of at most 70 words comparing the products, based on full_overview when available, otherwise on pros, cons and the usage columns. Highlight key features, critical pros and cons, and user value. Use simple, user-friendly language, give only the requested details and do not start with "Summary".
+5. Never mention column names in the answer; the only exception is the product id in the "Product ID:" markers.
+6. Start the answer with one "**Product ID: <id>**" marker per product, then the summary.
+7. End with a feedback question relevant to this conversation; vary it rather than repeating the same one.
+
+Example answer (for format only, write your own):
+
+**Product ID: 4322** **Product ID: 2289** **Product ID: 143** **Product ID: 146**
+
+These products offer distinct features, making them suitable for various needs: Product A excels in performance but is pricey, Product B balances cost and quality, Product C impresses with advanced features yet lacks durability, and Product D is budget-friendly but sacrifices some functionality, so choose based on your priorities. Which of these features matters most to you?"""
+
+# Used for the single-call answers (fast path, partial results) that need no tools
+FINAL_PROMPT = ChatPromptTemplate.from_messages([
+    SystemMessage(content=SYSTEM_INSTRUCTIONS),
+    MessagesPlaceholder(variable_name="chat_history"),
+    HumanMessagePromptTemplate.from_template("{question}"),
+])
+
+
+# Small talk is answered by the light model; it has no product data, so it must not make recommendations
+SMALL_TALK_PROMPT = ChatPromptTemplate.from_messages([
+    SystemMessage(content="You are Clearbuy's product recommendation assistant for earbuds and headphones. Reply to "
+                          "the user's message in one or two friendly sentences. Do not name or recommend products; "
+                          "offer to help the user find the right earbuds or headphones instead."),
+    MessagesPlaceholder(variable_name="chat_history"),
+    HumanMessagePromptTemplate.from_template("{question}"),
+])
+
+ROUTER_INSTRUCTIONS = """Classify the user's latest message to a shopping assistant for earbuds and headphones. Answer with one word:
+greeting - a greeting only
+small_talk - thanks, goodbyes or chat that needs no product data
+follow_up - a question about the products of the previous answer that the conversation and those products answer
+product_search - anything that needs a new search of the product database"""
+
+
+def build_router_messages(question: str, previous_answer: str = None):
+    context = f"Previous answer: {previous_answer}\n\n" if previous_answer else ""
+    return [SystemMessage(content=ROUTER_INSTRUCTIONS), HumanMessage(content=f"{context}Latest message: {question}")]
+
+
+def build_agent_prompt(dialect: str, top_k: int):
+    """
+    Prompt of the SQL agent: the static instructions and the SQL toolkit's instructions as one leading system
+    message, then the chat history, the question and the agent's scratchpad.
+    """
+    sql_instructions = SQL_PREFIX.format(dialect=dialect, top_k=top_k)
+    return ChatPromptTemplate.from_messages([
+        SystemMessage(content=f"{SYSTEM_INSTRUCTIONS}\n\n{sql_instructions}"),
+        MessagesPlaceholder(variable_name="chat_history"),
+        HumanMessagePromptTemplate.from_template("{input}"),
+        AIMessage(content=SQL_FUNCTIONS_SUFFIX),
+        MessagesPlaceholder(variable_name="agent_scratchpad"),
+    ])
@@ -0,0 +1,170 @@
+import re
+import time
+import threading
+from collections import OrderedDict
+from prometheus_client import Counter
+from core.config import settings
+from services.sql_guard import mask_sql
+
+SQL_TOKEN = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"|`[^`]*`|\d+(?:\.\d+)?|\w+|<>|!=|<=|>=|\S")
+# Keywords that end a WHERE clause at the top level
+WHERE_END = {"group", "order", "having", "limit", "union", "window"}
+
+SQL_CACHE_LOOKUPS = Counter("chatbot_sql_cache_lookups_total", "Agent SQL result cache lookups", ["result"])
+
+
+def _is_literal(token: str):
+    return token[0] in ("'", '"') or token[0].isdigit()
+
+
+def _sort_in_lists(tokens):
+    """
+    Sorts the items of `IN (literal, literal, ...)` lists.
+    """
+    out, i = [], 0
+    while i < len(tokens):
+        out.append(tokens[i])
+        if tokens[i] == "in" and i + 1 < len(tokens) and tokens[i + 1] == "(":
+            end = tokens.index(")", i + 1) if ")" in tokens[i + 1:] else -1
+            items = tokens[i + 2:end:2] if end != -1 else []
+            separators = tokens[i + 3:end:2] if end != -1 else []
+            if items and all(_is_literal(item) for item in items) and all(sep == "," for sep in separators):
+                out.append("(")
+                for n, item in enumerate(sorted(items)):
+                    out.extend([",", item] if n else [item])
+                out.append(")")
+                i = end + 1
+                continue
+        i += 1
+    return out
+
+
+def _sort_conjuncts(tokens):
+    """
+    Sorts the AND-ed predicates of the top-level WHERE clause when it contains no top-level OR or BETWEEN.
+    """
+    depth, where, end = 0, None, len(tokens)
+    for i, token in enumerate(tokens):
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth -= 1
+        elif depth == 0 and token == "where" and where is None:
+            where = i
+        elif depth == 0 and where is not None and token in WHERE_END:
+            end = i
+            break
+    if where is None:
+        return tokens
+
+    conjuncts, current, depth = [], [], 0
+    for token in tokens[where + 1:end]:
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth -= 1
+        if depth == 0 and token in ("or", "between"):
+            return tokens
+        if depth == 0 and token == "and":
+            conjuncts.append(" ".join(current))
+            current = []
+        else:
+            current.append(token)
+    conjuncts.append(" ".join(current))
+    return tokens[:where + 1] + [" and ".join(sorted(conjuncts))] + tokens[end:]
+
+
+def canonicalize_sql(sql: str):
+    """
+    Cache key of a query: comments dropped, whitespace collapsed, everything but string literals lowercased, and
+    the order of AND-ed WHERE predicates and of IN-list literals made irrelevant.
+    """
+    sql = mask_sql(sql)[0].strip().rstrip(";")
+    tokens = []
+    for token in SQL_TOKEN.findall(sql):
+        if token[0] in ("'", '"'):
+            tokens.append(token)
+        elif token[0] == "`":
+            tokens.append(token[1:-1].lower())
+        else:
+            tokens.append("<>" if token == "!=" else token.lower())
+    return " ".join(_sort_conjuncts(_sort_in_lists(tokens)))
+
+
+class QueryResultCache:
+    """
+    LRU/TTL cache of formatted agent query results, bounded by entry count and by the total size of the results.
+    Cleared when the product view snapshot is refreshed.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl_seconds: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[1])
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[0] >= self.ttl_seconds:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                SQL_CACHE_LOOKUPS.labels("miss").inc()
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            SQL_CACHE_LOOKUPS.labels("hit").inc()
+            return entry[1]
+
+    def put(self, key, result: str):
+        if len(result) > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (time.time(), result)
+            self._bytes += len(result)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+_query_cache = None
+
+
+def get_query_cache():
+    global _query_cache
+    if _query_cache is None:
+        _query_cache = QueryResultCache(
+            max_entries=settings.SQL_CACHE_MAX_ENTRIES,
+            max_bytes=settings.SQL_CACHE_MAX_BYTES,
+            ttl_seconds=settings.SQL_CACHE_TTL,
+        )
+    return _query_cache
@@ -0,0 +1,159 @@
+import re
+import logging
+from langchain_openai import ChatOpenAI
+from prometheus_client import Counter
+from starlette.concurrency import run_in_threadpool
+from core.config import settings
+from services.prompts import build_router_messages
+from services.answer_cache import normalize_question
+from services.tracing import get_trace_callbacks
+from services.fast_path import load_vocabulary, fetch_products_by_id, mentions_search_constraint
+
+GREETING = "greeting"
+SMALL_TALK = "small_talk"
+FOLLOW_UP = "follow_up"
+PRODUCT_SEARCH = "product_search"
+ROUTES = (GREETING, SMALL_TALK, FOLLOW_UP, PRODUCT_SEARCH)
+# Answered without gpt-4o and without an LLM slot
+LIGHT_ROUTES = (GREETING, SMALL_TALK, FOLLOW_UP)
+
+ROUTE_DECISIONS = Counter("chatbot_route_decisions_total", "Questions by route and by what decided the route",
+                          ["route", "decided_by"])
+
+# Longer messages carry a request even when they open with a greeting
+MAX_SMALL_TALK_CHARS = 80
+
+_GREETING_WORDS = r"hi+|hello+|hey+|hiya|howdy|hola|greetings|yo|good (?:morning|afternoon|evening|day)"
+_GREETING_FILLERS = r"there|again|all|everyone|bot|chatbot|clearbuy|friend"
+_SMALL_TALK_WORDS = (r"thanks?(?: you)?(?: (?:so|very) much)?(?: a lot)?|thank u|thx|ty|cheers|much appreciated|"
+                     r"ok(?:ay)?|cool|great|awesome|nice|perfect|got it|sounds good|no thanks?|"
+                     r"bye|goodbye|see (?:you|ya)(?: later)?|good night|have a (?:nice|good|great) (?:day|one|evening)|"
+                     r"how are you(?: doing)?(?: today)?|how s it going|what s up|who are you|what are you|"
+                     r"what can you do|what do you do|are you a (?:bot|robot|human)|that s (?:great|helpful|all)|"
+                     r"you re (?:great|awesome|helpful)|lol|haha")
+_ACKNOWLEDGEMENT_WORDS = (r"yes|yeah|yep|yup|sure|ok(?:ay)?|alright|great|cool|perfect|sounds (?:good|great)|"
+                          r"please|go ahead|do it|why not|absolutely|definitely|of course|that works|tell me more")
+# Matched against the whole normalized message; "yes" and "sure" are left out, they usually accept an offer
+GREETING_PATTERN = re.compile(rf"(?:(?:{_GREETING_WORDS}|{_GREETING_FILLERS}) ?)+")
+SMALL_TALK_PATTERN = re.compile(rf"(?:(?:{_GREETING_WORDS}|{_GREETING_FILLERS}|{_SMALL_TALK_WORDS}) ?)+")
+# A reply to a question of the previous answer ("Want me to compare them?"); small talk would refuse to show products
+ACKNOWLEDGEMENT_PATTERN = re.compile(rf"(?:(?:{_ACKNOWLEDGEMENT_WORDS}) ?)+")
+
+# Questions about the products of the previous answer ...
+REFERENCE_PATTERN = re.compile(r"\b(?:it|its|they|them|their|those|these|that one|this one|which one|which of|"
+                               r"the first|the second|the third|the fourth|the last|either|both)\b")
+# ... unless they ask for different products
+NEW_SEARCH_PATTERN = re.compile(r"\b(?:another|other|others|else|more like|similar|alternatives?|instead|"
+                                r"cheaper|cheapest|recommend\w*|suggest\w*|find|search|show me|look for|"
+                                r"looking for)\b")
+
+
+class Route:
+    """
+    Where a question is answered: `name` is one of ROUTES, `decided_by` is "rules", "model", "default" or
+    "disabled", and `products` holds the previous answer's product rows of a follow-up.
+    """
+
+    def __init__(self, name: str, decided_by: str, products=None):
+        self.name = name
+        self.decided_by = decided_by
+        self.products = products
+
+    @property
+    def light(self):
+        return self.name in LIGHT_ROUTES
+
+
+_light_llm = None
+
+
+def get_light_llm():
+    global _light_llm
+    if _light_llm is None:
+        _light_llm = ChatOpenAI(model_name=settings.LIGHT_MODEL, openai_api_key=settings.OPENAI_API_KEY)
+    return _light_llm
+
+
+def previous_product_ids(history):
+    """
+    Product IDs of the newest turn in the prompt's history, or [] when there is none.
+    """
+    if not history.turns:
+        return []
+    return history.turns[-1].get_product_ids()
+
+
+def asked_a_question(history):
+    """
+    Whether the newest turn in the prompt's history ends with a question to the user.
+    """
+    if not history.turns:
+        return False
+    lines = history.turns[-1].answer.strip().splitlines()
+    return bool(lines) and "?" in lines[-1]
+
+
+def classify_question(user_question: str, history):
+    """
+    Rule-based routing. Returns the route name, or None when the rules cannot tell.
+    """
+    normalized = normalize_question(user_question)
+    if len(normalized) <= MAX_SMALL_TALK_CHARS:
+        if ACKNOWLEDGEMENT_PATTERN.fullmatch(normalized) and asked_a_question(history):
+            # Accepting an offer about the products shown, or else an offer to search
+            return FOLLOW_UP if previous_product_ids(history) else PRODUCT_SEARCH
+        if GREETING_PATTERN.fullmatch(normalized):
+            return GREETING
+        if SMALL_TALK_PATTERN.fullmatch(normalized):
+            return SMALL_TALK
+    question = user_question.lower()
+    # A brand or price narrows a new search rather than asking about the products already shown
+    if NEW_SEARCH_PATTERN.search(question) or mentions_search_constraint(question, load_vocabulary()):
+        return PRODUCT_SEARCH
+    if previous_product_ids(history) and REFERENCE_PATTERN.search(question):
+        return FOLLOW_UP
+    return None
+
+
+async def classify_with_model(user_question: str, history):
+    """
+    Asks the light model for the route of a question the rules could not place; None for an unusable reply.
+    """
+    previous_answer = history.turns[-1].answer if history.turns else None
+    response = await get_light_llm().ainvoke(build_router_messages(user_question, previous_answer),
+                                             config={"callbacks": get_trace_callbacks()})
+    label = response.content.strip().strip(".").lower()
+    return label if label in ROUTES else None
+
+
+async def route_question(user_question: str, history):
+    """
+    Picks the route of a question; follow-ups come with the previous answer's products, or fall back to a product
+    search when those cannot be loaded.
+    """
+    if not settings.ROUTING_ENABLED:
+        return Route(PRODUCT_SEARCH, "disabled")
+    name, decided_by = None, "rules"
+    try:
+        # The brand vocabulary may need a query on first use
+        name = await run_in_threadpool(classify_question, user_question, history)
+        if name is None and settings.ROUTER_MODEL_ENABLED:
+            name, decided_by = await classify_with_model(user_question, history), "model"
+    except Exception as e:
+        logging.warning(f"Question routing failed, using the product search route: {str(e)}")
+    if name is None:
+        name, decided_by = PRODUCT_SEARCH, "default"
+
+    products = None
+    if name == FOLLOW_UP:
+        product_ids = previous_product_ids(history)
+        try:
+            products = await run_in_threadpool(fetch_products_by_id, product_ids) if product_ids else None
+        except Exception as e:
+            logging.warning(f"Loading the follow-up products failed: {str(e)}")
+        if not products:
+            name = PRODUCT_SEARCH
+
+    ROUTE_DECISIONS.labels(name, decided_by).inc()
+    logging.info(f"Routed question to {name} ({decided_by})")
+    return Route(name, decided_by, products)
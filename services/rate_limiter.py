@@ -0,0 +1,332 @@
+import math
+import time
+import heapq
+import asyncio
+import logging
+import contextvars
+from collections import Counter as CountMap
+from contextlib import asynccontextmanager
+from prometheus_client import Counter, Gauge, Histogram
+from core.config import settings
+
+RATE_LIMITED_REQUESTS = Counter("chatbot_rate_limited_requests_total", "Requests turned away with 429 by reason",
+                                ["reason"])
+SCHEDULER_QUEUE_DEPTH = Gauge("chatbot_scheduler_queue_depth", "Requests waiting for an LLM slot",
+                              multiprocess_mode="livesum")
+SCHEDULER_IN_FLIGHT = Gauge("chatbot_scheduler_in_flight", "Requests holding an LLM slot",
+                            multiprocess_mode="livesum")
+SCHEDULER_WAIT_SECONDS = Histogram("chatbot_scheduler_wait_seconds", "Time spent waiting for an LLM slot",
+                                   buckets=(0.005, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30))
+
+_current_flow = contextvars.ContextVar("chatbot_scheduling_flow", default=("", False))
+
+# Token bucket kept in a Redis hash; the clock is the caller's so all workers must share one host clock
+_REDIS_TAKE_SCRIPT = """
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local tokens = math.min(burst, (tonumber(state[1]) or burst) + math.max(0, now - (tonumber(state[2]) or now)) * rate)
+local retry_after = 0
+if tokens >= 1 then tokens = tokens - 1 else retry_after = (1 - tokens) / rate end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return tostring(retry_after)
+"""
+
+
+class RateLimitExceeded(Exception):
+    """
+    Raised instead of queuing a request without bound; `retry_after` is the suggested wait in seconds.
+    """
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"Rate limited ({reason}), retry after {retry_after:.1f}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self):
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class MemoryRateLimitBackend:
+    """
+    Token buckets of this worker only; with several workers each one enforces the limits separately.
+    """
+
+    MAX_BUCKETS = 100000
+
+    def __init__(self):
+        self._buckets = {}
+
+    async def take(self, key: str, rate: float, burst: float):
+        """
+        Takes a token from bucket `key` (refilled at `rate` per second up to `burst`); returns 0 when one was
+        available, otherwise the seconds until there is one.
+        """
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        retry_after = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            retry_after = (1 - tokens) / rate
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.MAX_BUCKETS:
+            self._prune(now, rate, burst)
+        return retry_after
+
+    def _prune(self, now: float, rate: float, burst: float):
+        # Buckets that have refilled completely are the same as absent ones
+        self._buckets = {key: (tokens, updated) for key, (tokens, updated) in self._buckets.items()
+                         if tokens + (now - updated) * rate < burst}
+
+    async def close(self):
+        pass
+
+
+class RedisRateLimitBackend:
+    """
+    Token buckets shared by every worker (and host) that points at the same Redis-compatible server.
+    """
+
+    def __init__(self, url: str, prefix: str = "chatbot:rate:"):
+        import redis.asyncio as redis
+        self._client = redis.from_url(url)
+        self._take = self._client.register_script(_REDIS_TAKE_SCRIPT)
+        self._prefix = prefix
+
+    async def take(self, key: str, rate: float, burst: float):
+        return float(await self._take(keys=[self._prefix + key], args=[rate, burst, time.time()]))
+
+    async def close(self):
+        await self._client.aclose()
+
+
+def get_rate_limit_backend(name: str):
+    if name == "memory":
+        return MemoryRateLimitBackend()
+    if name == "redis":
+        return RedisRateLimitBackend(settings.RATE_LIMIT_REDIS_URL)
+    raise ValueError(f"Unknown rate limit backend: {name}")
+
+
+class RateLimiter:
+    """
+    Admission control in front of /ask: a token bucket per user_id and one shared by all users, sized to the
+    OpenAI rate limit.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.admitted = 0
+        self.rejected = CountMap()
+
+    async def _take(self, key: str, per_minute: float, burst: float):
+        try:
+            return await self.backend.take(key, per_minute / 60.0, max(1.0, burst))
+        except Exception as e:
+            # An unreachable backend must not take the API down with it; admit and log
+            logging.error(f"Error in rate limiter: {str(e)}")
+            return 0.0
+
+    def _reject(self, reason: str, retry_after: float):
+        self.rejected[reason] += 1
+        RATE_LIMITED_REQUESTS.labels(reason).inc()
+        raise RateLimitExceeded(reason, retry_after)
+
+    async def admit(self, user_id: str):
+        """
+        Raises RateLimitExceeded when the user or the service as a whole is over its request rate.
+        """
+        if not settings.RATE_LIMIT_ENABLED:
+            return
+        if settings.RATE_LIMIT_USER_PER_MINUTE > 0:
+            retry_after = await self._take(f"user:{user_id}", settings.RATE_LIMIT_USER_PER_MINUTE,
+                                           settings.RATE_LIMIT_USER_BURST)
+            if retry_after:
+                self._reject("user_rate", retry_after)
+        if settings.RATE_LIMIT_GLOBAL_PER_MINUTE > 0:
+            retry_after = await self._take("global", settings.RATE_LIMIT_GLOBAL_PER_MINUTE,
+                                           settings.RATE_LIMIT_GLOBAL_BURST)
+            if retry_after:
+                self._reject("global_rate", retry_after)
+        self.admitted += 1
+
+    def stats(self):
+        return {
+            "backend": settings.RATE_LIMIT_BACKEND,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+        }
+
+
+def parse_weights(value: str):
+    """
+    Parses "flow=weight,flow=weight" (flows are user_ids, or "batch" for /ask/batch items).
+    """
+    weights = {}
+    for item in (value or "").split(","):
+        if item.strip():
+            flow, weight = item.rsplit("=", 1)
+            weights[flow.strip()] = float(weight)
+    return weights
+
+
+def set_scheduling_flow(flow: str, bounded: bool = True):
+    """
+    Names the flow (usually the user_id) that LLM work of the current request is queued under. Bounded flows are
+    turned away with RateLimitExceeded when the queue is full or the wait too long; unbounded ones always wait.
+    """
+    _current_flow.set((flow, bounded))
+
+
+class FairScheduler:
+    """
+    Hands out `capacity` LLM slots per worker in weighted fair queueing order: every request gets a virtual finish
+    tag of max(virtual time, the flow's previous tag) + 1 / weight and the smallest tag is served next, so a user
+    with many queued requests cannot delay the first request of another user by more than one slot.
+    """
+
+    def __init__(self, capacity: int, max_queue: int, max_queued_per_flow: int, max_wait: float, weights=None):
+        self.capacity = capacity
+        self.max_queue = max_queue
+        self.max_queued_per_flow = max_queued_per_flow
+        self.max_wait = max_wait
+        self.weights = weights or {}
+        self._waiting = []
+        self._sequence = 0
+        self._virtual_time = 0.0
+        self._last_tag = {}
+        self._queued = CountMap()
+        self._queue_depth = 0
+        self._in_flight = 0
+        # Moving average of slot hold times, for the Retry-After estimate
+        self._average_hold = 1.0
+        self.granted = 0
+        self.waited = 0
+        self.total_wait = 0.0
+        self.rejected = CountMap()
+
+    def _reject(self, reason: str):
+        self.rejected[reason] += 1
+        RATE_LIMITED_REQUESTS.labels(reason).inc()
+        retry_after = self._average_hold * (self._queue_depth + 1) / self.capacity
+        raise RateLimitExceeded(reason, retry_after)
+
+    def _grant(self, tag: float, waited: float):
+        self._in_flight += 1
+        self._virtual_time = max(self._virtual_time, tag)
+        self.granted += 1
+        SCHEDULER_IN_FLIGHT.set(self._in_flight)
+        SCHEDULER_WAIT_SECONDS.observe(waited)
+
+    def _next_tag(self, flow: str):
+        tag = max(self._virtual_time, self._last_tag.get(flow, 0.0)) + 1.0 / self.weights.get(flow, 1.0)
+        self._last_tag[flow] = tag
+        if len(self._last_tag) > 10000:
+            # Tags at or behind the virtual time are the same as no tag
+            self._last_tag = {key: value for key, value in self._last_tag.items() if value > self._virtual_time}
+        return tag
+
+    async def acquire(self, flow: str, bounded: bool):
+        if self._in_flight < self.capacity and not self._queue_depth:
+            self._grant(self._next_tag(flow), 0.0)
+            return
+        if bounded and self._queue_depth >= self.max_queue:
+            self._reject("queue_full")
+        if bounded and self._queued[flow] >= self.max_queued_per_flow:
+            self._reject("user_queue_full")
+
+        tag = self._next_tag(flow)
+        waiter = asyncio.get_running_loop().create_future()
+        self._sequence += 1
+        heapq.heappush(self._waiting, (tag, self._sequence, waiter))
+        self._queued[flow] += 1
+        self._queue_depth += 1
+        SCHEDULER_QUEUE_DEPTH.set(self._queue_depth)
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(waiter, self.max_wait if bounded else None)
+        except asyncio.TimeoutError:
+            self._reject("wait_timeout")
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as the caller went away
+                self.release(0.0)
+            raise
+        finally:
+            self._queued[flow] -= 1
+            if not self._queued[flow]:
+                del self._queued[flow]
+            self._queue_depth -= 1
+            SCHEDULER_QUEUE_DEPTH.set(self._queue_depth)
+        waited = time.monotonic() - started
+        self.waited += 1
+        self.total_wait += waited
+        SCHEDULER_WAIT_SECONDS.observe(waited)
+
+    def release(self, held: float):
+        self._in_flight -= 1
+        self._average_hold = 0.8 * self._average_hold + 0.2 * held
+        while self._waiting and self._in_flight < self.capacity:
+            tag, _, waiter = heapq.heappop(self._waiting)
+            if waiter.done():
+                # Cancelled or timed out while queued
+                continue
+            waiter.set_result(None)
+            self._in_flight += 1
+            self._virtual_time = max(self._virtual_time, tag)
+            self.granted += 1
+        SCHEDULER_IN_FLIGHT.set(self._in_flight)
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        Holds one LLM slot for the current request's flow (see set_scheduling_flow).
+        """
+        flow, bounded = _current_flow.get()
+        await self.acquire(flow, bounded)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started)
+
+    def stats(self):
+        return {
+            "capacity": self.capacity,
+            "in_flight": self._in_flight,
+            "queue_depth": self._queue_depth,
+            "queued_by_flow": dict(self._queued.most_common(10)),
+            "granted": self.granted,
+            "waited": self.waited,
+            "average_wait_s": round(self.total_wait / self.waited, 4) if self.waited else 0.0,
+            "average_hold_s": round(self._average_hold, 4),
+            "rejected": dict(self.rejected),
+        }
+
+
+_rate_limiter = None
+_scheduler = None
+
+
+def get_rate_limiter():
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = RateLimiter(get_rate_limit_backend(settings.RATE_LIMIT_BACKEND))
+    return _rate_limiter
+
+
+def get_scheduler():
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = FairScheduler(settings.MAX_CONCURRENT_AGENT_RUNS, settings.SCHEDULER_MAX_QUEUE,
+                                   settings.SCHEDULER_MAX_QUEUED_PER_USER, settings.SCHEDULER_MAX_WAIT_SECONDS,
+                                   parse_weights(settings.SCHEDULER_WEIGHTS))
+    return _scheduler
+
+
+async def close_rate_limiter():
+    if _rate_limiter is not None:
+        await _rate_limiter.backend.close()
@@ -0,0 +1,67 @@
+import asyncio
+import logging
+from prometheus_client import Counter
+
+COALESCED_REQUESTS = Counter("chatbot_coalesced_requests_total",
+                             "Questions answered by joining an identical in-flight run instead of starting one")
+
+
+class SingleFlight:
+    """
+    Runs a coroutine once per key among concurrent callers of one worker: callers that arrive while a run for the
+    same key is in flight wait for its result instead of starting their own.
+    """
+
+    def __init__(self):
+        self._in_flight = {}
+        self.runs = 0
+        self.coalesced = 0
+        # Joined runs whose result could not be shared, so the caller ran its own
+        self.unshared = 0
+
+    async def run(self, key, coroutine_factory, shareable=None):
+        """
+        Callers that joined a run whose result fails `shareable(result)` run the coroutine themselves.
+        """
+        task = self._in_flight.get(key)
+        if task is None:
+            self.runs += 1
+            # The run is its own task so a cancelled caller does not cancel it for everyone else
+            task = asyncio.ensure_future(coroutine_factory())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+            return await asyncio.shield(task)
+        self.coalesced += 1
+        COALESCED_REQUESTS.inc()
+        result = await asyncio.shield(task)
+        if shareable is not None and not shareable(result):
+            self.unshared += 1
+            return await coroutine_factory()
+        return result
+
+    def _finish(self, key, task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled() and task.exception() is not None:
+            # Retrieved here so an error nobody waited for is logged once rather than as "never retrieved"
+            logging.debug(f"Single-flight run failed: {str(task.exception())}")
+
+    def stats(self):
+        total = self.runs + self.coalesced
+        return {
+            "in_flight": len(self._in_flight),
+            "runs": self.runs,
+            "coalesced": self.coalesced,
+            "unshared": self.unshared,
+            "coalesced_ratio": round(self.coalesced / total, 4) if total else 0.0,
+        }
+
+
+_single_flight = None
+
+
+def get_single_flight():
+    global _single_flight
+    if _single_flight is None:
+        _single_flight = SingleFlight()
+    return _single_flight
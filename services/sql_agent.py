@@ -0,0 +1,278 @@
+import os
+import json
+import time
+import logging
+import threading
+from langchain.agents.agent_types import AgentType
+from langchain_community.agent_toolkits.sql.base import create_sql_agent
+from langchain_community.utilities.sql_database import SQLDatabase
+from langchain_community.agent_toolkits import SQLDatabaseToolkit
+from core.config import settings
+from core.database import get_engine
+from services.sql_guard import guard_sql, SQLGuardError
+from services.query_cache import canonicalize_sql, get_query_cache
+from services.prompts import build_agent_prompt
+
+PRODUCT_SCHEMA = "clearbuydb"
+PRODUCT_TABLE = "SG_product_full_info_materialized"
+PRODUCT_COLUMNS = ["id", "category_name", "brand_name", "name", "price_msrp", "full_overview", "pros", "cons"]
+USAGE_COLUMNS = ["fit_small_ear", "best_for_traveling", "best_for_workout", "best_for_work", "best_for_music",
+                 "best_for_gaming", "best_for_iphone", "best_for_samsung", "best_for_android"]
+# Free-text columns the agent's queries read truncated
+WIDE_COLUMNS = ["full_overview"]
+# Rows the agent is told to ask for by default (create_sql_agent's default)
+AGENT_TOP_K = 10
+
+_lock = threading.Lock()
+_snapshot = None
+_sql_database = None
+_toolkit = None
+_agent_executor = None
+_refresh_listeners = []
+_last_refresh_check = 0.0
+
+
+class GuardedSQLDatabase(SQLDatabase):
+    """
+    SQLDatabase whose text queries (the ones the agent writes) go through guard_sql before they are executed.
+    A rejected query is returned to the agent as an error message, like a failed statement. Formatted results
+    are served from the query result cache when the same canonical query ran before.
+    """
+
+    def run(self, command, fetch="all", include_columns=False, *, parameters=None, execution_options=None):
+        if not isinstance(command, str):
+            return super().run(command, fetch, include_columns, parameters=parameters,
+                               execution_options=execution_options)
+        command = guard_sql(command,
+                            table=PRODUCT_TABLE,
+                            narrow_columns=PRODUCT_COLUMNS + USAGE_COLUMNS,
+                            wide_columns=WIDE_COLUMNS,
+                            max_rows=settings.SQL_MAX_ROWS,
+                            max_text_chars=self._max_string_length,
+                            timeout_ms=settings.SQL_QUERY_TIMEOUT_MS,
+                            dialect=self.dialect)
+        if not settings.SQL_CACHE_ENABLED or parameters or execution_options or fetch == "cursor":
+            return super().run(command, fetch, include_columns)
+        key = (canonicalize_sql(command), fetch, include_columns)
+        query_cache = get_query_cache()
+        result = query_cache.get(key)
+        if result is None:
+            result = super().run(command, fetch, include_columns)
+            query_cache.put(key, result)
+        return result
+
+    def run_no_throw(self, command, fetch="all", include_columns=False, *, parameters=None,
+                     execution_options=None):
+        try:
+            return super().run_no_throw(command, fetch, include_columns, parameters=parameters,
+                                        execution_options=execution_options)
+        except SQLGuardError as e:
+            logging.warning(f"Rejected agent query: {str(e)}")
+            return f"Error: {e}"
+
+
+def _snapshot_is_fresh(snapshot):
+    return snapshot is not None and time.time() - snapshot["created_at"] < settings.SCHEMA_CACHE_TTL
+
+
+def _load_snapshot_from_disk():
+    try:
+        with open(settings.SCHEMA_CACHE_PATH, "r", encoding="utf-8") as f:
+            snapshot = json.load(f)
+        if snapshot.get("table") != PRODUCT_TABLE or not snapshot.get("table_info"):
+            return None
+        return snapshot
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.warning(f"Ignoring unreadable table info snapshot: {str(e)}")
+        return None
+
+
+def _save_snapshot_to_disk(snapshot):
+    try:
+        os.makedirs(os.path.dirname(settings.SCHEMA_CACHE_PATH) or ".", exist_ok=True)
+        tmp_path = f"{settings.SCHEMA_CACHE_PATH}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, settings.SCHEMA_CACHE_PATH)
+    except Exception as e:
+        logging.warning(f"Could not write table info snapshot: {str(e)}")
+
+
+def build_table_info_snapshot():
+    """
+    Reflects the product view and renders its DDL plus sample rows, exactly as the SQL agent would see it.
+    """
+    sql_database = SQLDatabase(get_engine(),
+                               view_support=True,
+                               schema=PRODUCT_SCHEMA,
+                               include_tables=[PRODUCT_TABLE],
+                               sample_rows_in_table_info=(3))
+    return {
+        "table": PRODUCT_TABLE,
+        "table_info": sql_database.get_table_info(),
+        "created_at": time.time(),
+    }
+
+
+def _get_snapshot(force_refresh: bool = False):
+    global _snapshot
+    if not force_refresh:
+        if _snapshot_is_fresh(_snapshot):
+            return _snapshot
+        disk_snapshot = _load_snapshot_from_disk()
+        if _snapshot_is_fresh(disk_snapshot):
+            _snapshot = disk_snapshot
+            return _snapshot
+
+    _snapshot = build_table_info_snapshot()
+    _save_snapshot_to_disk(_snapshot)
+    return _snapshot
+
+
+def get_sql_database():
+    """
+    Returns the per-worker SQLDatabase whose table info is served from the snapshot instead of MySQL and whose
+    queries are checked by the SQL guard.
+    """
+    global _sql_database, _toolkit, _agent_executor
+    with _lock:
+        if _sql_database is None or not _snapshot_is_fresh(_snapshot):
+            snapshot = _get_snapshot()
+            _sql_database = GuardedSQLDatabase(get_engine(),
+                                               view_support=True,
+                                               schema=PRODUCT_SCHEMA,
+                                               include_tables=[PRODUCT_TABLE],
+                                               sample_rows_in_table_info=(3),
+                                               custom_table_info={PRODUCT_TABLE: snapshot["table_info"]},
+                                               lazy_table_reflection=True)
+            # Dependent objects are rebuilt lazily on top of the new database
+            _toolkit = None
+            _agent_executor = None
+        return _sql_database
+
+
+def get_sql_agent(llm, extra_tools=()):
+    """
+    Returns the cached SQL agent, building the toolkit and agent only when the snapshot changes.
+    `extra_tools` are added next to the SQL tools when the agent is (re)built.
+    """
+    global _toolkit, _agent_executor
+    sql_database = get_sql_database()
+    with _lock:
+        if _agent_executor is None:
+            _toolkit = SQLDatabaseToolkit(db=sql_database, llm=llm)
+            _agent_executor = create_sql_agent(
+                llm=llm,
+                toolkit=_toolkit,
+                verbose=False,
+                agent_type=AgentType.OPENAI_FUNCTIONS,
+                prompt=build_agent_prompt(sql_database.dialect, AGENT_TOP_K),
+                extra_tools=list(extra_tools),
+                max_iterations=settings.AGENT_MAX_ITERATIONS,
+                # Backstop only; the per-request budget in agent_governor stops runs earlier
+                max_execution_time=settings.AGENT_MAX_SECONDS,
+            )
+        return _agent_executor
+
+
+def _refresh_marker_path():
+    return f"{settings.SCHEMA_CACHE_PATH}.refreshed"
+
+
+def _refresh_marker_mtime():
+    try:
+        return os.stat(_refresh_marker_path()).st_mtime
+    except OSError:
+        return 0.0
+
+
+def _touch_refresh_marker():
+    global _applied_refresh
+    try:
+        os.makedirs(os.path.dirname(settings.SCHEMA_CACHE_PATH) or ".", exist_ok=True)
+        with open(_refresh_marker_path(), "w", encoding="utf-8") as f:
+            f.write(str(time.time()))
+        _applied_refresh = _refresh_marker_mtime()
+    except Exception as e:
+        logging.warning(f"Could not signal the schema refresh to the other workers: {str(e)}")
+
+
+# Refreshes made before this process started are already in what it loads; preload_app forks workers after this
+_applied_refresh = _refresh_marker_mtime()
+
+
+def shared_refresh_pending():
+    """
+    Whether another worker ran /admin/refresh-schema since this worker last applied a refresh. Looks at the marker
+    file at most every SCHEMA_REFRESH_CHECK_SECONDS; a True result claims the refresh for the caller, who must then
+    call apply_shared_refresh().
+    """
+    global _last_refresh_check, _applied_refresh
+    now = time.monotonic()
+    if now - _last_refresh_check < settings.SCHEMA_REFRESH_CHECK_SECONDS:
+        return False
+    _last_refresh_check = now
+    marker = _refresh_marker_mtime()
+    if marker <= _applied_refresh:
+        return False
+    _applied_refresh = marker
+    return True
+
+
+def _drop_product_view_state():
+    global _sql_database, _toolkit, _agent_executor
+    with _lock:
+        _sql_database = None
+        _toolkit = None
+        _agent_executor = None
+    get_query_cache().clear()
+    for listener in _refresh_listeners:
+        listener()
+
+
+def apply_shared_refresh():
+    """
+    Drops this worker's snapshot, agent and caches after a refresh made by another worker; the snapshot is read
+    back from the file that worker wrote.
+    """
+    global _snapshot
+    with _lock:
+        _snapshot = None
+    _drop_product_view_state()
+    logging.info("Applied a schema refresh made by another worker")
+
+
+def add_refresh_listener(listener):
+    """
+    Registers a callable that is invoked after the product view snapshot is refreshed, e.g. to drop caches.
+    """
+    _refresh_listeners.append(listener)
+
+
+def refresh_table_info_snapshot():
+    """
+    Re-reads the product view (e.g. after the materialized view is rebuilt) and drops the cached agent, then
+    signals the other workers of this host to do the same (see shared_refresh_pending).
+    """
+    with _lock:
+        snapshot = _get_snapshot(force_refresh=True)
+    _drop_product_view_state()
+    _touch_refresh_marker()
+    status = get_schema_cache_status(snapshot)
+    status["other_workers_within_seconds"] = settings.SCHEMA_REFRESH_CHECK_SECONDS
+    return status
+
+
+def get_schema_cache_status(snapshot=None):
+    snapshot = snapshot or _snapshot
+    if snapshot is None:
+        return {"table": PRODUCT_TABLE, "cached": False}
+    return {
+        "table": PRODUCT_TABLE,
+        "cached": True,
+        "age_seconds": round(time.time() - snapshot["created_at"], 1),
+        "ttl_seconds": settings.SCHEMA_CACHE_TTL,
+        "table_info_chars": len(snapshot["table_info"]),
+    }
@@ -0,0 +1,166 @@
+import re
+
+# Statements and clauses an agent query may not contain, checked with string literals masked out
+FORBIDDEN_KEYWORDS = re.compile(
+    r"\b(?:insert|update|delete|drop|alter|create|truncate|rename|grant|revoke|call|load|lock|unlock|handler|"
+    r"into|outfile|dumpfile|sleep|benchmark|get_lock|load_file)\b",
+    re.IGNORECASE,
+)
+LEADING_KEYWORD = re.compile(r"^\s*(\w+)", re.IGNORECASE)
+TRAILING_LIMIT = re.compile(r"\blimit\s+(\d+)(?:\s*,\s*(\d+)|\s+offset\s+(\d+))?\s*$", re.IGNORECASE)
+SINGLE_TABLE_FROM = re.compile(r"^\s*`?(?:(\w+)`?\.`?)?(\w+)`?(?:\s+(?:as\s+)?(?!where\b|order\b|group\b|limit\b)\w+)?"
+                               r"\s*(?:\bwhere\b|\border\b|\bgroup\b|\blimit\b|$)", re.IGNORECASE)
+COLUMN_REFERENCE = re.compile(r"^`?(?:(\w+)`?\.`?)?(\w+)`?$")
+
+
+class SQLGuardError(ValueError):
+    pass
+
+
+def mask_sql(sql: str):
+    """
+    Removes comments and returns (sql, masked) of equal length where string literals and quoted identifiers are
+    replaced by spaces in `masked`, so keywords, parentheses and semicolons can be searched for safely.
+    """
+    out, masked = [], []
+    i, length = 0, len(sql)
+    while i < length:
+        char = sql[i]
+        if char in ("'", '"', "`"):
+            end = i + 1
+            while end < length:
+                if sql[end] == "\\" and char != "`":
+                    end += 2
+                    continue
+                if sql[end] == char:
+                    if end + 1 < length and sql[end + 1] == char:
+                        end += 2
+                        continue
+                    break
+                end += 1
+            literal = sql[i:end + 1]
+            out.append(literal)
+            # Keep identifier quotes visible; only their contents and string literals are hidden
+            masked.append(literal if char == "`" else char + " " * (len(literal) - 2) + char if len(literal) > 1
+                          else " ")
+            i = end + 1
+        elif sql.startswith("--", i) or char == "#":
+            end = sql.find("\n", i)
+            i = length if end == -1 else end
+        elif sql.startswith("/*", i):
+            end = sql.find("*/", i + 2)
+            i = length if end == -1 else end + 2
+            out.append(" ")
+            masked.append(" ")
+        else:
+            out.append(char)
+            masked.append(char)
+            i += 1
+    return "".join(out), "".join(masked)
+
+
+def _top_level_positions(masked: str, pattern):
+    """
+    Yields the match objects of `pattern` in `masked` that are not inside parentheses.
+    """
+    depth_at = []
+    depth = 0
+    for char in masked:
+        if char == "(":
+            depth += 1
+        depth_at.append(depth)
+        if char == ")":
+            depth -= 1
+    for match in pattern.finditer(masked):
+        if depth_at[match.start()] == 0:
+            yield match
+
+
+def _split_top_level(text: str, masked: str):
+    parts, start, depth = [], 0, 0
+    for i, char in enumerate(masked):
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "," and depth == 0:
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+    return parts
+
+
+def _rewrite_select_list(sql: str, masked: str, table: str, narrow_columns, wide_columns, max_text_chars: int):
+    """
+    Expands `SELECT *` on the product table to the columns the agent needs and truncates wide text columns in
+    the database instead of transferring them whole.
+    """
+    select = next(_top_level_positions(masked, re.compile(r"\bselect\b", re.IGNORECASE)), None)
+    from_clause = next(_top_level_positions(masked, re.compile(r"\bfrom\b", re.IGNORECASE)), None)
+    if select is None or from_clause is None or from_clause.start() < select.end():
+        return sql
+
+    list_start = select.end()
+    distinct = re.match(r"\s+distinct\b", masked[list_start:], re.IGNORECASE)
+    if distinct:
+        list_start += distinct.end()
+    items = _split_top_level(sql[list_start:from_clause.start()], masked[list_start:from_clause.start()])
+    table_match = SINGLE_TABLE_FROM.match(masked[from_clause.end():])
+    on_product_table = table_match is not None and table_match.group(2).lower() == table.lower()
+
+    if on_product_table:
+        expanded = []
+        for item in items:
+            expanded.extend(narrow_columns if item.strip() == "*" else [item])
+        items = expanded
+
+    rewritten = []
+    for item in items:
+        column = COLUMN_REFERENCE.match(item.strip())
+        if column and column.group(2).lower() in wide_columns:
+            rewritten.append(f"SUBSTRING({item.strip()}, 1, {max_text_chars}) AS {column.group(2)}")
+        else:
+            rewritten.append(item.strip())
+    return f"{sql[:list_start]} {', '.join(rewritten)} {sql[from_clause.start():]}"
+
+
+def guard_sql(sql: str, table: str, narrow_columns, wide_columns, max_rows: int, max_text_chars: int,
+              timeout_ms: int = 0, dialect: str = ""):
+    """
+    Validates an agent-generated query and returns the statement to execute.
+
+    Only a single SELECT (or WITH ... SELECT) is accepted; a LIMIT of at most `max_rows` is enforced, `SELECT *`
+    on `table` is narrowed to `narrow_columns`, `wide_columns` are truncated to `max_text_chars` characters, and on
+    MySQL a MAX_EXECUTION_TIME hint of `timeout_ms` is added. Raises SQLGuardError for anything else.
+    """
+    sql, masked = mask_sql(sql)
+    sql, masked = sql.strip(), masked.strip()
+    while masked.endswith(";"):
+        sql, masked = sql[:-1].rstrip(), masked[:-1].rstrip()
+    if not masked:
+        raise SQLGuardError("Empty query.")
+    if ";" in masked:
+        raise SQLGuardError("Only one statement can be run at a time.")
+    leading = LEADING_KEYWORD.match(masked)
+    if leading is None or leading.group(1).lower() not in ("select", "with"):
+        raise SQLGuardError("Only SELECT queries are allowed.")
+    forbidden = FORBIDDEN_KEYWORDS.search(masked)
+    if forbidden:
+        raise SQLGuardError(f"'{forbidden.group(0).upper()}' is not allowed; only plain SELECT queries can be run.")
+
+    sql = _rewrite_select_list(sql, masked, table, narrow_columns, {column.lower() for column in wide_columns},
+                               max_text_chars)
+    masked = mask_sql(sql)[1]
+
+    limit = TRAILING_LIMIT.search(masked)
+    if limit is None:
+        sql = f"{sql} LIMIT {max_rows}"
+    else:
+        count_group = 2 if limit.group(2) is not None else 1
+        if int(limit.group(count_group)) > max_rows:
+            sql = sql[:limit.start(count_group)] + str(max_rows) + sql[limit.end(count_group):]
+
+    if timeout_ms and dialect == "mysql" and leading.group(1).lower() == "select":
+        sql = re.sub(r"^\s*select\b", f"SELECT /*+ MAX_EXECUTION_TIME({int(timeout_ms)}) */", sql, count=1,
+                     flags=re.IGNORECASE)
+    return sql
@@ -0,0 +1,150 @@
+import re
+import json
+
+PRODUCT_ID_PATTERN = re.compile(r"\*\*Product ID:\s*(\d+)\*\*")
+PRODUCT_ID_PREFIX = "**Product ID:"
+PARTIAL_MARKER_TAIL = re.compile(r"\s*\d*\*?")
+MAX_PARTIAL_MARKER_LENGTH = 40
+INLINE_SPACE = " \t"
+CLOSING_PUNCTUATION = ",.;:!?)"
+
+
+def format_sse(event: str, data):
+    """
+    Formats one Server-Sent Event frame.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def format_ndjson(data):
+    """
+    Formats one newline-delimited JSON record.
+    """
+    return f"{json.dumps(data)}\n"
+
+
+def _could_be_marker(text: str):
+    if len(text) > MAX_PARTIAL_MARKER_LENGTH:
+        return False
+    if len(text) <= len(PRODUCT_ID_PREFIX):
+        return PRODUCT_ID_PREFIX.startswith(text)
+    return text.startswith(PRODUCT_ID_PREFIX) and PARTIAL_MARKER_TAIL.fullmatch(text[len(PRODUCT_ID_PREFIX):]) is not None
+
+
+def _held_back_start(buffer: str, position: int):
+    """
+    Returns where the text that may be the start of a marker completed by the next chunk begins.
+    """
+    candidate = buffer.find("**", max(position, len(buffer) - MAX_PARTIAL_MARKER_LENGTH))
+    while candidate != -1:
+        if _could_be_marker(buffer[candidate:]):
+            return candidate
+        candidate = buffer.find("**", candidate + 1)
+    # A trailing "*" may be the first half of the next marker's "**"
+    return len(buffer) - 1 if buffer.endswith("*") and len(buffer) > position else len(buffer)
+
+
+class ProductIdStreamParser:
+    """
+    Single-pass scanner that strips **Product ID: N** markers from answer text, fed whole or chunk by chunk.
+
+    Product IDs are collected deduplicated, in order of mention; with `known_ids` (a container of int IDs) IDs
+    outside it go to `unknown_ids` instead. The whitespace a removed marker leaves behind is dropped, the answer's
+    own line breaks, paragraphs and indentation are kept. Text that may be the start of a marker, and spaces that
+    may precede one, are held back until the next chunk decides them.
+    """
+
+    def __init__(self, known_ids=None):
+        self._buffer = ""
+        # Spaces seen before a possible marker; emitted only if text follows on the same line
+        self._pending_space = ""
+        # After a marker: "line" drops the spaces after it, "block" (nothing else on the line) all whitespace
+        self._after_marker = None
+        self._line_has_text = False
+        self._known_ids = known_ids
+        self.product_ids = []
+        self.unknown_ids = []
+
+    def _add_id(self, product_id: str, new_ids):
+        if product_id in self.product_ids or product_id in self.unknown_ids:
+            return
+        if self._known_ids is not None and int(product_id) not in self._known_ids:
+            self.unknown_ids.append(product_id)
+            return
+        self.product_ids.append(product_id)
+        new_ids.append(product_id)
+
+    def _emit(self, visible, segment: str):
+        visible.append(segment)
+        newline = segment.rfind("\n")
+        if newline == -1:
+            self._line_has_text = self._line_has_text or not segment.isspace()
+        else:
+            self._line_has_text = bool(segment[newline + 1:].strip())
+
+    def _emit_text(self, visible, segment: str):
+        if not segment:
+            return
+        stripped = segment.rstrip(INLINE_SPACE)
+        if stripped:
+            self._emit(visible, self._pending_space + stripped)
+            self._pending_space = segment[len(stripped):]
+        else:
+            self._pending_space += segment
+
+    def _skip_after_marker(self, buffer: str, position: int):
+        """
+        Skips the whitespace after a removed marker; returns the new position (len(buffer) if undecided).
+        """
+        skip = INLINE_SPACE if self._after_marker == "line" else INLINE_SPACE + "\r\n"
+        length = len(buffer)
+        while position < length and buffer[position] in skip:
+            position += 1
+        if position < length:
+            self._after_marker = None
+            following = buffer[position]
+            if following in "\r\n" or following in CLOSING_PUNCTUATION:
+                # The marker ended the line or sat before punctuation; the space before it goes too
+                self._pending_space = ""
+        return position
+
+    def _scan(self, text: str, final: bool):
+        buffer = self._buffer + text
+        self._buffer = ""
+        visible, new_ids = [], []
+        position, length = 0, len(buffer)
+        while position < length:
+            if self._after_marker:
+                position = self._skip_after_marker(buffer, position)
+                if position == length:
+                    break
+            match = PRODUCT_ID_PATTERN.search(buffer, position)
+            if match is None:
+                end = length if final else _held_back_start(buffer, position)
+                self._emit_text(visible, buffer[position:end])
+                self._buffer = buffer[end:]
+                break
+            self._emit_text(visible, buffer[position:match.start()])
+            self._add_id(match.group(1), new_ids)
+            if self._line_has_text:
+                self._after_marker = "line"
+            else:
+                self._after_marker = "block"
+                self._pending_space = ""
+            position = match.end()
+        return "".join(visible), new_ids
+
+    def feed(self, text: str):
+        """
+        Returns the text that is safe to show and the product IDs completed by this chunk.
+        """
+        return self._scan(text, final=False)
+
+    def flush(self):
+        """
+        Returns the held-back text once the answer is complete; trailing spaces are dropped.
+        """
+        visible, _ = self._scan("", final=True)
+        self._pending_space = ""
+        return visible
+
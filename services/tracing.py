@@ -0,0 +1,290 @@
+import time
+import json
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from langchain_core.callbacks import BaseCallbackHandler
+from prometheus_client import Counter, Histogram
+from core.config import settings
+
+MAX_TRACED_STATEMENT_CHARS = 2000
+
+REQUESTS = Counter("chatbot_requests_total", "Answered questions by endpoint and outcome", ["endpoint", "status"])
+REQUEST_SECONDS = Histogram("chatbot_request_duration_seconds", "End-to-end answer latency", ["endpoint"],
+                            buckets=(0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60))
+SECTION_SECONDS = Histogram("chatbot_section_duration_seconds", "Time spent in instrumented sections of a request",
+                            ["section"], buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5))
+AGENT_STEPS = Counter("chatbot_agent_steps_total", "Agent tool calls by tool", ["tool"])
+AGENT_STEPS_PER_REQUEST = Histogram("chatbot_agent_steps_per_request", "Agent tool calls per answered question",
+                                    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 30))
+SQL_SECONDS = Histogram("chatbot_sql_duration_seconds", "SQL statement latency",
+                        buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+SQL_ROWS = Counter("chatbot_sql_rows_total", "Rows returned or affected by SQL statements")
+LLM_CALLS = Counter("chatbot_llm_calls_total", "LLM calls by model", ["model"])
+LLM_SECONDS = Histogram("chatbot_llm_duration_seconds", "LLM call latency", ["model"],
+                        buckets=(0.25, 0.5, 1, 2, 4, 8, 15, 30, 60))
+LLM_TOKENS = Counter("chatbot_llm_tokens_total", "LLM tokens by model and kind", ["model", "kind"])
+ROUTE_SECONDS = Histogram("chatbot_route_duration_seconds", "End-to-end answer latency by route", ["route"],
+                          buckets=(0.01, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60))
+ROUTE_COST = Counter("chatbot_route_cost_usd_total", "Estimated LLM cost in USD by route", ["route"])
+
+# USD per million (prompt, completion) tokens; model names are matched by their longest listed prefix
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+}
+
+_current_trace = contextvars.ContextVar("chatbot_request_trace", default=None)
+
+
+class RequestTrace:
+    """
+    Everything recorded while answering one question: agent steps, SQL statements, LLM calls and timed sections.
+    """
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.events = []
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.agent_steps = 0
+        self.route = None
+
+    def _offset_ms(self, start: float):
+        return round((start - self.started) * 1000, 1)
+
+    def add(self, kind: str, start: float, duration: float, **fields):
+        event_record = {"kind": kind, "start_ms": self._offset_ms(start), "duration_ms": round(duration * 1000, 1)}
+        event_record.update(fields)
+        self.events.append(event_record)
+
+    def summary(self):
+        kinds = [event_record["kind"] for event_record in self.events]
+        return {
+            "endpoint": self.endpoint,
+            "duration_ms": round((time.perf_counter() - self.started) * 1000, 1),
+            "agent_steps": self.agent_steps,
+            "sql_statements": kinds.count("sql"),
+            "llm_calls": kinds.count("llm"),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "route": self.route,
+            "cost_usd": round(estimate_cost(self), 6),
+        }
+
+    def to_dict(self):
+        trace = self.summary()
+        trace["events"] = self.events
+        return trace
+
+
+def model_price(model: str):
+    matches = [name for name in MODEL_PRICES if model.startswith(name)]
+    return MODEL_PRICES[max(matches, key=len)] if matches else (0.0, 0.0)
+
+
+def estimate_cost(trace: RequestTrace):
+    """
+    USD cost of the LLM calls recorded on the trace, from their token counts and MODEL_PRICES.
+    """
+    cost = 0.0
+    for event_record in trace.events:
+        if event_record["kind"] == "llm":
+            prompt_price, completion_price = model_price(event_record["model"])
+            cost += (event_record["prompt_tokens"] * prompt_price
+                     + event_record["completion_tokens"] * completion_price) / 1_000_000
+    return cost
+
+
+class RouteStats:
+    """
+    Answered questions, latency and estimated LLM cost per route in this worker, for /admin/routing.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def record(self, route: str, duration: float, cost: float):
+        with self._lock:
+            stats = self._routes.setdefault(route, {"requests": 0, "seconds": 0.0, "cost_usd": 0.0})
+            stats["requests"] += 1
+            stats["seconds"] += duration
+            stats["cost_usd"] += cost
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                route: {
+                    "requests": stats["requests"],
+                    "avg_latency_ms": round(stats["seconds"] / stats["requests"] * 1000, 1),
+                    "cost_usd": round(stats["cost_usd"], 6),
+                    "avg_cost_usd": round(stats["cost_usd"] / stats["requests"], 6),
+                }
+                for route, stats in self._routes.items()
+            }
+
+
+route_stats = RouteStats()
+
+
+def start_trace(endpoint: str):
+    trace = RequestTrace(endpoint)
+    _current_trace.set(trace)
+    return trace
+
+
+def get_current_trace():
+    return _current_trace.get()
+
+
+def detach_trace():
+    """
+    Background tasks inherit the context of the request that created them; call this first thing in the task so
+    its queries are not recorded on that request's trace.
+    """
+    _current_trace.set(None)
+
+
+def finish_trace(trace: RequestTrace, status: str):
+    """
+    Records the request metrics and logs the trace summary of slow requests.
+    """
+    duration = time.perf_counter() - trace.started
+    REQUESTS.labels(trace.endpoint, status).inc()
+    REQUEST_SECONDS.labels(trace.endpoint).observe(duration)
+    AGENT_STEPS_PER_REQUEST.observe(trace.agent_steps)
+    if trace.route is not None and status == "success":
+        cost = estimate_cost(trace)
+        ROUTE_SECONDS.labels(trace.route).observe(duration)
+        ROUTE_COST.labels(trace.route).inc(cost)
+        route_stats.record(trace.route, duration, cost)
+    if duration >= settings.TRACE_SLOW_REQUEST_SECONDS:
+        logging.warning(f"Slow {trace.endpoint} request: {json.dumps(trace.summary())}")
+
+
+@contextmanager
+def trace_section(name: str):
+    """
+    Times a block of a request; the duration goes to the section histogram and the current trace.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        SECTION_SECONDS.labels(name).observe(duration)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add("section", start, duration, name=name)
+
+
+def wants_debug_trace(header_value):
+    return settings.DEBUG_TRACE_ENABLED and header_value not in (None, "", "0", "false")
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("chatbot_query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("chatbot_query_start")
+    if not starts:
+        return
+    start = starts.pop()
+    duration = time.perf_counter() - start
+    rows = cursor.rowcount if cursor.rowcount is not None and cursor.rowcount >= 0 else None
+    SQL_SECONDS.observe(duration)
+    if rows:
+        SQL_ROWS.inc(rows)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add("sql", start, duration, statement=statement[:MAX_TRACED_STATEMENT_CHARS], rows=rows)
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """
+    Records LLM calls (latency, prompt/completion tokens) and agent tool calls of one request.
+    """
+
+    # Called directly instead of through a thread pool executor
+    run_inline = True
+
+    def __init__(self, trace: RequestTrace):
+        self.trace = trace
+        self._llm_runs = {}
+        self._tool_runs = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        params = kwargs.get("invocation_params") or {}
+        model = params.get("model_name") or params.get("model") or params.get("_type") or "unknown"
+        self._llm_runs[run_id] = (time.perf_counter(), model)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        start, model = self._llm_runs.pop(run_id, (None, "unknown"))
+        if start is None:
+            return
+        duration = time.perf_counter() - start
+        prompt_tokens, completion_tokens = token_usage(response)
+        LLM_CALLS.labels(model).inc()
+        LLM_SECONDS.labels(model).observe(duration)
+        LLM_TOKENS.labels(model, "prompt").inc(prompt_tokens)
+        LLM_TOKENS.labels(model, "completion").inc(completion_tokens)
+        self.trace.prompt_tokens += prompt_tokens
+        self.trace.completion_tokens += completion_tokens
+        self.trace.add("llm", start, duration, model=model, prompt_tokens=prompt_tokens,
+                       completion_tokens=completion_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._llm_runs.pop(run_id, None)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._tool_runs[run_id] = (time.perf_counter(), (serialized or {}).get("name") or kwargs.get("name"), input_str)
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        start, tool, tool_input = self._tool_runs.pop(run_id, (None, None, None))
+        if start is None:
+            return
+        AGENT_STEPS.labels(tool or "unknown").inc()
+        self.trace.agent_steps += 1
+        self.trace.add("agent_step", start, time.perf_counter() - start, tool=tool,
+                       input=str(tool_input)[:MAX_TRACED_STATEMENT_CHARS])
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        start, tool, tool_input = self._tool_runs.pop(run_id, (None, None, None))
+        if start is not None:
+            AGENT_STEPS.labels(tool or "unknown").inc()
+            self.trace.agent_steps += 1
+            self.trace.add("agent_step", start, time.perf_counter() - start, tool=tool,
+                           input=str(tool_input)[:MAX_TRACED_STATEMENT_CHARS], error=str(error))
+
+
+def token_usage(response):
+    """
+    Returns (prompt tokens, completion tokens) of an LLMResult; ChatOpenAI reports them in llm_output, newer
+    integrations on the message's usage_metadata.
+    """
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    if usage:
+        return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+    prompt_tokens = completion_tokens = 0
+    for generations in response.generations:
+        for generation in generations:
+            metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+            prompt_tokens += metadata.get("input_tokens", 0)
+            completion_tokens += metadata.get("output_tokens", 0)
+    return prompt_tokens, completion_tokens
+
+
+def get_trace_callbacks():
+    """
+    Callbacks to pass to LLM and agent calls so they are recorded on the current request's trace.
+    """
+    trace = _current_trace.get()
+    return [TracingCallbackHandler(trace)] if trace is not None else []
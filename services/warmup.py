@@ -0,0 +1,105 @@
+import time
+import asyncio
+import logging
+from sqlalchemy import text
+from starlette.concurrency import run_in_threadpool
+from prometheus_client import Gauge
+from core.config import settings
+from core.database import init_engine, init_async_engine, get_engine, get_async_session_factory
+from services.sql_agent import PRODUCT_SCHEMA, PRODUCT_TABLE, get_sql_database, get_sql_agent
+from services.catalog import get_catalog, get_catalog_tools
+from services.answer_cache import get_answer_cache
+from services.history_manager import count_tokens
+import services.chatbot_service as chatbot_service
+
+STARTUP_SECONDS = Gauge("chatbot_startup_seconds", "Cold start time of this worker by phase", ["phase"],
+                        multiprocess_mode="liveall")
+
+
+class WarmUpState:
+    """
+    Readiness of this worker: ready once every warm-up phase has run. Keeps the duration of each phase.
+    """
+
+    def __init__(self):
+        self.ready = False
+        self.attempts = 0
+        self.last_error = None
+        self.phases = {}
+
+    def record(self, phase: str, seconds: float):
+        self.phases[phase] = round(seconds, 3)
+        STARTUP_SECONDS.labels(phase).set(seconds)
+
+    def status(self):
+        return {
+            "ready": self.ready,
+            "attempts": self.attempts,
+            "last_error": self.last_error,
+            "phases_seconds": self.phases,
+        }
+
+
+warm_up_state = WarmUpState()
+
+
+def _build_agent():
+    extra_tools = get_catalog_tools() if settings.CATALOG_ENABLED else ()
+    get_sql_agent(chatbot_service.llm, extra_tools)
+
+
+def _query_product_view():
+    with get_engine().connect() as connection:
+        connection.execute(text(f"SELECT id FROM {PRODUCT_SCHEMA}.{PRODUCT_TABLE} LIMIT 1")).fetchall()
+
+
+async def _query_chat_history_db():
+    AsyncSessionLocal = get_async_session_factory()
+    async with AsyncSessionLocal() as db:
+        await db.execute(text("SELECT 1"))
+
+
+async def _timed(phase: str, step):
+    start = time.perf_counter()
+    result = step()
+    if asyncio.iscoroutine(result):
+        await result
+    warm_up_state.record(phase, time.perf_counter() - start)
+
+
+async def warm_up():
+    """
+    Builds everything the first request would otherwise pay for: engines, the table info snapshot, the catalog,
+    the agent, the tokenizer and the answer cache, then runs one query on each engine.
+    """
+    await _timed("engines", lambda: (init_engine(), init_async_engine()))
+    await _timed("table_info_snapshot", lambda: run_in_threadpool(get_sql_database))
+    if settings.CATALOG_ENABLED:
+        await _timed("catalog", lambda: run_in_threadpool(get_catalog))
+    await _timed("agent", lambda: run_in_threadpool(_build_agent))
+    await _timed("tokenizer", lambda: count_tokens("warm up"))
+    if settings.ANSWER_CACHE_ENABLED:
+        await _timed("answer_cache", get_answer_cache)
+    await _timed("warm_up_query", lambda: run_in_threadpool(_query_product_view))
+    await _timed("warm_up_history_query", _query_chat_history_db)
+
+
+async def run_warm_up():
+    """
+    Runs warm_up until it succeeds, retrying every WARMUP_RETRY_SECONDS (e.g. while MySQL is not reachable yet).
+    The worker serves requests meanwhile; only the readiness endpoint waits for it.
+    """
+    started = time.perf_counter()
+    while True:
+        warm_up_state.attempts += 1
+        try:
+            await warm_up()
+            warm_up_state.record("total", time.perf_counter() - started)
+            warm_up_state.ready = True
+            warm_up_state.last_error = None
+            logging.info(f"Worker warm-up finished: {warm_up_state.phases}")
+            return
+        except Exception as e:
+            warm_up_state.last_error = str(e)
+            logging.error(f"Error in warm-up (attempt {warm_up_state.attempts}): {str(e)}")
+        await asyncio.sleep(settings.WARMUP_RETRY_SECONDS)
@@ -0,0 +1,10 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# core.config refuses to load without these; the tests never connect to MySQL or OpenAI
+for _var in ("DATABASE_USERNAME", "DATABASE_PASSWORD", "DATABASE_HOSTNAME", "DATABASE_PORT",
+             "DATABASE_NAME", "SSLMODE", "OPENAI_API_KEY", "ORGANIZATION_ID"):
+    os.environ.setdefault(_var, "test")
+os.environ.setdefault("ANSWER_CACHE_EMBEDDER", "hashing")
@@ -0,0 +1,49 @@
+import asyncio
+from services.answer_cache import AnswerCache, HashingEmbedder
+from services.fast_path import extract_product_query
+
+VOCABULARY = {
+    "categories": ["Wired Earbuds", "Wireless Earbuds"],
+    "brands": ["Bose", "Sony"],
+}
+
+
+def constraints(question: str):
+    return extract_product_query(question.lower(), VOCABULARY).constraints()
+
+
+def lookup(cache, question: str):
+    cached, _ = asyncio.run(cache.lookup(question, "", constraints(question)))
+    return cached
+
+
+def cache_with(question: str, answer: str):
+    # A low threshold: the two price bounds below would share an answer on similarity alone
+    cache = AnswerCache(HashingEmbedder(), max_entries=10, ttl_seconds=60, similarity_threshold=0.5)
+    _, vector = asyncio.run(cache.lookup(question, "", constraints(question)))
+    cache.store(question, "", vector, answer, [1], constraints(question))
+    return cache
+
+
+def test_different_price_bounds_do_not_share_an_answer():
+    cache = cache_with("best wireless earbuds under $50", "cheap ones")
+    assert lookup(cache, "best wireless earbuds under $150") is None
+    assert cache.stats()["semantic_hits"] == 0
+
+
+def test_same_price_bound_is_a_semantic_hit():
+    cache = cache_with("best wireless earbuds under $50", "cheap ones")
+    cached = lookup(cache, "which wireless earbuds are best under $50")
+    assert cached is not None and cached.answer == "cheap ones"
+    assert cache.stats()["semantic_hits"] == 1
+
+
+def test_different_brand_is_a_miss():
+    cache = cache_with("sony wireless earbuds under $100", "sony ones")
+    assert lookup(cache, "bose wireless earbuds under $100") is None
+
+
+def test_unknown_constraints_only_match_exactly():
+    cache = cache_with("best wireless earbuds under $50", "cheap ones")
+    assert asyncio.run(cache.lookup("which wireless earbuds are best under $50", "", None))[0] is None
+    assert asyncio.run(cache.lookup("Best wireless earbuds under $50!", "", None))[0] is not None
@@ -0,0 +1,38 @@
+import services.catalog as catalog_module
+from services.catalog import ProductCatalog, refresh_catalog_incremental
+from services.sql_agent import USAGE_COLUMNS
+
+
+def product(product_id: int, name: str, price: float, brand: str = "Sony"):
+    row = {"id": product_id, "category_name": "Wireless Earbuds", "brand_name": brand, "name": name,
+           "price_msrp": price, "full_overview": f"{name} overview", "pros": None, "cons": None}
+    row.update({column: 0 for column in USAGE_COLUMNS})
+    return row
+
+
+def test_incremental_refresh_leaves_the_live_catalog_untouched(monkeypatch):
+    live = ProductCatalog()
+    live.add_rows([product(1, "WF-1000XM5", 299), product(2, "WF-C700N", 119)])
+    new_rows = [product(3, "Elite 10", 249, brand="Jabra")]
+    monkeypatch.setattr(catalog_module, "_select_rows", lambda where="", params=None: new_rows)
+
+    refreshed = refresh_catalog_incremental(live)
+
+    assert refreshed is not live
+    assert len(live) == 2 and len(live.names) == 2 and 3 not in live.row_by_id
+    assert live.brands == ["Sony"] and "jabra" not in live.token_index
+    assert [row["id"] for row in live.search(max_price=300)] == [1, 2]
+    assert len(refreshed) == 3
+    assert [row["id"] for row in refreshed.search(brands=["Jabra"])] == [3]
+    assert [row["id"] for row in refreshed.get_rows([2, 3])] == [2, 3]
+
+
+def test_refresh_replacing_a_row_keeps_the_live_catalog_untouched(monkeypatch):
+    live = ProductCatalog()
+    live.add_rows([product(1, "WF-1000XM5", 299)])
+    monkeypatch.setattr(catalog_module, "_select_rows", lambda where="", params=None: [product(1, "WF-1000XM5", 249)])
+
+    refreshed = refresh_catalog_incremental(live)
+
+    assert live.get_rows([1])[0]["price_msrp"] == 299
+    assert refreshed.get_rows([1])[0]["price_msrp"] == 249
@@ -0,0 +1,26 @@
+import ssl
+import pytest
+from core.database import get_ssl_connect_args, get_async_ssl_connect_args
+
+
+def test_verify_ca_requires_a_ca_bundle():
+    with pytest.raises(ValueError):
+        get_ssl_connect_args("VERIFY_CA")
+    with pytest.raises(ValueError):
+        get_async_ssl_connect_args("VERIFY_CA")
+
+
+def test_verify_ca_checks_the_certificate_against_the_bundle():
+    assert get_ssl_connect_args("VERIFY_CA", "/etc/mysql/ca.pem") == {
+        "ssl_verify_cert": True, "ssl_verify_identity": False, "ssl_ca": "/etc/mysql/ca.pem"}
+
+
+def test_verify_identity_falls_back_to_the_system_store():
+    assert get_ssl_connect_args("VERIFY_IDENTITY") == {"ssl_verify_cert": True, "ssl_verify_identity": True}
+    context = get_async_ssl_connect_args("VERIFY_IDENTITY")["ssl"]
+    assert context.check_hostname and context.verify_mode == ssl.CERT_REQUIRED
+
+
+def test_required_encrypts_without_verifying():
+    assert get_ssl_connect_args("REQUIRED") == {"ssl": {"check_hostname": False}}
+    assert get_async_ssl_connect_args("REQUIRED")["ssl"].verify_mode == ssl.CERT_NONE
@@ -0,0 +1,71 @@
+import pytest
+from services.fast_path import parse_product_query, mentions_search_constraint
+
+VOCABULARY = {
+    "categories": ["Wired Earbuds", "Wired Headphones", "Wireless Earbuds", "Wireless Headphones"],
+    "brands": ["Bose", "Jabra", "Sony"],
+}
+
+
+def test_work_with_a_device_is_not_the_work_usage():
+    query = parse_product_query("wireless earbuds that work with iphone", VOCABULARY)
+    assert query is not None
+    assert query.usage_columns == ["best_for_iphone"]
+
+
+@pytest.mark.parametrize("question", [
+    "wireless earbuds for work",
+    "earbuds I can wear at work",
+    "wireless headphones for work calls",
+])
+def test_work_usage(question):
+    query = parse_product_query(question, VOCABULARY)
+    assert query is not None
+    assert "best_for_work" in query.usage_columns
+
+
+@pytest.mark.parametrize("question", [
+    "What are the best earbuds for the gym?",
+    "what is the cheapest wireless headphones under $100",
+    "which are the top wired earbuds",
+])
+def test_superlative_questions_take_the_fast_path(question):
+    assert parse_product_query(question, VOCABULARY) is not None
+
+
+@pytest.mark.parametrize("question", [
+    "Is the Jabra Elite 7 waterproof?",
+    "are the Sony wireless earbuds good for running",
+    "compare Sony and Bose wireless headphones",
+])
+def test_questions_about_specific_products_go_to_the_agent(question):
+    assert parse_product_query(question, VOCABULARY) is None
+
+
+@pytest.mark.parametrize("question, min_price, max_price", [
+    ("wireless earbuds under $50", None, 50.0),
+    ("wireless earbuds under 50", None, 50.0),
+    ("wireless earbuds under 50 for the gym", None, 50.0),
+    ("wireless headphones over $200", 200.0, None),
+    ("wireless earbuds between 50 and 100", 50.0, 100.0),
+])
+def test_price_bounds(question, min_price, max_price):
+    query = parse_product_query(question, VOCABULARY)
+    assert query is not None
+    assert (query.min_price, query.max_price) == (min_price, max_price)
+
+
+@pytest.mark.parametrize("question", [
+    "wireless earbuds with a battery that lasts at least 8 hours",
+    "wireless headphones that connect up to 10 people",
+    "wireless earbuds with up to 30h of playback",
+    "wired earbuds over 100 db",
+    "wireless earbuds that last between 6 and 8 hours",
+])
+def test_specs_are_not_prices_and_go_to_the_agent(question):
+    assert parse_product_query(question, VOCABULARY) is None
+
+
+def test_a_spec_is_not_a_search_constraint():
+    assert not mentions_search_constraint("do they last at least 8 hours?", VOCABULARY)
+    assert mentions_search_constraint("any of them under 80?", VOCABULARY)
@@ -0,0 +1,36 @@
+import asyncio
+from services.history_cache import ChatHistoryCache, MemoryHistoryBackend
+from services.history_writer import PendingChatEntry
+
+
+def make_cache():
+    return ChatHistoryCache(MemoryHistoryBackend(max_users=10, max_bytes=1 << 20, ttl_seconds=60), depth=5)
+
+
+def turn(number: int):
+    return PendingChatEntry("user", f"question {number}", f"answer {number}", [])
+
+
+def test_summary_stays_current_until_the_next_turn():
+    async def scenario():
+        cache = make_cache()
+        await cache.fill("user", await cache.begin_fill("user"), [turn(1)], complete=True)
+        assert not await cache.summary_is_current("user")
+        await cache.set_summary("user", "likes bass", current=True)
+        assert await cache.summary_is_current("user")
+        await cache.append("user", turn(2))
+        assert not await cache.summary_is_current("user")
+        assert await cache.summary("user") == (True, "likes bass")
+
+    asyncio.run(scenario())
+
+
+def test_fill_started_before_a_write_is_not_stored():
+    async def scenario():
+        cache = make_cache()
+        token = await cache.begin_fill("user")
+        await cache.invalidate("user")
+        await cache.fill("user", token, [turn(1)], complete=True)
+        assert await cache.recent("user", 5) is None
+
+    asyncio.run(scenario())
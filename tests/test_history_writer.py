@@ -0,0 +1,40 @@
+import asyncio
+import services.history_writer as history_writer
+from services.history_writer import ChatHistoryWriter
+
+
+class SlowSession:
+    def __init__(self, written):
+        self.written = written
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def execute(self, statement, rows):
+        await asyncio.sleep(0.05)
+        self.written.extend(rows)
+
+    async def commit(self):
+        pass
+
+
+def test_stop_writes_the_batch_in_flight(monkeypatch):
+    written = []
+    monkeypatch.setattr(history_writer, "get_async_session_factory", lambda: lambda: SlowSession(written))
+    monkeypatch.setattr(history_writer, "get_history_cache", lambda: None)
+
+    async def scenario():
+        writer = ChatHistoryWriter(batch_size=2, flush_interval=60, max_retries=1)
+        for turn in range(4):
+            writer.enqueue("user", f"question {turn}", f"answer {turn}", [])
+        # Let the flusher pick up the first batch and start writing it
+        await asyncio.sleep(0.01)
+        await writer.stop()
+        return writer
+
+    writer = asyncio.run(scenario())
+    assert [row["question"] for row in written] == [f"question {turn}" for turn in range(4)]
+    assert writer.stats() == {"queued": 0, "rows_written": 4, "batches_written": 2, "rows_dropped": 0}
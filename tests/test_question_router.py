@@ -0,0 +1,50 @@
+import pytest
+import services.question_router as question_router
+from services.history_manager import HistoryContext
+from services.history_writer import PendingChatEntry
+from services.question_router import classify_question, GREETING, SMALL_TALK, FOLLOW_UP, PRODUCT_SEARCH
+
+OFFER = "The Sony WF-1000XM5 and the Jabra Elite 7 Pro both fit that budget.\nWant me to compare their battery life?"
+STATEMENT = "The Sony WF-1000XM5 and the Jabra Elite 7 Pro both fit that budget."
+
+
+@pytest.fixture(autouse=True)
+def vocabulary(monkeypatch):
+    monkeypatch.setattr(question_router, "load_vocabulary",
+                        lambda: {"categories": ["Wireless Earbuds"], "brands": ["Jabra", "Sony"]})
+
+
+def history(answer=None, product_ids=(1, 2)):
+    if answer is None:
+        return HistoryContext([])
+    return HistoryContext([PendingChatEntry("user", "wireless earbuds under $300", answer, list(product_ids))])
+
+
+@pytest.mark.parametrize("message", ["ok", "Great!", "yes please", "sure", "sounds good"])
+def test_acknowledging_an_offer_is_a_follow_up(message):
+    assert classify_question(message, history(OFFER)) == FOLLOW_UP
+
+
+def test_acknowledging_an_offer_without_products_is_a_search():
+    assert classify_question("ok", history(OFFER, product_ids=())) == PRODUCT_SEARCH
+
+
+@pytest.mark.parametrize("message", ["ok", "great", "thanks!", "ok cool"])
+def test_acknowledging_a_statement_is_small_talk(message):
+    assert classify_question(message, history(STATEMENT)) == SMALL_TALK
+
+
+def test_thanks_after_an_offer_is_small_talk():
+    assert classify_question("no thanks", history(OFFER)) == SMALL_TALK
+
+
+def test_greeting():
+    assert classify_question("Hello there", history()) == GREETING
+
+
+def test_reference_to_previous_products_is_a_follow_up():
+    assert classify_question("Are they good for calls?", history(STATEMENT)) == FOLLOW_UP
+
+
+def test_brand_starts_a_new_search():
+    assert classify_question("what about Jabra ones?", history(STATEMENT)) == PRODUCT_SEARCH